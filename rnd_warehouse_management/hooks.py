@@ -71,6 +71,10 @@ doc_events = {
     },
     "Quality Inspection": {
         "on_submit": "rnd_warehouse_management.rnd_warehouse_management.qi_automation.create_non_conformity_on_qi_failure"
+    },
+    "IoT Sensor Reading": {
+        "before_insert": "rnd_warehouse_management.rnd_warehouse_management.iot_pipeline.on_reading_before_insert",
+        "after_insert": "rnd_warehouse_management.rnd_warehouse_management.iot_pipeline.on_reading_insert"
     }
 }
 
@@ -88,8 +92,18 @@ override_whitelisted_methods = {
 
 scheduler_events = {
     "cron": {
+        "* * * * *": [
+            "rnd_warehouse_management.rnd_warehouse_management.iot_pipeline.publish_pending_dashboard_deltas",
+            "rnd_warehouse_management.rnd_warehouse_management.iot_spool.drain_spool"
+        ],
         "*/5 * * * *": [
-            "rnd_warehouse_management.rnd_warehouse_management.warehouse_monitoring.run_temperature_monitoring"
+            "rnd_warehouse_management.rnd_warehouse_management.warehouse_monitoring.run_temperature_monitoring",
+            "rnd_warehouse_management.rnd_warehouse_management.iot_pipeline.refresh_health_snapshot_status",
+            "rnd_warehouse_management.rnd_warehouse_management.iot_compression.flush_held_readings"
+        ],
+        "*/15 * * * *": [
+            "rnd_warehouse_management.rnd_warehouse_management.iot_lateness.reconcile_late_rollups",
+            "rnd_warehouse_management.rnd_warehouse_management.iot_correlation.run_zone_correlation"
         ]
     },
     "hourly": [
@@ -98,6 +112,8 @@ scheduler_events = {
     "daily": [
         "rnd_warehouse_management.rnd_warehouse_management.tasks.cleanup_expired_signatures",
         "rnd_warehouse_management.rnd_warehouse_management.tasks.generate_warehouse_reports",
+        "rnd_warehouse_management.rnd_warehouse_management.iot_archive.archive_old_readings",
+        "rnd_warehouse_management.rnd_warehouse_management.iot_uptime.purge_old_gaps",
     ]
 }
 
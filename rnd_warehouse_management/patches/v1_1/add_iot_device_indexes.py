@@ -0,0 +1,27 @@
+import frappe
+
+# (doctype, columns) - per-device queries filter on sensor_id / rpi_id first.
+# The app's own doctypes (IoT Reading Rollup, Sensor Health Snapshot) add
+# theirs in on_doctype_update, so they exist however the table was created.
+IOT_DEVICE_INDEXES = [
+	("IoT Sensor Reading", ["sensor_id", "creation"]),
+	("IoT Sensor Reading", ["rpi_id", "creation"]),
+	("IoT Sensor Reading", ["sensor_type", "creation"]),
+]
+
+def execute():
+	"""Add composite indexes for per-device (rpi_id / sensor_id) IoT queries"""
+	for doctype in ("IoT Device Sensor", "IoT Device"):
+		frappe.reload_doc("rnd_warehouse_management", "doctype", frappe.scrub(doctype))
+
+	for doctype, columns in IOT_DEVICE_INDEXES:
+		if not frappe.db.table_exists(doctype):
+			continue
+		# IoT Sensor Reading belongs to the sensor app; its columns may vary
+		if not all(frappe.db.has_column(doctype, column) for column in columns):
+			frappe.log(f"Skipping index on {doctype} {columns}: missing column")
+			continue
+		frappe.db.add_index(doctype, columns)
+		frappe.log(f"Index on {doctype} ({', '.join(columns)}) ready")
+
+	frappe.db.commit()
@@ -0,0 +1,47 @@
+import frappe
+from frappe.utils import now_datetime, add_to_date
+
+REBUILD_QUEUE = "long"
+
+def execute():
+	"""Queue the rebuild of IoT Reading Rollup from the readings stored before
+	the upgrade; the dashboard totals, aggregations and drift checks read only
+	the rollups. Hours behind the lateness horizon are rebuilt by one background
+	job per iot_rebuild chunk. Later hours are still being added to by ingest,
+	so they are deferred to the late data reconciliation, which rebuilds them
+	once they pass the horizon. Types under swinging-door compression are left
+	to ingest, as in iot_rebuild."""
+	from rnd_warehouse_management.rnd_warehouse_management.iot_rebuild import (
+		plan_chunks, get_sensor_types, get_history_start, get_rollup_boundary)
+	from rnd_warehouse_management.rnd_warehouse_management.iot_lateness import defer_dirty_hours
+	from rnd_warehouse_management.rnd_warehouse_management.iot_compression import is_compressed
+	from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import READING_TIME_FIELD
+
+	frappe.reload_doc("rnd_warehouse_management", "doctype", "iot_reading_rollup")
+	if not frappe.db.table_exists("IoT Sensor Reading"):
+		return
+	if not frappe.db.has_column("IoT Sensor Reading", READING_TIME_FIELD):
+		frappe.log(f"Skipping rollup seed: IoT Sensor Reading lacks {READING_TIME_FIELD}")
+		return
+
+	sensor_types = get_sensor_types()
+	start = get_history_start()
+	if not sensor_types or not start:
+		return
+
+	boundary = get_rollup_boundary()
+	chunks = plan_chunks(["rollups"], sensor_types, start, boundary) if start < boundary else []
+	for chunk in chunks:
+		frappe.enqueue("rnd_warehouse_management.rnd_warehouse_management.iot_rebuild.run_chunk",
+			queue=REBUILD_QUEUE, enqueue_after_commit=True, chunk=chunk)
+
+	hours = []
+	hour = max(boundary, start.replace(minute=0, second=0, microsecond=0))
+	now = now_datetime()
+	while hour < now:
+		hours.extend({"sensor_type": t, READING_TIME_FIELD: hour} for t in sensor_types if not is_compressed(t))
+		hour = add_to_date(hour, hours=1)
+	defer_dirty_hours(hours)
+
+	frappe.db.commit()
+	frappe.log(f"Queued {len(chunks)} rollup rebuild chunks; {len(hours)} recent hours deferred")
@@ -0,0 +1,74 @@
+import frappe
+from frappe.utils import now_datetime, time_diff_in_seconds
+
+INSERT_CHUNK = 500
+
+def execute():
+	"""Seed Sensor Health Snapshot from existing IoT Sensor Reading rows, so
+	sensors that went offline before the upgrade still show up in the health
+	check and the dashboard totals include the whole history"""
+	from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+		HEALTH_SNAPSHOT_DOCTYPE, _SNAPSHOT_COLUMNS, _health_status, snapshot_name)
+
+	frappe.reload_doc("rnd_warehouse_management", "doctype", "sensor_health_snapshot")
+	if not frappe.db.table_exists("IoT Sensor Reading"):
+		return
+	if not all(frappe.db.has_column("IoT Sensor Reading", c) for c in ("sensor_id", "device_time", "temperature")):
+		frappe.log("Skipping health snapshot seed: IoT Sensor Reading lacks sensor_id/device_time/temperature")
+		return
+
+	# Totals per sensor, then the hour and day counters from the rows of the
+	# last two days each sensor reported (index on sensor_id, device_time)
+	rows = frappe.db.sql("""
+		SELECT g.sensor_type, g.sensor_id, g.first_seen, g.last_seen, g.total,
+			g.hour_bucket, g.day_bucket,
+			SUM(r.device_time >= g.hour_bucket) as hour_count,
+			SUM(r.device_time >= g.hour_bucket - INTERVAL 1 HOUR AND r.device_time < g.hour_bucket) as prev_hour_count,
+			SUM(r.device_time >= g.day_bucket) as day_count,
+			SUM(r.device_time < g.day_bucket) as prev_day_count,
+			SUBSTRING_INDEX(GROUP_CONCAT(r.temperature ORDER BY r.device_time DESC SEPARATOR '|'), '|', 1) as last_value
+		FROM (
+			SELECT sensor_type, IFNULL(sensor_id, '') as sensor_id,
+				MIN(device_time) as first_seen, MAX(device_time) as last_seen, COUNT(*) as total,
+				TIMESTAMP(DATE(MAX(device_time))) + INTERVAL HOUR(MAX(device_time)) HOUR as hour_bucket,
+				TIMESTAMP(DATE(MAX(device_time))) as day_bucket
+			FROM `tabIoT Sensor Reading`
+			WHERE sensor_type IS NOT NULL AND device_time IS NOT NULL
+			GROUP BY sensor_type, IFNULL(sensor_id, '')
+		) g
+		JOIN `tabIoT Sensor Reading` r
+			ON r.sensor_type = g.sensor_type AND IFNULL(r.sensor_id, '') = g.sensor_id
+			AND r.device_time >= g.day_bucket - INTERVAL 1 DAY
+		GROUP BY g.sensor_type, g.sensor_id, g.first_seen, g.last_seen, g.total, g.hour_bucket, g.day_bucket
+	""", as_dict=True)
+	if not rows:
+		return
+
+	now = now_datetime()
+	user = frappe.session.user
+	values = []
+	for r in rows:
+		values.append((
+			snapshot_name(r.sensor_type, r.sensor_id), now, now, user, user,
+			r.sensor_type, r.sensor_id or None,
+			_health_status(time_diff_in_seconds(now, r.last_seen)),
+			r.first_seen, r.last_seen, float(r.last_value) if r.last_value not in (None, "") else None,
+			r.hour_bucket, int(r.hour_count or 0), int(r.prev_hour_count or 0),
+			r.day_bucket, int(r.day_count or 0), int(r.prev_day_count or 0), int(r.total)
+		))
+
+	# The readings table already holds the rows ingested since the upgrade,
+	# so existing snapshots are replaced rather than added to
+	columns = ", ".join(_SNAPSHOT_COLUMNS)
+	update = ", ".join(f"{c} = VALUES({c})" for c in _SNAPSHOT_COLUMNS if c not in ("name", "creation", "owner"))
+	row_placeholder = "(" + ", ".join(["%s"] * len(_SNAPSHOT_COLUMNS)) + ")"
+	for i in range(0, len(values), INSERT_CHUNK):
+		chunk = values[i:i + INSERT_CHUNK]
+		frappe.db.sql(
+			f"INSERT INTO `tab{HEALTH_SNAPSHOT_DOCTYPE}` ({columns}) VALUES "
+			+ ", ".join([row_placeholder] * len(chunk))
+			+ f" ON DUPLICATE KEY UPDATE {update}",
+			[v for row in chunk for v in row]
+		)
+		frappe.db.commit()
+	frappe.log(f"Seeded {len(values)} sensor health snapshots")
@@ -4,7 +4,7 @@
 Batch genealogy, CoA generation, hold/release workflow, traceability reports."""
 import frappe
 from frappe import _
-from frappe.utils import now_datetime, nowdate, getdate
+from frappe.utils import now_datetime, nowdate, getdate, get_datetime, add_days
 import json
 
 
@@ -292,4 +292,27 @@ def get_full_traceability(batch_id):
     }
 
 
+@frappe.whitelist()
+def get_batch_sensor_readings(batch_id, sensor_type=None, sensor_id=None):
+    """Sensor readings recorded on the batch's manufacturing day.
+    Reads through the IoT archive, so batches older than the hot window
+    are served from compressed segments transparently."""
+    if not frappe.db.exists("Batch", batch_id):
+        frappe.throw(_("Batch {0} not found").format(batch_id))
+
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import get_readings
+
+    batch = frappe.db.get_value("Batch", batch_id, ["manufacturing_date", "creation"], as_dict=True)
+    day = getdate(batch.manufacturing_date or batch.creation)
+    start = get_datetime(day)
+    readings = get_readings(sensor_type, start, add_days(start, 1), sensor_id)
+
+    return {
+        "batch_id": batch_id,
+        "date": str(day),
+        "reading_count": len(readings),
+        "readings": readings
+    }
+
+
 print("batch_traceability.py loaded")
@@ -0,0 +1,73 @@
+# Copyright (c) 2026, Prosolmex and contributors
+# For license information, please see license.txt
+
+import json
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+# Maintained by iot_pipeline on ingest, never from the form
+SEQUENCE_FIELDS = ("next_expected_seq", "pending_ranges", "received_total", "duplicate_total")
+
+
+class IoTDevice(Document):
+    """Raspberry Pi gateway that uploads sensor readings.
+    Holds the (rpi_id, seq) high-water mark used to accept replayed
+    buffer flushes idempotently; see iot_pipeline.claim_sequences.
+    The sensors table maps each sensor_id to its warehouse and zone."""
+
+    def validate(self):
+        self.keep_sequence_state()
+        self.validate_sensors()
+
+    def keep_sequence_state(self):
+        """A form saved with stale sequence values must not move the
+        high-water mark back, so reload them under the row lock."""
+        if not self.is_new():
+            current = frappe.db.get_value(self.doctype, self.name, SEQUENCE_FIELDS,
+                                          as_dict=True, for_update=True)
+            if current:
+                self.update(current)
+        if (self.next_expected_seq or 0) < 1:
+            self.next_expected_seq = 1
+        if self.pending_ranges:
+            try:
+                ranges = json.loads(self.pending_ranges)
+            except ValueError:
+                ranges = None
+            if not isinstance(ranges, list):
+                frappe.throw(_("Pending Ranges must be a JSON list of [start, end] pairs"))
+
+    def validate_sensors(self):
+        seen = set()
+        for row in self.sensors:
+            if row.sensor_id in seen:
+                frappe.throw(_("Row {0}: Sensor ID {1} is listed twice").format(row.idx, row.sensor_id))
+            seen.add(row.sensor_id)
+            if not row.warehouse and self.warehouse:
+                row.warehouse = self.warehouse
+                row.zone = row.zone or frappe.db.get_value("Warehouse", self.warehouse, "custom_zone_type")
+
+        if not seen:
+            return
+        other = frappe.db.get_value("IoT Device Sensor", {
+            "parenttype": self.doctype,
+            "parent": ["!=", self.name],
+            "sensor_id": ["in", list(seen)],
+        }, ["sensor_id", "parent"], as_dict=True)
+        if other:
+            frappe.throw(_("Sensor ID {0} is already registered on IoT Device {1}").format(
+                other.sensor_id, other.parent))
+
+    def on_update(self):
+        clear_device_registry_cache()
+
+    def on_trash(self):
+        clear_device_registry_cache()
+
+
+def clear_device_registry_cache():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import DEVICE_REGISTRY_CACHE_KEY
+
+    frappe.cache().delete_value(DEVICE_REGISTRY_CACHE_KEY)
@@ -0,0 +1,50 @@
+# Copyright (c) 2026, Prosolmex and Contributors
+# See license.txt
+
+import json
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+    claim_sequences, get_sensor_ids, resolve_sensor_filter)
+from rnd_warehouse_management.rnd_warehouse_management.doctype.iot_device.iot_device import (
+    clear_device_registry_cache)
+
+
+class TestIoTDevice(FrappeTestCase):
+    def test_claim_sequences_is_idempotent(self):
+        rpi_id = "_Test RPi Seq"
+        frappe.db.delete("IoT Device", {"rpi_id": rpi_id})
+
+        first = claim_sequences(rpi_id, [1, 2, 3, 5])
+        self.assertEqual(first["fresh"], {1, 2, 3, 5})
+        retry = claim_sequences(rpi_id, [2, 3, 4, 5, 6])
+        self.assertEqual(retry["fresh"], {4, 6})
+
+        doc = frappe.get_doc("IoT Device", rpi_id)
+        self.assertEqual(doc.next_expected_seq, 7)
+        self.assertEqual(json.loads(doc.pending_ranges or "[]"), [])
+        self.assertEqual(doc.duplicate_total, 3)
+        frappe.db.rollback()
+
+    def test_registry_maps_sensors(self):
+        rpi_id = "_Test RPi Registry"
+        frappe.db.delete("IoT Device", {"rpi_id": rpi_id})
+        frappe.db.delete("IoT Device Sensor", {"parent": rpi_id})
+        frappe.get_doc({
+            "doctype": "IoT Device",
+            "rpi_id": rpi_id,
+            "sensors": [
+                {"sensor_id": "_TEST-REG-01", "sensor_type": "DHT22", "zone": "_Test Zone A"},
+                {"sensor_id": "_TEST-REG-02", "sensor_type": "DS18B20", "zone": "_Test Zone B"},
+            ],
+        }).insert()
+
+        self.assertEqual(get_sensor_ids(rpi_id=rpi_id), ["_TEST-REG-01", "_TEST-REG-02"])
+        self.assertEqual(get_sensor_ids(rpi_id=rpi_id, zone="_Test Zone B"), ["_TEST-REG-02"])
+        self.assertEqual(resolve_sensor_filter("_TEST-REG-01", rpi_id), ["_TEST-REG-01"])
+        self.assertEqual(resolve_sensor_filter("_TEST-OTHER", rpi_id), [])
+        self.assertIsNone(resolve_sensor_filter())
+        frappe.db.rollback()
+        clear_device_registry_cache()
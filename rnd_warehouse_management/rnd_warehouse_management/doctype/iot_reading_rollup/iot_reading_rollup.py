@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Prosolmex and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class IoTReadingRollup(Document):
+    """Pre-aggregated IoT readings per sensor, metric and time bucket.
+    Rows are written by iot_rollups with INSERT ... ON DUPLICATE KEY UPDATE."""
+
+
+def on_doctype_update():
+    frappe.db.add_index("IoT Reading Rollup", ["sensor_type", "resolution", "metric", "bucket_start"])
+    frappe.db.add_index("IoT Reading Rollup", ["sensor_id", "resolution", "metric", "bucket_start"])
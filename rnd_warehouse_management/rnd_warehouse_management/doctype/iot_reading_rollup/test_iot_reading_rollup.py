@@ -0,0 +1,27 @@
+# Copyright (c) 2026, Prosolmex and Contributors
+# See license.txt
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import now_datetime
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+    update_rollups, floor_to_minutes, rollup_name)
+
+
+class TestIoTReadingRollup(FrappeTestCase):
+    def test_rollup_upsert_accumulates(self):
+        ts = now_datetime()
+        rows = [
+            {"sensor_type": "_Test Sensor", "sensor_id": "TEST-01", "temperature": 20.0, "creation": ts},
+            {"sensor_type": "_Test Sensor", "sensor_id": "TEST-01", "temperature": 24.0, "creation": ts},
+        ]
+        update_rollups(rows)
+        update_rollups(rows[:1])
+        name = rollup_name(1, "_Test Sensor", "TEST-01", "temperature", floor_to_minutes(ts, 1))
+        doc = frappe.get_doc("IoT Reading Rollup", name)
+        self.assertEqual(doc.reading_count, 3)
+        self.assertAlmostEqual(doc.avg_value, 64.0 / 3, places=6)
+        self.assertEqual(doc.min_value, 20.0)
+        self.assertEqual(doc.max_value, 24.0)
+        self.assertAlmostEqual(doc.value_sum_sq, 400.0 * 2 + 576.0, places=6)
@@ -0,0 +1,52 @@
+# Copyright (c) 2026, Prosolmex and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class IoTSensorCalibration(Document):
+    """Calibration coefficients of one sensor_id from effective_from on.
+    iot_calibration applies them to raw_adc / resistance readings on ingest
+    and, when backfill_on_save is set, re-applies them to stored readings."""
+
+    def validate(self):
+        if not self.sensor_type:
+            from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_device_registry
+            registered = get_device_registry()["by_sensor"].get(self.sensor_id) or {}
+            self.sensor_type = registered.get("sensor_type")
+        if self.method == "steinhart_hart":
+            # C may be 0: the simplified form used for beta-parameter thermistors
+            if not (self.coeff_a and self.coeff_b):
+                frappe.throw(_("Steinhart-Hart needs non-zero A and B coefficients"))
+            if self.input_field not in ("raw_adc", "resistance"):
+                frappe.throw(_("Steinhart-Hart converts raw_adc or resistance readings"))
+            if self.input_field == "raw_adc" and not (self.series_resistor and self.adc_max):
+                frappe.throw(_("A raw_adc input needs the series resistor and ADC full scale"))
+        elif self.method == "linear" and not self.gain:
+            frappe.throw(_("A linear calibration needs a non-zero gain"))
+        if frappe.db.exists(self.doctype, {"sensor_id": self.sensor_id, "effective_from": self.effective_from,
+                                           "name": ["!=", self.name]}):
+            frappe.throw(_("Sensor {0} already has a calibration effective from {1}").format(
+                self.sensor_id, self.effective_from))
+
+    def on_update(self):
+        from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import enqueue_backfill
+
+        clear_calibration_cache()
+        if self.enabled and self.backfill_on_save:
+            enqueue_backfill(self.name)
+
+    def on_trash(self):
+        clear_calibration_cache()
+
+
+def clear_calibration_cache():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import CALIBRATION_CACHE_KEY
+
+    frappe.cache().delete_value(CALIBRATION_CACHE_KEY)
+
+
+def on_doctype_update():
+    frappe.db.add_index("IoT Sensor Calibration", ["sensor_id", "effective_from"])
@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Prosolmex and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class IoTSensorGap(Document):
+    """An interval in which a sensor missed its expected readings.
+    Written by iot_uptime on ingest; merged into uptime reports."""
+
+
+def on_doctype_update():
+    frappe.db.add_index("IoT Sensor Gap", ["sensor_id", "gap_end"])
+    frappe.db.add_index("IoT Sensor Gap", ["sensor_type", "gap_end"])
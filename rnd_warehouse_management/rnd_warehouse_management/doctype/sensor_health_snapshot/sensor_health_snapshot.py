@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Prosolmex and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class SensorHealthSnapshot(Document):
+    """Current health of one sensor (sensor_type + sensor_id).
+    Maintained by iot_pipeline on ingest; read by the health dashboards."""
+
+
+def on_doctype_update():
+    frappe.db.add_index("Sensor Health Snapshot", ["sensor_id", "sensor_type"])
@@ -0,0 +1,436 @@
+"""Phase 6.7: IoT Reading Archive
+Tiered retention for IoT Sensor Reading. Raw rows older than the hot window
+are moved into compressed per-sensor, per-day segment files under the site's
+private files; get_readings() serves archive and live rows transparently.
+Days and the segments' time axis are the reading time (device_time), so
+buffered readings that arrive late are archived with the day they belong to."""
+import frappe
+from frappe.utils import now_datetime, add_to_date, get_datetime, getdate
+import hashlib
+import json
+import os
+import re
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import READING_TIME_FIELD, reading_time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+ARCHIVE_DIR = "iot_archive"
+DEFAULT_RETENTION_DAYS = 30
+ARCHIVE_MAX_DAYS_PER_RUN = 7
+ARCHIVE_DELETE_CHUNK = 1000
+
+# Values are stored as fixed-point integers so deltas round-trip exactly
+ARCHIVE_VALUE_SCALE = 10000
+
+SEGMENT_MAGIC = b"IOTA"
+SEGMENT_VERSION = 1
+CODEC_ZLIB = 0
+CODEC_ZSTD = 1
+
+_NUMERIC_FIELDTYPES = ("Float", "Int", "Currency", "Percent")
+_TEXT_FIELDTYPES = ("Data", "Select", "Link", "Small Text")
+_EPOCH = datetime(1970, 1, 1)
+
+
+def get_retention_days():
+    """Days of raw readings kept in the live table (site_config: iot_raw_retention_days)."""
+    return int(frappe.conf.get("iot_raw_retention_days") or DEFAULT_RETENTION_DAYS)
+
+
+def get_hot_cutoff():
+    """Start of the hot window; everything before it lives in the archive."""
+    day = getdate(add_to_date(now_datetime(), days=-get_retention_days()))
+    return datetime(day.year, day.month, day.day)
+
+
+# ============================================================================
+# SEGMENT ENCODING - delta + zigzag varints, then zlib/zstd
+# ============================================================================
+
+def _zigzag(n):
+    return (n << 1) ^ (n >> 63)
+
+
+def _unzigzag(n):
+    return (n >> 1) ^ -(n & 1)
+
+
+def _encode_varints(numbers, out):
+    for n in numbers:
+        n = _zigzag(n)
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+
+
+def _decode_varints(buf, pos, count):
+    numbers = []
+    for _i in range(count):
+        shift = 0
+        n = 0
+        while True:
+            b = buf[pos]
+            pos += 1
+            n |= (b & 0x7F) << shift
+            if b < 0x80:
+                break
+            shift += 7
+        numbers.append(_unzigzag(n))
+    return numbers, pos
+
+
+def _deltas(numbers):
+    prev = 0
+    out = []
+    for n in numbers:
+        out.append(n - prev)
+        prev = n
+    return out
+
+
+def _undeltas(deltas):
+    total = 0
+    out = []
+    for d in deltas:
+        total += d
+        out.append(total)
+    return out
+
+
+def _to_micros(dt):
+    delta = get_datetime(dt) - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def _compress(payload):
+    if zstandard is not None:
+        return CODEC_ZSTD, zstandard.ZstdCompressor(level=9).compress(payload)
+    return CODEC_ZLIB, zlib.compress(payload, 9)
+
+
+def _decompress(codec, data):
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            frappe.throw("Archive segment is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def encode_segment(sensor_type, sensor_id, rows, numeric_fields, text_fields):
+    """Encode rows (sorted by reading time) into segment bytes.
+    Timestamps are microsecond deltas; each numeric column is a presence
+    bitmap plus deltas of its fixed-point values."""
+    count = len(rows)
+    header = {
+        "sensor_type": sensor_type,
+        "sensor_id": sensor_id,
+        "count": count,
+        "scale": ARCHIVE_VALUE_SCALE,
+        "numeric_fields": numeric_fields,
+        "text": {f: [r.get(f) for r in rows] for f in text_fields}
+    }
+
+    body = bytearray()
+    stamps = [_to_micros(reading_time(r)) for r in rows]
+    _encode_varints(_deltas(stamps), body)
+
+    for field in numeric_fields:
+        bitmap = bytearray((count + 7) // 8)
+        present = []
+        for i, r in enumerate(rows):
+            value = r.get(field)
+            if value is None:
+                continue
+            bitmap[i // 8] |= 1 << (i % 8)
+            present.append(int(round(float(value) * ARCHIVE_VALUE_SCALE)))
+        body += bitmap
+        _encode_varints(_deltas(present), body)
+
+    header_bytes = json.dumps(header, default=str).encode()
+    payload = struct.pack("<I", len(header_bytes)) + header_bytes + bytes(body)
+    codec, compressed = _compress(payload)
+    return SEGMENT_MAGIC + struct.pack("<BB", SEGMENT_VERSION, codec) + compressed
+
+
+def decode_segment(data):
+    """Decode segment bytes into (header, rows)."""
+    if data[:4] != SEGMENT_MAGIC:
+        frappe.throw("Not an IoT archive segment")
+    _version, codec = struct.unpack_from("<BB", data, 4)
+    payload = memoryview(_decompress(codec, data[6:]))
+
+    (header_len,) = struct.unpack_from("<I", payload, 0)
+    header = json.loads(bytes(payload[4:4 + header_len]))
+    pos = 4 + header_len
+    count = header["count"]
+    scale = header["scale"]
+
+    deltas, pos = _decode_varints(payload, pos, count)
+    # Only the reading time is kept; it also stands in for creation
+    rows = []
+    for us in _undeltas(deltas):
+        ts = _EPOCH + timedelta(microseconds=us)
+        rows.append({
+            READING_TIME_FIELD: ts,
+            "creation": ts,
+            "sensor_type": header["sensor_type"],
+            "sensor_id": header["sensor_id"]
+        })
+
+    bitmap_len = (count + 7) // 8
+    for field in header["numeric_fields"]:
+        bitmap = payload[pos:pos + bitmap_len]
+        pos += bitmap_len
+        indexes = [i for i in range(count) if bitmap[i // 8] & (1 << (i % 8))]
+        deltas, pos = _decode_varints(payload, pos, len(indexes))
+        values = _undeltas(deltas)
+        for row in rows:
+            row[field] = None
+        for i, v in zip(indexes, values):
+            rows[i][field] = v / scale
+
+    for field, values in header["text"].items():
+        for row, v in zip(rows, values):
+            row[field] = v
+
+    return header, rows
+
+
+# ============================================================================
+# SEGMENT FILES
+# ============================================================================
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", text or "none")
+
+
+def _day_dir(day):
+    return frappe.get_site_path("private", "files", ARCHIVE_DIR, getdate(day).isoformat())
+
+
+def _segment_path(day, sensor_type, sensor_id):
+    # Short hash keeps names unique when slugging collapses characters
+    digest = hashlib.md5(f"{sensor_type}|{sensor_id or ''}".encode()).hexdigest()[:8]
+    filename = f"{_slug(sensor_type)}__{_slug(sensor_id)}__{digest}.seg"
+    return os.path.join(_day_dir(day), filename)
+
+
+def read_segment_file(path):
+    with open(path, "rb") as f:
+        return decode_segment(f.read())
+
+
+def _write_segment_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _archive_fields():
+    """Numeric and text columns of IoT Sensor Reading worth keeping."""
+    meta = frappe.get_meta("IoT Sensor Reading")
+    numeric = [df.fieldname for df in meta.fields if df.fieldtype in _NUMERIC_FIELDTYPES]
+    text = [df.fieldname for df in meta.fields
+            if df.fieldtype in _TEXT_FIELDTYPES and df.fieldname not in ("sensor_type", "sensor_id")]
+    return numeric, text
+
+
+# ============================================================================
+# ARCHIVER (daily scheduler job)
+# ============================================================================
+
+def archive_old_readings(retention_days=None, max_days=ARCHIVE_MAX_DAYS_PER_RUN):
+    """Move raw readings older than the hot window into segment files.
+    Works through at most max_days calendar days per run, oldest first."""
+    if not frappe.db.exists("DocType", "IoT Sensor Reading"):
+        return {"archived_days": 0}
+
+    if retention_days:
+        day = getdate(add_to_date(now_datetime(), days=-int(retention_days)))
+        cutoff = datetime(day.year, day.month, day.day)
+    else:
+        cutoff = get_hot_cutoff()
+
+    oldest = frappe.db.sql(f"SELECT MIN(`{READING_TIME_FIELD}`) FROM `tabIoT Sensor Reading`")[0][0]
+    if not oldest or get_datetime(oldest) >= cutoff:
+        return {"archived_days": 0, "cutoff": str(cutoff)}
+
+    day = getdate(oldest)
+    archived = []
+    while datetime(day.year, day.month, day.day) < cutoff and len(archived) < int(max_days):
+        try:
+            archived.append({"day": str(day), "rows": archive_day(day)})
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), f"IoT archive failed for {day}")
+            break
+        day = day + timedelta(days=1)
+
+    return {"archived_days": len(archived), "cutoff": str(cutoff), "days": archived}
+
+
+def archive_day(day):
+    """Archive every sensor's readings for one calendar day, then delete
+    them from the live table. Segments are written (and fsynced) before the
+    delete, so a crash in between only causes a harmless re-merge."""
+    day = getdate(day)
+    start = datetime(day.year, day.month, day.day)
+    end = start + timedelta(days=1)
+    numeric_fields, text_fields = _archive_fields()
+    columns = ", ".join(f"`{f}`" for f in ["name", "creation", READING_TIME_FIELD, "sensor_type", "sensor_id"]
+                        + numeric_fields + text_fields)
+
+    sensors = frappe.db.sql(f"""
+        SELECT DISTINCT sensor_type, sensor_id FROM `tabIoT Sensor Reading`
+        WHERE `{READING_TIME_FIELD}` >= %s AND `{READING_TIME_FIELD}` < %s
+    """, (start, end), as_dict=True)
+
+    total = 0
+    for s in sensors:
+        rows = frappe.db.sql(f"""
+            SELECT {columns} FROM `tabIoT Sensor Reading`
+            WHERE `{READING_TIME_FIELD}` >= %(start)s AND `{READING_TIME_FIELD}` < %(end)s
+            AND sensor_type <=> %(sensor_type)s AND sensor_id <=> %(sensor_id)s
+            ORDER BY `{READING_TIME_FIELD}`
+        """, {"start": start, "end": end, "sensor_type": s.sensor_type, "sensor_id": s.sensor_id},
+            as_dict=True)
+        if not rows:
+            continue
+
+        path = _segment_path(day, s.sensor_type, s.sensor_id)
+        merged = rows
+        if os.path.exists(path):
+            _header, existing = read_segment_file(path)
+            merged = _merge_rows(existing, rows, numeric_fields)
+        _write_segment_file(path, encode_segment(s.sensor_type, s.sensor_id, merged, numeric_fields, text_fields))
+
+        names = [r.name for r in rows]
+        for i in range(0, len(names), ARCHIVE_DELETE_CHUNK):
+            frappe.db.delete("IoT Sensor Reading", {"name": ["in", names[i:i + ARCHIVE_DELETE_CHUNK]]})
+        frappe.db.commit()
+        total += len(rows)
+
+    return total
+
+
+def _merge_rows(existing, new_rows, numeric_fields):
+    """Merge freshly archived rows into an existing segment, dropping exact
+    duplicates left by an interrupted earlier run."""
+    seen = set()
+    merged = []
+    for r in existing + list(new_rows):
+        key = (reading_time(r),) + tuple(
+            None if r.get(f) is None else round(float(r.get(f)) * ARCHIVE_VALUE_SCALE) for f in numeric_fields)
+        if key in seen:
+            continue
+        seen.add(key)
+        merged.append(r)
+    merged.sort(key=reading_time)
+    return merged
+
+
+# ============================================================================
+# READ API
+# ============================================================================
+
+def get_archived_readings(sensor_type=None, start=None, end=None, sensor_id=None):
+    """Readings from archive segments in [start, end), sorted by reading time."""
+    start = get_datetime(start)
+    end = get_datetime(end) if end else get_hot_cutoff()
+    readings = []
+
+    day = getdate(start)
+    while datetime(day.year, day.month, day.day) < end:
+        for path in _segment_paths_for_day(day, sensor_type, sensor_id):
+            _header, rows = read_segment_file(path)
+            if sensor_type and rows and rows[0]["sensor_type"] != sensor_type:
+                continue
+            if sensor_id and rows and rows[0]["sensor_id"] != sensor_id:
+                continue
+            readings.extend(r for r in rows if start <= r[READING_TIME_FIELD] < end)
+        day = day + timedelta(days=1)
+
+    readings.sort(key=lambda r: r[READING_TIME_FIELD])
+    return readings
+
+
+def _segment_paths_for_day(day, sensor_type=None, sensor_id=None):
+    if sensor_type and sensor_id:
+        path = _segment_path(day, sensor_type, sensor_id)
+        return [path] if os.path.exists(path) else []
+
+    folder = _day_dir(day)
+    if not os.path.isdir(folder):
+        return []
+    prefix = f"{_slug(sensor_type)}__" if sensor_type else ""
+    return sorted(os.path.join(folder, f) for f in os.listdir(folder)
+                  if f.endswith(".seg") and f.startswith(prefix))
+
+
+@frappe.whitelist()
+def get_readings(sensor_type=None, start=None, end=None, sensor_id=None):
+    """Raw readings in [start, end) regardless of tier: the archived part is
+    decoded from segment files, the hot part is read from the live table."""
+    end = get_datetime(end) if end else now_datetime()
+    start = get_datetime(start) if start else add_to_date(end, hours=-24)
+    cutoff = get_hot_cutoff()
+    readings = []
+
+    if start < cutoff:
+        readings.extend(get_archived_readings(sensor_type, start, min(end, cutoff), sensor_id))
+
+    if end > cutoff:
+        numeric_fields, text_fields = _archive_fields()
+        columns = ", ".join(f"`{f}`" for f in ["creation", READING_TIME_FIELD, "sensor_type", "sensor_id"]
+                            + numeric_fields + text_fields)
+        conditions = [f"`{READING_TIME_FIELD}` >= %(start)s", f"`{READING_TIME_FIELD}` < %(end)s"]
+        if sensor_type:
+            conditions.append("sensor_type = %(sensor_type)s")
+        if sensor_id:
+            conditions.append("sensor_id = %(sensor_id)s")
+        readings.extend(frappe.db.sql(f"""
+            SELECT {columns} FROM `tabIoT Sensor Reading`
+            WHERE {" AND ".join(conditions)}
+            ORDER BY `{READING_TIME_FIELD}`
+        """, {"start": max(start, cutoff), "end": end, "sensor_type": sensor_type, "sensor_id": sensor_id},
+            as_dict=True))
+
+    return readings
+
+
+@frappe.whitelist()
+def get_archive_status():
+    """Summary of the archive tier for monitoring."""
+    root = frappe.get_site_path("private", "files", ARCHIVE_DIR)
+    days = sorted(d for d in os.listdir(root)) if os.path.isdir(root) else []
+    size = 0
+    segments = 0
+    for d in days:
+        for f in os.listdir(os.path.join(root, d)):
+            if f.endswith(".seg"):
+                segments += 1
+                size += os.path.getsize(os.path.join(root, d, f))
+
+    return {
+        "retention_days": get_retention_days(),
+        "hot_cutoff": str(get_hot_cutoff()),
+        "archived_days": len(days),
+        "first_day": days[0] if days else None,
+        "last_day": days[-1] if days else None,
+        "segments": segments,
+        "size_bytes": size,
+        "codec": "zstd" if zstandard is not None else "zlib"
+    }
@@ -0,0 +1,258 @@
+"""Phase 6.19: IoT Sensor Calibration
+Server-side calibration from IoT Sensor Calibration: coefficients per
+sensor_id, each set effective from a date until the sensor's next one.
+On ingest, rows carrying the calibration's input column (raw_adc,
+resistance, millivolts, voltage) get their engineering value computed here,
+with NumPy, one array per calibration rather than one call per row; the
+value the Pi computed is overwritten and the row records the calibration
+it was computed with. Saving a calibration re-applies it to the stored
+readings of its effective range: the range is split into chunks that run
+as parallel background jobs, each updating its rows and queueing the
+touched hours for the rollup reconciliation (iot_lateness), deferred while
+they are inside the lateness horizon.
+
+Needs NumPy; without it readings are stored as the Pi calibrated them."""
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, add_to_date, get_datetime
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import READING_TIME_FIELD, floor_to_minutes
+from rnd_warehouse_management.rnd_warehouse_management.iot_lateness import (
+    resolve_device_time, split_by_horizon, mark_dirty_hours, defer_dirty_hours)
+from rnd_warehouse_management.rnd_warehouse_management.iot_compression import is_compressed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+CALIBRATION_DOCTYPE = "IoT Sensor Calibration"
+CALIBRATION_CACHE_KEY = "iot_sensor_calibrations"
+CALIBRATION_INPUT_FIELDS = ("raw_adc", "resistance", "millivolts", "voltage")
+CALIBRATION_OUTPUT_FIELDS = ("temperature", "humidity")
+CALIBRATION_PRECISION = 4
+KELVIN = 273.15
+
+BACKFILL_CHUNK_HOURS = 6
+BACKFILL_UPDATE_ROWS = 1000
+BACKFILL_QUEUE = "long"
+BACKFILL_PROGRESS_KEY = "iot_calibration|backfill"
+
+_CALIBRATION_FIELDS = ("name", "sensor_id", "method", "input_field", "output_field", "effective_from",
+                       "coeff_a", "coeff_b", "coeff_c", "series_resistor", "adc_max", "gain", "offset")
+
+
+def _load_calibrations():
+    rows = frappe.get_all(CALIBRATION_DOCTYPE, filters={"enabled": 1}, fields=list(_CALIBRATION_FIELDS),
+                          order_by="sensor_id, effective_from")
+    by_sensor = {}
+    for r in rows:
+        entry = dict(r)
+        entry["effective_epoch"] = get_datetime(r.effective_from).timestamp()
+        by_sensor.setdefault(r.sensor_id, []).append(entry)
+    return by_sensor
+
+
+def get_calibrations():
+    """{sensor_id: [calibration, ...]} oldest first, cached until one is saved."""
+    return frappe.cache().get_value(CALIBRATION_CACHE_KEY, generator=_load_calibrations)
+
+
+# ============================================================================
+# CONVERSION
+# ============================================================================
+
+def convert(values, calibration):
+    """Engineering values for an array of inputs; NaN where the input is
+    missing or outside what the calibration can convert."""
+    x = np.asarray(values, dtype=float)
+    if calibration["method"] == "linear":
+        return float(calibration.get("gain") or 0) * x + float(calibration.get("offset") or 0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if calibration["input_field"] == "raw_adc":
+            # Thermistor on the ground side of a divider with the series resistor
+            full_scale = float(calibration["adc_max"])
+            resistance = float(calibration["series_resistor"]) * x / (full_scale - x)
+            resistance[(x <= 0) | (x >= full_scale)] = np.nan
+        else:
+            resistance = np.where(x > 0, x, np.nan)
+        ln_r = np.log(resistance)
+        inverse_t = (float(calibration.get("coeff_a") or 0) + float(calibration.get("coeff_b") or 0) * ln_r
+                     + float(calibration.get("coeff_c") or 0) * ln_r ** 3)
+        return 1.0 / inverse_t - KELVIN
+
+
+def _input_values(rows, field):
+    values = []
+    for row in rows:
+        try:
+            values.append(float(row.get(field)))
+        except (ValueError, TypeError):
+            values.append(float("nan"))
+    return values
+
+
+def calibrate_batch(batch, now=None):
+    """Apply the effective calibration to every row of a sensor that has
+    one, in place, before validation. Returns the number of rows set."""
+    if np is None:
+        return 0
+    calibrations = get_calibrations()
+    if not calibrations:
+        return 0
+
+    by_sensor = {}
+    for index, row in enumerate(batch):
+        if isinstance(row, dict) and row.get("sensor_id") in calibrations:
+            by_sensor.setdefault(row["sensor_id"], []).append(index)
+    if not by_sensor:
+        return 0
+
+    now = now or now_datetime()
+    calibrated = 0
+    for sensor_id, indexes in by_sensor.items():
+        entries = calibrations[sensor_id]
+        times = [(resolve_device_time(batch[i].get("device_time") or batch[i].get("timestamp"), now)[0] or now)
+                 .timestamp() for i in indexes]
+        # Index of the calibration in effect at each reading, -1 before the first
+        which = np.searchsorted([e["effective_epoch"] for e in entries], times, side="right") - 1
+        for position, entry in enumerate(entries):
+            rows = [batch[indexes[j]] for j in np.flatnonzero(which == position)]
+            if not rows:
+                continue
+            values = convert(_input_values(rows, entry["input_field"]), entry)
+            for row, value in zip(rows, values.tolist()):
+                if value == value and abs(value) != float("inf"):
+                    row[entry["output_field"]] = round(value, CALIBRATION_PRECISION)
+                    row["calibration"] = entry["name"]
+                    calibrated += 1
+    return calibrated
+
+
+# ============================================================================
+# BACKFILL
+# ============================================================================
+
+def get_effective_range(calibration):
+    """[start, end) a calibration applies to: until the sensor's next
+    enabled calibration, else open-ended (end None)."""
+    following = frappe.get_all(CALIBRATION_DOCTYPE, filters={
+        "sensor_id": calibration.sensor_id, "enabled": 1,
+        "effective_from": [">", calibration.effective_from], "name": ["!=", calibration.name],
+    }, fields=["effective_from"], order_by="effective_from", limit=1)
+    return get_datetime(calibration.effective_from), (get_datetime(following[0].effective_from)
+                                                       if following else None)
+
+
+def _progress_key(name, suffix):
+    return f"{BACKFILL_PROGRESS_KEY}|{name}|{suffix}"
+
+
+def enqueue_backfill(calibration, start=None, end=None):
+    """Queue the re-application of a calibration to stored readings of its
+    effective range (narrowed to [start, end) if given) as one background
+    job per BACKFILL_CHUNK_HOURS. Archived days are left as they are."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import get_hot_cutoff
+
+    doc = frappe.get_doc(CALIBRATION_DOCTYPE, calibration)
+    effective_start, effective_end = get_effective_range(doc)
+    now = now_datetime()
+    start = max(effective_start, get_hot_cutoff(), get_datetime(start) if start else effective_start)
+    end = min(effective_end or now, now, get_datetime(end) if end else now)
+
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(add_to_date(floor_to_minutes(chunk_start, 60), hours=BACKFILL_CHUNK_HOURS), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+    cache = frappe.cache()
+    for suffix in ("done", "rows"):
+        cache.delete_value(_progress_key(calibration, suffix))
+    cache.set_value(_progress_key(calibration, "plan"), {
+        "start": str(start), "end": str(end), "chunks": len(chunks), "queued_at": str(now),
+        "archived_before": str(effective_start) if effective_start < start else None,
+    })
+    for chunk_start, chunk_end in chunks:
+        frappe.enqueue("rnd_warehouse_management.rnd_warehouse_management.iot_calibration.backfill_chunk",
+                       queue=BACKFILL_QUEUE, enqueue_after_commit=True,
+                       calibration=calibration, start=str(chunk_start), end=str(chunk_end))
+    frappe.db.set_value(CALIBRATION_DOCTYPE, calibration, "last_backfill", now, update_modified=False)
+    return {"calibration": calibration, "start": str(start), "end": str(end), "chunks": len(chunks)}
+
+
+def backfill_chunk(calibration, start, end):
+    """Background job: recompute one chunk of a calibration's readings from
+    their stored input column and queue the touched hours for rollups."""
+    doc = frappe.get_doc(CALIBRATION_DOCTYPE, calibration)
+    if np is None or not doc.enabled:
+        return {"updated": 0}
+    if doc.input_field not in CALIBRATION_INPUT_FIELDS or doc.output_field not in CALIBRATION_OUTPUT_FIELDS:
+        frappe.throw(_("Unsupported calibration fields"))
+    for field in (doc.input_field, doc.output_field):
+        if not frappe.db.has_column("IoT Sensor Reading", field):
+            frappe.throw(_("IoT Sensor Reading has no {0} column").format(field))
+    set_calibration = frappe.db.has_column("IoT Sensor Reading", "calibration")
+
+    rows = frappe.db.sql(f"""
+        SELECT name, `{doc.input_field}`, `{READING_TIME_FIELD}`, sensor_type
+        FROM `tabIoT Sensor Reading`
+        WHERE sensor_id = %(sensor_id)s AND `{READING_TIME_FIELD}` >= %(start)s
+            AND `{READING_TIME_FIELD}` < %(end)s AND `{doc.input_field}` IS NOT NULL
+    """, {"sensor_id": doc.sensor_id, "start": start, "end": end})
+    values = convert([r[1] for r in rows], doc.as_dict())
+    updates = [(r[0], round(v, CALIBRATION_PRECISION)) for r, v in zip(rows, values.tolist())
+               if v == v and abs(v) != float("inf")]
+
+    for i in range(0, len(updates), BACKFILL_UPDATE_ROWS):
+        chunk = updates[i:i + BACKFILL_UPDATE_ROWS]
+        cases = " ".join(["WHEN %s THEN %s"] * len(chunk))
+        params = [p for pair in chunk for p in pair]
+        extra = ", calibration = %s" if set_calibration else ""
+        if set_calibration:
+            params.append(calibration)
+        params.append(tuple(name for name, _value in chunk))
+        frappe.db.sql(f"""
+            UPDATE `tabIoT Sensor Reading`
+            SET `{doc.output_field}` = CASE name {cases} END{extra}
+            WHERE name IN %s
+        """, params)
+        frappe.db.commit()
+
+    # Compressed types are left out as on ingest: their stored rows can't
+    # rebuild the rollups. Hours still inside the lateness horizon are being
+    # added to by ingest, so they wait until they pass it.
+    hours = {(r[3], floor_to_minutes(r[2], 60)) for r in rows if r[3] and not is_compressed(r[3])}
+    current, past = split_by_horizon([{"sensor_type": sensor_type, READING_TIME_FIELD: hour}
+                                      for sensor_type, hour in hours])
+    mark_dirty_hours(past)
+    defer_dirty_hours(current)
+
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    pipe.incr(cache.make_key(_progress_key(calibration, "done")))
+    pipe.incrby(cache.make_key(_progress_key(calibration, "rows")), len(updates))
+    pipe.execute()
+    return {"updated": len(updates), "hours": len(hours)}
+
+
+@frappe.whitelist()
+def backfill_calibration(calibration, start=None, end=None):
+    """Re-apply a calibration to stored readings, optionally within [start, end)."""
+    frappe.get_doc(CALIBRATION_DOCTYPE, calibration).check_permission("write")
+    return enqueue_backfill(calibration, start, end)
+
+
+@frappe.whitelist()
+def get_backfill_status(calibration):
+    cache = frappe.cache()
+    plan = cache.get_value(_progress_key(calibration, "plan"))
+    if not plan:
+        return {"calibration": calibration, "status": "not_queued"}
+    done = int(cache.get(cache.make_key(_progress_key(calibration, "done"))) or 0)
+    rows = int(cache.get(cache.make_key(_progress_key(calibration, "rows"))) or 0)
+    return dict(plan, calibration=calibration, done=done, rows=rows,
+                status="completed" if done >= plan["chunks"] else "running")
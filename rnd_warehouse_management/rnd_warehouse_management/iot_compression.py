@@ -0,0 +1,446 @@
+"""Phase 6.15: IoT Swinging-Door Compression
+Optional swinging-door trending (SDT) on ingest: for each sensor, a reading
+is only stored when the straight line from the last stored reading can no
+longer pass within the deviation of every reading since, so flat or steadily
+ramping series keep a handful of points. The dropped readings still feed
+rollups, stats, sketches and the latest-value rings; only IoT Sensor
+Reading rows are thinned, and get_reconstructed_series interpolates them
+back for charts and quality scoring. A door holds its sensor's last reading
+until the next one shows whether it is needed. The held reading is stored
+right away, so losing the Redis door state never loses an accepted
+reading, and is deleted again when a later batch makes it redundant.
+flush_held_readings (scheduler) pins the ones held longer than
+SDT_MAX_GAP_SECONDS, so a sensor that goes quiet keeps its last reading.
+
+Enabled with site_config "iot_swinging_door": a list of sensor types, or
+true for every type with a deviation. Deviations come from
+DEFAULT_PLC_REGISTER_MAP (compression_deviation, else the poll deadband) or
+the sensor registry's compression_deviation."""
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, add_to_date, get_datetime
+from contextlib import contextmanager
+from datetime import timedelta
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+    reading_time, row_metrics, primary_metric)
+
+
+# A reading is always stored at least this often, so gaps stay visible
+SDT_MAX_GAP_SECONDS = 900
+# Dropped points kept per sensor to measure the reconstruction error
+SDT_MAX_PENDING = 1000
+SDT_LOCK_TIMEOUT = 30
+SDT_STATE_KEY = "iot_sdt_state"
+SDT_STATS_KEY = "iot_sdt_stats"
+DEFAULT_RECONSTRUCT_POINTS = 500
+MAX_RECONSTRUCT_POINTS = 5000
+
+
+def get_compressed_types():
+    setting = frappe.conf.get("iot_swinging_door")
+    if not setting:
+        return set()
+    if setting is True or setting == 1:
+        from rnd_warehouse_management.rnd_warehouse_management.plc_integration import DEFAULT_PLC_REGISTER_MAP
+        from rnd_warehouse_management.rnd_warehouse_management.sensor_discovery import DEFAULT_SENSOR_REGISTRY
+        return {t for t in list(DEFAULT_PLC_REGISTER_MAP) + list(DEFAULT_SENSOR_REGISTRY) if get_deviations(t)}
+    return set(setting)
+
+
+def is_compressed(sensor_type):
+    return sensor_type in get_compressed_types()
+
+
+def get_deviations(sensor_type):
+    """{metric: deviation} compressed for a sensor type; a scalar registry
+    value applies to the type's primary metric."""
+    from rnd_warehouse_management.rnd_warehouse_management.plc_integration import (
+        DEFAULT_PLC_REGISTER_MAP, get_register_deadband)
+    from rnd_warehouse_management.rnd_warehouse_management.sensor_discovery import DEFAULT_SENSOR_REGISTRY
+
+    if sensor_type in DEFAULT_PLC_REGISTER_MAP:
+        reg = DEFAULT_PLC_REGISTER_MAP[sensor_type]
+        return {reg["parameter"]: float(reg.get("compression_deviation") or get_register_deadband(sensor_type))}
+    deviation = (DEFAULT_SENSOR_REGISTRY.get(sensor_type) or {}).get("compression_deviation")
+    if isinstance(deviation, dict):
+        return {metric: float(value) for metric, value in deviation.items()}
+    if deviation:
+        return {primary_metric(sensor_type): float(deviation)}
+    return {}
+
+
+# ============================================================================
+# SWINGING DOOR
+# ============================================================================
+
+def new_door_state():
+    return {"anchor": None, "held": None, "up": {}, "low": {}, "pending": []}
+
+
+def _corridor(anchor, point, deviations):
+    """Slopes from the anchor to the top and bottom of point +/- deviation."""
+    (ta, va), (t, v) = anchor, point
+    dt = t - ta
+    up, low = {}, {}
+    for metric, deviation in deviations.items():
+        if metric in v and metric in va:
+            up[metric] = (v[metric] + deviation - va[metric]) / dt
+            low[metric] = (v[metric] - deviation - va[metric]) / dt
+    return up, low
+
+
+def _segment_errors(start, end, pending, errors):
+    """Largest distance of the dropped points from the stored segment."""
+    (ts, vs), (te, ve) = start, end
+    for t, v in pending:
+        for metric, value in v.items():
+            if metric in vs and metric in ve:
+                expected = vs[metric] + (ve[metric] - vs[metric]) * (t - ts) / (te - ts)
+                errors[metric] = max(errors.get(metric, 0.0), abs(value - expected))
+
+
+def swinging_door(points, deviations, state=None, max_gap_seconds=SDT_MAX_GAP_SECONDS):
+    """Run points (epoch, {metric: value}, payload), in time order, through
+    the door. The last point is held back until a later one shows whether it
+    is needed. Returns (payloads to store, new state, {metric: max error})."""
+    state = state or new_door_state()
+    stored = []
+    errors = {}
+
+    def restart(t, values, payload):
+        stored.append(payload)
+        state.update(anchor=(t, values), held=None, up={}, low={}, pending=[])
+
+    for t, values, payload in points:
+        anchor, held = state["anchor"], state["held"]
+        if anchor is None:
+            restart(t, values, payload)
+            continue
+        if t <= (held or anchor)[0]:
+            # Out of order (e.g. a late replay): stored, the door is left alone
+            stored.append(payload)
+            continue
+
+        up, low = _corridor(anchor, (t, values), deviations)
+        up = {m: min(s, state["up"].get(m, s)) for m, s in up.items()}
+        low = {m: max(s, state["low"].get(m, s)) for m, s in low.items()}
+        closed = (any(low[m] > up[m] for m in up) or t - anchor[0] > max_gap_seconds
+                  or len(state["pending"]) >= SDT_MAX_PENDING)
+        if not closed:
+            if held:
+                state["pending"].append(held[:2])
+            state.update(held=(t, values, payload), up=up, low=low)
+            continue
+        if not held or t - held[0] > max_gap_seconds:
+            # Nothing to bridge with, or a gap: keep both ends
+            if held:
+                _segment_errors(anchor, held[:2], state["pending"], errors)
+                stored.append(held[2])
+            restart(t, values, payload)
+            continue
+
+        # The held point is the last one the stored line can reach
+        _segment_errors(anchor, held[:2], state["pending"], errors)
+        stored.append(held[2])
+        up, low = _corridor(held[:2], (t, values), deviations)
+        state.update(anchor=held[:2], held=(t, values, payload), up=up, low=low, pending=[])
+    return stored, state, errors
+
+
+# ============================================================================
+# INGEST
+# ============================================================================
+
+def _state_field(sensor_type, sensor_id):
+    return f"{sensor_type}|{sensor_id or ''}"
+
+
+@contextmanager
+def storage_filter(accepted):
+    """Yield the (index, row) pairs of accepted to store; the caller sets
+    row["name"] once inserted. Held readings an earlier batch stored and
+    this one makes redundant are deleted in the caller's transaction. Door
+    states and stats are saved only when the block exits without error
+    (after the caller committed), under a per-type lock so parallel flushes
+    of one sensor don't both act on the same held reading."""
+    types = get_compressed_types() & {row.get("sensor_type") for _index, row in accepted}
+    if not types:
+        yield accepted
+        return
+
+    cache = frappe.cache()
+    with _type_locks(types):
+        stored, states, stats, redundant = apply_swinging_door(accepted, types)
+        if redundant:
+            frappe.db.delete("IoT Sensor Reading", {"name": ["in", redundant]})
+        yield stored
+        for field, state in states.items():
+            cache.hset(SDT_STATE_KEY, field, state)
+        _save_stats(stats)
+
+
+@contextmanager
+def _type_locks(types):
+    cache = frappe.cache()
+    locks = [cache.lock(cache.make_key(f"iot_sdt_lock|{t}"), timeout=SDT_LOCK_TIMEOUT)
+             for t in sorted(types)]
+    acquired = []
+    try:
+        for lock in locks:
+            lock.acquire()
+            acquired.append(lock)
+        yield
+    finally:
+        for lock in reversed(acquired):
+            try:
+                lock.release()
+            except Exception:
+                # Expired while the batch was inserted; nothing to release
+                pass
+
+
+def apply_swinging_door(accepted, types):
+    """Split accepted rows into the ones to store and per-sensor door states.
+    A sensor's new held reading is stored too; the one an earlier batch held
+    and stored is left alone when the door keeps it and listed for deletion
+    when the door drops it. Held readings from before they were stored
+    right away (no "name") are stored when kept.
+    Returns (stored, states, {sensor_type: stats delta}, redundant names)."""
+    stored = []
+    groups = {}
+    for index, row in accepted:
+        sensor_type = row.get("sensor_type")
+        if sensor_type not in types:
+            stored.append((index, row))
+            continue
+        point = (reading_time(row).timestamp(), row_metrics(row), (index, row))
+        groups.setdefault((sensor_type, row.get("sensor_id")), []).append(point)
+
+    cache = frappe.cache()
+    states = {}
+    stats = {}
+    redundant = []
+    for (sensor_type, sensor_id), points in groups.items():
+        field = _state_field(sensor_type, sensor_id)
+        points.sort(key=lambda p: p[0])
+        state = cache.hget(SDT_STATE_KEY, field)
+        previous = state["held"][2][1] if state and state.get("held") else None
+        kept, state, errors = swinging_door(points, get_deviations(sensor_type), state)
+        held = state["held"][2] if state["held"] else None
+        if held and held[0] is not None:
+            # Stored now in case the door state is lost; batch positions mean
+            # nothing to a later batch
+            kept.append(held)
+            t, values, (_index, row) = state["held"]
+            state["held"] = (t, values, (None, row))
+        new = [p for p in kept if p[0] is not None or not p[1].get("name")]
+        # The earlier held reading went into the door's pending points
+        dropped = bool(previous and previous.get("name")
+                       and not (held and held[1] is previous)
+                       and not any(row is previous for _index, row in kept))
+        if dropped:
+            redundant.append(previous["name"])
+        states[field] = state
+        stored.extend(new)
+        s = stats.setdefault(sensor_type, {"seen": 0, "stored": 0, "max_error": {}})
+        s["seen"] += len(points)
+        s["stored"] += len(new) - (1 if dropped else 0)
+        for metric, error in errors.items():
+            s["max_error"][metric] = max(s["max_error"].get(metric, 0.0), error)
+    return stored, states, stats, redundant
+
+
+def release_held(state):
+    """Take a door's held reading out to be stored on its own: the door
+    restarts from it. Returns (row, {metric: max error}) or (None, {})."""
+    held = state.get("held")
+    if not held:
+        return None, {}
+    errors = {}
+    if state["anchor"]:
+        _segment_errors(state["anchor"], held[:2], state["pending"], errors)
+    state.update(anchor=held[:2], held=None, up={}, low={}, pending=[])
+    return held[2][1], errors
+
+
+def flush_held_readings(max_age_seconds=SDT_MAX_GAP_SECONDS):
+    """Scheduler job: release readings a door has held for longer than
+    max_age_seconds, so no later batch can delete them. A held reading is
+    normally settled by the sensor's next one; when a sensor goes quiet this
+    keeps its last reading. Held readings are already stored, except ones
+    held from before that (no "name"), which are stored here."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import _bulk_insert_readings
+
+    cache = frappe.cache()
+    cutoff = now_datetime().timestamp() - float(max_age_seconds)
+    stale = {}
+    for field, state in (cache.hgetall(SDT_STATE_KEY) or {}).items():
+        field = field.decode() if isinstance(field, bytes) else field
+        if state and state.get("held") and state["held"][0] < cutoff:
+            stale.setdefault(field.split("|", 1)[0], []).append(field)
+    if not stale:
+        return 0
+
+    released = 0
+    for sensor_type, fields in stale.items():
+        with _type_locks([sensor_type]):
+            rows, states, stats = [], {}, {"seen": 0, "stored": 0, "max_error": {}}
+            for field in fields:
+                # Re-read under the lock: ingest may have released it meanwhile
+                state = cache.hget(SDT_STATE_KEY, field)
+                if not (state and state.get("held") and state["held"][0] < cutoff):
+                    continue
+                row, errors = release_held(state)
+                if not row.get("name"):
+                    rows.append((None, row))
+                states[field] = state
+                for metric, error in errors.items():
+                    stats["max_error"][metric] = max(stats["max_error"].get(metric, 0.0), error)
+            if not states:
+                continue
+            if rows:
+                _bulk_insert_readings(rows)
+                frappe.db.commit()
+            for field, state in states.items():
+                cache.hset(SDT_STATE_KEY, field, state)
+            stats["stored"] = len(rows)
+            _save_stats({sensor_type: stats})
+            released += len(states)
+    return released
+
+
+def _save_stats(stats):
+    cache = frappe.cache()
+    for sensor_type, delta in stats.items():
+        current = cache.hget(SDT_STATS_KEY, sensor_type) or {
+            "since": str(now_datetime()), "seen": 0, "stored": 0, "max_error": {}}
+        current["seen"] += delta["seen"]
+        current["stored"] += delta["stored"]
+        for metric, error in delta["max_error"].items():
+            current["max_error"][metric] = round(max(current["max_error"].get(metric, 0.0), error), 6)
+        cache.hset(SDT_STATS_KEY, sensor_type, current)
+
+
+# ============================================================================
+# RECONSTRUCTION AND REPORTING
+# ============================================================================
+
+def interpolate(points, times):
+    """Linear interpolation of sorted (epoch, value) points at the given
+    epochs; None outside the points' span."""
+    values = []
+    j = 0
+    for t in times:
+        while j < len(points) - 1 and points[j + 1][0] < t:
+            j += 1
+        if not points or t < points[0][0] or t > points[-1][0]:
+            values.append(None)
+        elif j == len(points) - 1 or points[j + 1][0] == points[j][0]:
+            values.append(points[j][1])
+        else:
+            (t0, v0), (t1, v1) = points[j], points[j + 1]
+            values.append(v0 + (v1 - v0) * (t - t0) / (t1 - t0))
+    return values
+
+
+def _stored_points(sensor_type, sensor_id, start, end, metric):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import get_readings
+
+    # One gap either side, so the window's edges can be interpolated
+    margin = timedelta(seconds=SDT_MAX_GAP_SECONDS)
+    points = []
+    for row in get_readings(sensor_type, start - margin, end + margin, sensor_id):
+        value = row_metrics(row).get(metric)
+        if value is not None:
+            points.append((reading_time(row).timestamp(), value))
+    points.sort()
+    return points
+
+
+@frappe.whitelist()
+def get_reconstructed_series(sensor_type, sensor_id=None, start=None, end=None, step_seconds=None,
+                             metric=None):
+    """A sensor's series resampled on a regular grid from the stored
+    (compressed) readings: {"t": [epoch...], "v": [value or None...]}."""
+    end = get_datetime(end) if end else now_datetime()
+    start = get_datetime(start) if start else add_to_date(end, hours=-24)
+    metric = metric or primary_metric(sensor_type)
+    span = (end - start).total_seconds()
+    if span <= 0:
+        frappe.throw(_("start must be before end"))
+    step = float(step_seconds) if step_seconds else span / DEFAULT_RECONSTRUCT_POINTS
+    step = max(step, span / MAX_RECONSTRUCT_POINTS)
+
+    points = _stored_points(sensor_type, sensor_id, start, end, metric)
+    first = start.timestamp()
+    times = [first + i * step for i in range(int(span // step) + 1)]
+    return {
+        "sensor_type": sensor_type,
+        "sensor_id": sensor_id,
+        "metric": metric,
+        "step_seconds": step,
+        "stored_points": sum(1 for t, _v in points if first <= t <= end.timestamp()),
+        "t": [round(t) for t in times],
+        "v": [round(v, 4) if v is not None else None for v in interpolate(points, times)],
+    }
+
+
+def evaluate_compression(sensor_type, sensor_id=None, hours=24, deviations=None):
+    """Replay stored history through the door without storing anything:
+    compression ratio and max reconstruction error it would give."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import get_readings
+
+    end = now_datetime()
+    deviations = deviations or get_deviations(sensor_type)
+    groups = {}
+    for row in get_readings(sensor_type, add_to_date(end, hours=-float(hours)), end, sensor_id):
+        groups.setdefault(row.get("sensor_id"), []).append(
+            (reading_time(row).timestamp(), row_metrics(row), None))
+    seen = stored = 0
+    max_error = {}
+    for points in groups.values():
+        points.sort(key=lambda p: p[0])
+        kept, state, errors = swinging_door(points, deviations)
+        seen += len(points)
+        stored += len(kept) + (1 if state["held"] else 0)
+        for metric, error in errors.items():
+            max_error[metric] = max(max_error.get(metric, 0.0), error)
+    return _report_entry(sensor_type, deviations, seen, stored, max_error)
+
+
+def _report_entry(sensor_type, deviations, seen, stored, max_error):
+    return {
+        "sensor_type": sensor_type,
+        "deviation": deviations,
+        "readings": seen,
+        "stored": stored,
+        "compression_ratio": round(seen / stored, 2) if stored else None,
+        "max_error": {m: round(e, 6) for m, e in max_error.items()},
+    }
+
+
+@frappe.whitelist()
+def get_compression_report(evaluate=0, hours=24):
+    """Compression ratio and max reconstruction error per register since
+    compression was enabled. evaluate=1 instead replays the last `hours` of
+    stored history for every type with a deviation, to size the gain before
+    enabling it."""
+    from rnd_warehouse_management.rnd_warehouse_management.plc_integration import DEFAULT_PLC_REGISTER_MAP
+    from rnd_warehouse_management.rnd_warehouse_management.sensor_discovery import DEFAULT_SENSOR_REGISTRY
+
+    enabled = get_compressed_types()
+    registers = []
+    for sensor_type in list(DEFAULT_PLC_REGISTER_MAP) + list(DEFAULT_SENSOR_REGISTRY):
+        deviations = get_deviations(sensor_type)
+        if not deviations:
+            continue
+        if int(evaluate or 0):
+            entry = evaluate_compression(sensor_type, hours=hours, deviations=deviations)
+        else:
+            stats = frappe.cache().hget(SDT_STATS_KEY, sensor_type) or {"seen": 0, "stored": 0, "max_error": {}}
+            entry = _report_entry(sensor_type, deviations, stats["seen"], stats["stored"], stats["max_error"])
+            entry["since"] = stats.get("since")
+        entry["enabled"] = sensor_type in enabled
+        registers.append(entry)
+    return {"evaluated_hours": float(hours) if int(evaluate or 0) else None, "registers": registers}
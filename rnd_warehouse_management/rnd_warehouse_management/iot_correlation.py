@@ -0,0 +1,277 @@
+"""Phase 6.17: IoT Zone Correlation
+Sensors that share a zone (a cold room, a tank line) should read alike. A
+scheduled job loads the 1-minute rollups of every registered zone sensor in
+one query, lays each zone out as a sensors x minutes matrix and, with NumPy,
+computes every sensor's residual from the zone median and the pairwise
+correlation of all sensors at once. A sensor is flagged when it sits off
+the zone median, when its residual has recently shifted (it is drifting
+away from its neighbours) or when it no longer follows the zone's swings.
+
+Needs NumPy; without it the job is skipped. Settings can be overridden with
+site_config "iot_zone_correlation": {"window_hours", "recent_minutes",
+"min_correlation", "limits": {metric: max residual}}."""
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, add_to_date
+import time
+import warnings
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import ROLLUP_DOCTYPE, floor_to_minutes
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+ZONE_CORRELATION_KEY = "iot_zone_correlation"
+ZONE_MIN_SENSORS = 3
+# Minutes two sensors must share before their correlation is reported
+ZONE_MIN_OVERLAP = 30
+DEFAULT_ZONE_SETTINGS = {
+    "window_hours": 6,
+    "recent_minutes": 30,
+    "min_correlation": 0.5,
+    # Residual from the zone median (in the metric's unit) that flags a sensor
+    "limits": {"temperature": 1.0, "humidity": 5.0},
+}
+
+
+def get_zone_settings():
+    settings = dict(DEFAULT_ZONE_SETTINGS)
+    overrides = frappe.conf.get("iot_zone_correlation") or {}
+    settings.update({k: v for k, v in overrides.items() if k != "limits"})
+    settings["limits"] = dict(DEFAULT_ZONE_SETTINGS["limits"], **(overrides.get("limits") or {}))
+    return settings
+
+
+# ============================================================================
+# MATRIX MATH
+# ============================================================================
+
+def _nanmean(a, axis):
+    present = ~np.isnan(a)
+    count = present.sum(axis=axis)
+    total = np.where(present, a, 0.0).sum(axis=axis)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def _nanmedian(a, axis):
+    # All-NaN slices are expected (silent sensors, empty minutes)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmedian(a, axis=axis)
+
+
+def build_zone_matrix(sensor_index, minute_index, values, sensors, minutes):
+    """sensors x minutes matrix, NaN where a sensor has no reading."""
+    matrix = np.full((sensors, minutes), np.nan)
+    matrix[sensor_index, minute_index] = values
+    return matrix
+
+
+def pairwise_correlation(matrix, min_overlap=ZONE_MIN_OVERLAP):
+    """Pearson correlation of every pair of rows over the minutes both have,
+    as matrix products instead of one pass per pair. NaN where a pair
+    overlaps less than min_overlap minutes or either row is flat."""
+    present = (~np.isnan(matrix)).astype(float)
+    x = np.where(present > 0, matrix, 0.0)
+    # Shift by each row's mean first; the sums below then stay small
+    x = np.where(present > 0, x - _nanmean(matrix, axis=1)[:, None], 0.0)
+    n = present @ present.T
+    sx = x @ present.T
+    sxx = (x * x) @ present.T
+    sxy = x @ x.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = sxy - sx * sx.T / n
+        var_x = sxx - sx * sx / n
+        corr = cov / np.sqrt(var_x * var_x.T)
+    corr[(n < min_overlap) | ~np.isfinite(corr)] = np.nan
+    return np.clip(corr, -1.0, 1.0)
+
+
+def analyze_zone(matrix, limit, recent_minutes, min_correlation):
+    """Residuals from the zone median and correlation for every row of a
+    sensors x minutes matrix. Returns per-sensor columns and the flags."""
+    sensors, minutes = matrix.shape
+    # Minutes where enough sensors reported for the median to mean something
+    columns = (~np.isnan(matrix)).sum(axis=0) >= ZONE_MIN_SENSORS
+    median = np.full(minutes, np.nan)
+    median[columns] = _nanmedian(matrix[:, columns], axis=0)
+    residual = matrix - median
+
+    recent_start = max(minutes - recent_minutes, 0)
+    recent = _nanmean(residual[:, recent_start:], axis=1)
+    baseline = _nanmedian(residual[:, :recent_start], axis=1) if recent_start else np.full(sensors, np.nan)
+    shift = recent - baseline
+    spread = np.sqrt(np.maximum(_nanmean(residual ** 2, axis=1) - _nanmean(residual, axis=1) ** 2, 0.0))
+
+    corr = pairwise_correlation(matrix)
+    np.fill_diagonal(corr, np.nan)
+    median_corr = _nanmedian(corr, axis=1)
+    # Correlation only says something when the zone itself moves
+    zone_moves = bool(np.nanstd(median) >= limit / 2) if columns.any() else False
+
+    flags = []
+    for i in range(sensors):
+        reasons = []
+        if abs(recent[i]) > limit:
+            reasons.append("offset")
+        if abs(shift[i]) > limit / 2:
+            reasons.append("diverging")
+        if zone_moves and median_corr[i] < min_correlation:
+            reasons.append("decorrelated")
+        flags.append(reasons)
+
+    return {
+        "recent_residual": recent,
+        "baseline_residual": baseline,
+        "shift": shift,
+        "residual_std": spread,
+        "median_correlation": median_corr,
+        "coverage": (~np.isnan(matrix)).sum(axis=1) / minutes,
+        "correlation": corr,
+        "zone_std": float(np.nanstd(median)) if columns.any() else None,
+        "flags": flags,
+    }
+
+
+def _num(value, digits=3):
+    value = float(value)
+    return None if value != value else round(value, digits)
+
+
+# ============================================================================
+# JOB
+# ============================================================================
+
+def _load_zone_rollups(sensor_ids, metrics, start, end):
+    """(sensor_id, metric, minute offset, mean) of every 1-minute bucket in
+    [start, end) for the given sensors, in one query."""
+    return frappe.db.sql(f"""
+        SELECT sensor_id, metric, TIMESTAMPDIFF(MINUTE, %(start)s, bucket_start) AS minute,
+               value_sum / reading_count AS value
+        FROM `tab{ROLLUP_DOCTYPE}`
+        WHERE resolution = 1 AND sensor_id IN %(sensor_ids)s AND metric IN %(metrics)s
+            AND bucket_start >= %(start)s AND bucket_start < %(end)s AND reading_count > 0
+    """, {"sensor_ids": tuple(sensor_ids), "metrics": tuple(metrics), "start": start, "end": end})
+
+
+def compute_zone_correlation(zones, rows, minutes, settings):
+    """Analyze each (zone, metric) from rollup rows. zones is
+    {zone: [sensor_id]}, rows (sensor_id, metric, minute, value)."""
+    if not rows:
+        return []
+    sensor_col, metric_col, minute_col, value_col = (np.array(col) for col in zip(*rows))
+    minute_col = minute_col.astype(int)
+    value_col = value_col.astype(float)
+
+    results = []
+    for zone in sorted(zones):
+        in_zone = np.isin(sensor_col, list(zones[zone]))
+        for metric, limit in settings["limits"].items():
+            mask = in_zone & (metric_col == metric) & (minute_col >= 0) & (minute_col < minutes)
+            sensor_ids, sensor_index = np.unique(sensor_col[mask], return_inverse=True)
+            if len(sensor_ids) < ZONE_MIN_SENSORS:
+                continue
+            matrix = build_zone_matrix(sensor_index, minute_col[mask], value_col[mask], len(sensor_ids), minutes)
+            analysis = analyze_zone(matrix, float(limit), int(settings["recent_minutes"]),
+                                    float(settings["min_correlation"]))
+            sensors = [{
+                "sensor_id": str(sensor_id),
+                "recent_residual": _num(analysis["recent_residual"][i]),
+                "baseline_residual": _num(analysis["baseline_residual"][i]),
+                "shift": _num(analysis["shift"][i]),
+                "residual_std": _num(analysis["residual_std"][i]),
+                "median_correlation": _num(analysis["median_correlation"][i]),
+                "coverage": _num(analysis["coverage"][i]),
+                "flags": analysis["flags"][i],
+            } for i, sensor_id in enumerate(sensor_ids)]
+            results.append({
+                "zone": zone,
+                "metric": metric,
+                "limit": float(limit),
+                "zone_std": _num(analysis["zone_std"]) if analysis["zone_std"] is not None else None,
+                "sensors": sensors,
+                "flagged": [s["sensor_id"] for s in sensors if s["flags"]],
+                "sensor_ids": [s["sensor_id"] for s in sensors],
+                "correlation": [[_num(c) for c in row] for row in analysis["correlation"]],
+            })
+    return results
+
+
+def run_zone_correlation():
+    """Scheduled: compare every zone's sensors and cache the result."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_device_registry
+
+    if np is None:
+        return {"skipped": "numpy is not installed"}
+
+    started = time.monotonic()
+    settings = get_zone_settings()
+    zones = {zone: ids for zone, ids in get_device_registry()["by_zone"].items() if len(ids) >= ZONE_MIN_SENSORS}
+    # Only whole minutes; the current one is still filling
+    end = floor_to_minutes(now_datetime(), 1)
+    start = add_to_date(end, hours=-float(settings["window_hours"]))
+    minutes = int((end - start).total_seconds() // 60)
+
+    sensor_ids = sorted({sid for ids in zones.values() for sid in ids})
+    rows = _load_zone_rollups(sensor_ids, list(settings["limits"]), start, end) if sensor_ids else []
+    results = compute_zone_correlation(zones, rows, minutes, settings)
+
+    cache = frappe.cache()
+    previous = cache.get_value(ZONE_CORRELATION_KEY) or {}
+    before = {(z["zone"], z["metric"], sid) for z in previous.get("zones", []) for sid in z["flagged"]}
+    for zone in results:
+        for sensor in zone["sensors"]:
+            if sensor["flags"] and (zone["zone"], zone["metric"], sensor["sensor_id"]) not in before:
+                _publish_divergence(zone, sensor)
+
+    snapshot = {
+        "computed_at": str(now_datetime()),
+        "window_start": str(start),
+        "window_end": str(end),
+        "elapsed_ms": round((time.monotonic() - started) * 1000),
+        "sensors": len(sensor_ids),
+        "zones": results,
+    }
+    cache.set_value(ZONE_CORRELATION_KEY, snapshot)
+    return {"zones": len(results), "sensors": len(sensor_ids), "elapsed_ms": snapshot["elapsed_ms"],
+            "flagged": sum(len(z["flagged"]) for z in results)}
+
+
+def _publish_divergence(zone, sensor):
+    message = (f"IoT zone divergence: {sensor['sensor_id']} in {zone['zone']} ({zone['metric']}) "
+               f"{', '.join(sensor['flags'])}, residual {sensor['recent_residual']}")
+    frappe.logger().warning(message)
+    frappe.publish_realtime("iot_zone_divergence", dict(sensor, zone=zone["zone"], metric=zone["metric"]))
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+@frappe.whitelist()
+def get_zone_correlation(zone=None, metric=None, refresh=0, include_matrix=0):
+    """Latest zone comparison: per sensor its residual from the zone median,
+    recent shift, median correlation with its neighbours and flags.
+    include_matrix adds the pairwise correlation matrix, in sensor_ids order."""
+    if int(refresh or 0):
+        if np is None:
+            frappe.throw(_("NumPy is required for zone correlation"))
+        run_zone_correlation()
+    snapshot = frappe.cache().get_value(ZONE_CORRELATION_KEY)
+    if not snapshot:
+        return {"zones": [], "reason": "not_computed"}
+
+    zones = []
+    for entry in snapshot["zones"]:
+        if (zone and entry["zone"] != zone) or (metric and entry["metric"] != metric):
+            continue
+        if not int(include_matrix or 0):
+            entry = {k: v for k, v in entry.items() if k != "correlation"}
+        zones.append(entry)
+    return dict(snapshot, zones=zones, flagged=[
+        {"zone": z["zone"], "metric": z["metric"], "sensor_id": s["sensor_id"], "flags": s["flags"]}
+        for z in zones for s in z["sensors"] if s["flags"]])
@@ -0,0 +1,233 @@
+"""Phase 6.14: IoT Fleet Backlog
+Every report_buffer_status call is kept as a compact sample
+"epoch:buffered:ingested" on a per-device Redis ring, where ingested is the
+running count of rows the server took in from that RPi. From the recent
+samples each device gets its ingest rate, the least-squares trend of its
+backlog and a projection: when it will have drained, or when a growing
+backlog will fill the device's buffer. The projection is stored on IoT
+Device so the fleet view is one query."""
+import frappe
+from frappe.utils import now_datetime, add_to_date, get_datetime, time_diff_in_seconds
+
+
+BACKLOG_RING_SIZE = 1440
+BACKLOG_RETENTION_HOURS = 48
+# Trend window; needs at least BACKLOG_MIN_SAMPLES reports spanning 2+ minutes
+BACKLOG_TREND_MINUTES = 30
+BACKLOG_MIN_SAMPLES = 3
+BACKLOG_MIN_SPAN_SECONDS = 120
+# Backlog changes slower than this (readings/min) count as stable
+BACKLOG_STABLE_RATE = 1.0
+# Flag growing devices that will fill their buffer within this many hours
+OVERFLOW_WARNING_HOURS = 24
+OVERFLOW_FILL_RATIO = 0.9
+# A device that hasn't reported for this long is shown as stale
+BACKLOG_STALE_MINUTES = 15
+
+
+def _backlog_key(rpi_id):
+    return f"iot_fleet|backlog|{rpi_id}"
+
+
+def _ingested_key(rpi_id):
+    return f"iot_fleet|ingested|{rpi_id}"
+
+
+# ============================================================================
+# SAMPLES
+# ============================================================================
+
+def count_device_ingest(rows):
+    """Add ingested rows to their RPi's running counter (called on ingest)."""
+    counts = {}
+    for row in rows:
+        if row.get("rpi_id"):
+            counts[row["rpi_id"]] = counts.get(row["rpi_id"], 0) + 1
+    if not counts:
+        return
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for rpi_id, count in counts.items():
+        pipe.incrby(cache.make_key(_ingested_key(rpi_id)), count)
+    pipe.execute()
+
+
+def get_ingested_count(rpi_id):
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(_ingested_key(rpi_id))) or 0)
+
+
+def record_backlog_sample(rpi_id, buffered_count, now=None):
+    """Push one report onto the device's ring."""
+    now = now or now_datetime()
+    sample = f"{int(get_datetime(now).timestamp())}:{int(buffered_count)}:{get_ingested_count(rpi_id)}"
+    cache = frappe.cache()
+    key = cache.make_key(_backlog_key(rpi_id))
+    pipe = cache.pipeline()
+    pipe.lpush(key, sample)
+    pipe.ltrim(key, 0, BACKLOG_RING_SIZE - 1)
+    pipe.expire(key, BACKLOG_RETENTION_HOURS * 3600)
+    pipe.execute()
+
+
+def parse_samples(entries):
+    """Decode ring entries into (epoch, buffered, ingested) tuples, oldest first."""
+    samples = []
+    for entry in entries or ():
+        if isinstance(entry, bytes):
+            entry = entry.decode()
+        try:
+            epoch, buffered, ingested = (int(x) for x in entry.split(":"))
+        except ValueError:
+            continue
+        samples.append((epoch, buffered, ingested))
+    samples.sort()
+    return samples
+
+
+def get_backlog_samples(rpi_id, minutes=BACKLOG_TREND_MINUTES):
+    cache = frappe.cache()
+    samples = parse_samples(cache.lrange(cache.make_key(_backlog_key(rpi_id)), 0, -1))
+    cutoff = int(add_to_date(now_datetime(), minutes=-float(minutes)).timestamp())
+    return [s for s in samples if s[0] >= cutoff]
+
+
+# ============================================================================
+# PROJECTION
+# ============================================================================
+
+def _slope(points):
+    """Least-squares slope of (x, y) points."""
+    n = len(points)
+    mean_x = sum(x for x, _y in points) / n
+    mean_y = sum(y for _x, y in points) / n
+    sxx = sum((x - mean_x) ** 2 for x, _y in points)
+    if not sxx:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+
+
+def project_backlog(samples, buffer_capacity=None):
+    """Backlog trend and projection from (epoch, buffered, ingested) samples,
+    oldest first. Rates are readings per minute; net_rate is the backlog's
+    trend, production_rate what the device records (ingest + net)."""
+    result = {"buffered": samples[-1][1] if samples else 0, "samples": len(samples),
+              "ingest_rate": None, "net_rate": None, "production_rate": None,
+              "status": "Unknown", "drain_seconds": None, "overflow_seconds": None}
+    if not samples:
+        return result
+    buffered = result["buffered"]
+    capacity = int(buffer_capacity or 0)
+    if capacity and buffered >= OVERFLOW_FILL_RATIO * capacity:
+        result["status"] = "Overflow Risk"
+
+    span = samples[-1][0] - samples[0][0]
+    if len(samples) < BACKLOG_MIN_SAMPLES or span < BACKLOG_MIN_SPAN_SECONDS:
+        if result["status"] == "Unknown" and not buffered:
+            result["status"] = "Idle"
+        return result
+
+    net = _slope([(t, b) for t, b, _i in samples]) * 60
+    ingested = samples[-1][2] - samples[0][2]
+    # A negative delta means the counter was reset (Redis restart)
+    ingest = ingested * 60 / span if ingested >= 0 else None
+    result.update(net_rate=round(net, 2), ingest_rate=round(ingest, 2) if ingest is not None else None,
+                  production_rate=round(ingest + net, 2) if ingest is not None else None)
+
+    if net < -BACKLOG_STABLE_RATE:
+        status = "Draining"
+        result["drain_seconds"] = round(buffered / -net * 60)
+    elif net > BACKLOG_STABLE_RATE:
+        status = "Growing"
+        if capacity:
+            result["overflow_seconds"] = round(max(capacity - buffered, 0) / net * 60)
+            if result["overflow_seconds"] < OVERFLOW_WARNING_HOURS * 3600:
+                status = "Overflow Risk"
+    else:
+        status = "Stable" if buffered else "Idle"
+    if result["status"] != "Overflow Risk":
+        result["status"] = status
+    return result
+
+
+def update_device_backlog(rpi_id, buffered_count, buffer_capacity=None, now=None):
+    """Record a buffer report and return the device's backlog projection
+    plus the IoT Device column values to store with it."""
+    now = now or now_datetime()
+    record_backlog_sample(rpi_id, buffered_count, now)
+    projection = project_backlog(get_backlog_samples(rpi_id), buffer_capacity)
+    projection["columns"] = {
+        "ingest_rate": projection["ingest_rate"],
+        "backlog_trend": projection["net_rate"],
+        "backlog_status": projection["status"],
+        "projected_drain_at": add_to_date(now, seconds=projection["drain_seconds"])
+        if projection["drain_seconds"] is not None else None,
+        "projected_overflow_at": add_to_date(now, seconds=projection["overflow_seconds"])
+        if projection["overflow_seconds"] is not None else None,
+    }
+    return projection
+
+
+# ============================================================================
+# FLEET VIEW
+# ============================================================================
+
+@frappe.whitelist()
+def get_fleet_backlog(include_series=0, minutes=BACKLOG_TREND_MINUTES):
+    """Backlog, ingest rate and projected drain or overflow per RPi, worst
+    first, plus fleet totals for sizing ingest capacity. include_series adds
+    each device's recent samples as compact arrays."""
+    include_series = int(include_series or 0)
+    now = now_datetime()
+    devices = frappe.db.sql("""
+        SELECT name AS rpi_id, device_name, warehouse, last_sync, buffered_count, buffer_capacity,
+               ingest_rate, backlog_trend, backlog_status, projected_drain_at, projected_overflow_at
+        FROM `tabIoT Device`
+        ORDER BY name
+    """, as_dict=True)
+
+    rank = {"Overflow Risk": 0, "Growing": 1, "Stable": 2, "Draining": 3, "Unknown": 4, "Idle": 5}
+    rows = []
+    for d in devices:
+        stale = not d.last_sync or time_diff_in_seconds(now, d.last_sync) > BACKLOG_STALE_MINUTES * 60
+        row = {
+            "rpi_id": d.rpi_id,
+            "device_name": d.device_name,
+            "warehouse": d.warehouse,
+            "last_sync": str(d.last_sync) if d.last_sync else None,
+            "stale": stale,
+            "buffered": d.buffered_count or 0,
+            "buffer_capacity": d.buffer_capacity or None,
+            "fill_pct": round(100 * (d.buffered_count or 0) / d.buffer_capacity, 1) if d.buffer_capacity else None,
+            "ingest_rate": d.ingest_rate,
+            "net_rate": d.backlog_trend,
+            "status": d.backlog_status or "Unknown",
+            "growing": d.backlog_status in ("Growing", "Overflow Risk"),
+            "projected_drain_at": str(d.projected_drain_at) if d.projected_drain_at else None,
+            "projected_overflow_at": str(d.projected_overflow_at) if d.projected_overflow_at else None,
+        }
+        if include_series:
+            samples = get_backlog_samples(d.rpi_id, minutes)
+            row["series"] = {"t": [s[0] for s in samples], "buffered": [s[1] for s in samples]}
+        rows.append(row)
+    rows.sort(key=lambda r: (rank.get(r["status"], 4), -r["buffered"]))
+
+    live = [r for r in rows if not r["stale"]]
+    total_buffered = sum(r["buffered"] for r in rows)
+    fleet_ingest = sum(r["ingest_rate"] or 0 for r in live)
+    fleet_net = sum(r["net_rate"] or 0 for r in live)
+    return {
+        "devices": rows,
+        "summary": {
+            "devices": len(rows),
+            "stale": len(rows) - len(live),
+            "total_buffered": total_buffered,
+            "ingest_rate": round(fleet_ingest, 2),
+            "net_rate": round(fleet_net, 2),
+            # What the fleet records; ingest has to keep above this
+            "production_rate": round(fleet_ingest + fleet_net, 2),
+            "drain_minutes": round(total_buffered / -fleet_net, 1) if fleet_net < 0 else None,
+            "growing": [r["rpi_id"] for r in rows if r["growing"]],
+            "overflow_risk": [r["rpi_id"] for r in rows if r["status"] == "Overflow Risk"],
+        },
+    }
@@ -0,0 +1,585 @@
+"""Phase 6.9: IoT Ingestion Gateway
+Optional standalone asyncio receiver for sensor uploads, so a fleet-wide
+reconnect lands on its own process instead of the desk's gunicorn workers.
+It accepts HTTP uploads (JSON or packed binary) and a local line-based
+publish socket, pre-validates rows against the sensor registry in the event
+loop, and flushes micro-batches (by size or age) to IoT Sensor Reading via
+iot_pipeline.ingest_batch from a single database thread.
+
+Devices authenticate with the ingest token of their IoT Device: HTTP
+uploads send "Authorization: token <rpi_id>:<token>" and socket publishers
+start with "AUTH <rpi_id> <token>". Readings are stored under the
+authenticated rpi_id; anything else gets 401.
+
+Backpressure: the row queue is bounded. HTTP uploads that do not fit get
+503 with Retry-After; socket publishers are simply not read until the
+queue drains, so the kernel's flow control slows them down. Uploads are
+also drawn from the ingest token buckets (iot_rate_limit) before they are
+queued: over the limit, HTTP gets 429 with Retry-After and the socket
+"ERR rate_limited <seconds>".
+
+Run it next to the bench (settings from the "iot_gateway" site_config key):
+    bench --site mysite execute rnd_warehouse_management.rnd_warehouse_management.iot_gateway.run
+or, from the bench's sites directory:
+    python -m rnd_warehouse_management.rnd_warehouse_management.iot_gateway --site mysite
+"""
+import frappe
+import argparse
+import asyncio
+import hmac
+import json
+import math
+import os
+import signal
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import SENSOR_RANGES, _check_range
+from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import CALIBRATION_INPUT_FIELDS
+from rnd_warehouse_management.rnd_warehouse_management.iot_rate_limit import check_rate_limit
+
+
+DEFAULT_GATEWAY_CONFIG = {
+    "host": "127.0.0.1",
+    "port": 8765,
+    "socket_path": None,
+    "batch_size": 500,
+    "max_wait_seconds": 1.0,
+    "queue_size": 20000,
+    "max_body_bytes": 4 * 1024 * 1024,
+    "retry_after_seconds": 2,
+    "registry_refresh_seconds": 60,
+    "require_token": True,
+}
+
+FLUSH_RETRIES = 3
+HTTP_REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+                405: "Method Not Allowed", 411: "Length Required", 413: "Payload Too Large",
+                429: "Too Many Requests", 503: "Service Unavailable"}
+
+
+def get_gateway_config(**overrides):
+    """DEFAULT_GATEWAY_CONFIG, then site_config "iot_gateway", then overrides."""
+    conf = dict(DEFAULT_GATEWAY_CONFIG)
+    conf.update(frappe.conf.get("iot_gateway") or {})
+    conf.update({k: v for k, v in overrides.items() if v is not None})
+    return conf
+
+
+# ============================================================================
+# PRE-VALIDATION - cheap checks done in the event loop, no database access
+# ============================================================================
+
+def prevalidate(row, sensors=None):
+    """Return a reject code for rows that can never be stored, else None.
+    sensors is the device registry's by_sensor map; a registered sensor_id
+    must report its registered sensor_type. Full validation (outliers, seq
+    dedup) still happens in ingest_batch."""
+    if not isinstance(row, dict):
+        return "invalid_row"
+    sensor_type = row.get("sensor_type")
+    if not sensor_type:
+        return "missing_sensor_type"
+    registered = (sensors or {}).get(row.get("sensor_id"))
+    if registered and registered.get("sensor_type") != sensor_type:
+        return "sensor_type_mismatch"
+    if "temperature" not in row and "value" not in row and any(
+            row.get(field) is not None for field in CALIBRATION_INPUT_FIELDS):
+        # Raw-only rows are calibrated in ingest_batch
+        return None
+    try:
+        value = float(row["temperature"] if "temperature" in row else row.get("value"))
+    except (ValueError, TypeError):
+        return "non_numeric"
+    if math.isnan(value) or math.isinf(value):
+        return "non_numeric"
+    if sensor_type in SENSOR_RANGES and _check_range(sensor_type, value):
+        return "out_of_range"
+    return None
+
+
+def parse_topic(topic):
+    """sensors/<rpi_id>/<sensor_type>/<sensor_id> -> row keys."""
+    parts = topic.split("/")
+    if len(parts) != 4 or parts[0] != "sensors" or not parts[2]:
+        raise ValueError(f"Invalid topic: {topic}")
+    row = {"sensor_type": parts[2]}
+    if parts[1]:
+        row["rpi_id"] = parts[1]
+    if parts[3]:
+        row["sensor_id"] = parts[3]
+    return row
+
+
+def parse_authorization(header):
+    """"token <rpi_id>:<token>" -> (rpi_id, token), else (None, None)."""
+    scheme, _, credentials = (header or "").strip().partition(" ")
+    rpi_id, sep, token = credentials.strip().partition(":")
+    if scheme.lower() != "token" or not sep or not rpi_id or not token:
+        return None, None
+    return rpi_id, token
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# ============================================================================
+# GATEWAY
+# ============================================================================
+
+class IngestGateway:
+    """Bounded row queue feeding one micro-batch flusher.
+    flush(rows) runs in executor (a single database thread) and must store
+    the rows; registry_loader() returns the by_sensor registry map and
+    token_loader() the {rpi_id: ingest token} map. With require_token, only
+    devices with a token can upload. rate_limiter(rows, rpi_id) returns None
+    or a 429 body with retry_after, like iot_rate_limit.check_rate_limit."""
+
+    def __init__(self, flush, executor=None, registry_loader=None, token_loader=None, rate_limiter=None,
+                 batch_size=500,
+                 max_wait_seconds=1.0, queue_size=20000, max_body_bytes=4 * 1024 * 1024,
+                 retry_after_seconds=2, registry_refresh_seconds=60, require_token=True, **_ignored):
+        self.flush = flush
+        self.executor = executor
+        self.registry_loader = registry_loader
+        self.token_loader = token_loader
+        self.rate_limiter = rate_limiter
+        self.require_token = bool(require_token)
+        self.tokens = {}
+        self.batch_size = int(batch_size)
+        self.max_wait_seconds = float(max_wait_seconds)
+        self.queue_size = int(queue_size)
+        self.max_body_bytes = int(max_body_bytes)
+        self.retry_after_seconds = int(retry_after_seconds)
+        self.registry_refresh_seconds = float(registry_refresh_seconds)
+        self.sensors = {}
+        self.queue = None
+        self.servers = []
+        self.tasks = []
+        self.stopping = None
+        self.stats = {"received": 0, "rejected": 0, "queued": 0, "flushed_rows": 0,
+                      "flushes": 0, "busy_responses": 0, "unauthorized": 0, "throttled": 0, "flush_errors": 0,
+                      "dropped_rows": 0, "last_flush_seconds": None}
+
+    # -- lifecycle ----------------------------------------------------------
+
+    async def start(self, host="127.0.0.1", port=8765, socket_path=None):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.stopping = asyncio.Event()
+        # Tokens are loaded before the first upload can arrive
+        if self.registry_loader or self.token_loader:
+            await self.refresh_registry()
+            self.tasks.append(asyncio.create_task(self.run_registry_refresh()))
+        self.servers.append(await asyncio.start_server(self.handle_http, host, port))
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            self.servers.append(await asyncio.start_unix_server(self.handle_publish, socket_path))
+        self.tasks.append(asyncio.create_task(self.run_batcher()))
+        return self.servers
+
+    async def stop(self):
+        """Stop accepting uploads, flush what is queued, then return."""
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.stopping.set()
+        await self.queue.join()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def serve(self, host="127.0.0.1", port=8765, socket_path=None):
+        await self.start(host, port, socket_path)
+        loop = asyncio.get_running_loop()
+        done = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, done.set)
+        frappe.logger().info(f"IoT gateway listening on http://{host}:{port}"
+                             + (f" and {socket_path}" if socket_path else ""))
+        await done.wait()
+        await self.stop()
+
+    # -- queueing -----------------------------------------------------------
+
+    def free_slots(self):
+        return self.queue.maxsize - self.queue.qsize()
+
+    def accept_rows(self, rows, rpi_id=None):
+        """Pre-validate rows. Returns (valid_rows, rejected) where rejected
+        lists {"index", "code"} for rows dropped here. With require_token,
+        rpi_id is the authenticated device and rows naming another are
+        rejected."""
+        valid = []
+        rejected = []
+        for index, row in enumerate(rows):
+            code = prevalidate(row, self.sensors)
+            if not code and self.require_token and row.get("rpi_id") not in (None, "", rpi_id):
+                code = "rpi_id_mismatch"
+            if code:
+                rejected.append({"index": index, "code": code})
+                continue
+            if rpi_id and not row.get("rpi_id"):
+                row["rpi_id"] = rpi_id
+            valid.append(row)
+        self.stats["received"] += len(rows)
+        self.stats["rejected"] += len(rejected)
+        return valid, rejected
+
+    def check_rate_limit(self, rows, rpi_id=None):
+        """None, or the rate limiter's 429 body when rows are over a limit."""
+        if not self.rate_limiter or not rows:
+            return None
+        limited = self.rate_limiter(rows, rpi_id)
+        if limited:
+            self.stats["throttled"] += 1
+        return limited
+
+    def enqueue_nowait(self, rows):
+        for row in rows:
+            self.queue.put_nowait(row)
+        self.stats["queued"] += len(rows)
+
+    # -- flushing -----------------------------------------------------------
+
+    async def run_batcher(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                    continue
+                except asyncio.QueueEmpty:
+                    pass
+                timeout = deadline - loop.time()
+                if timeout <= 0 or self.stopping.is_set():
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                await self.flush_batch(batch)
+            finally:
+                for _row in batch:
+                    self.queue.task_done()
+
+    async def flush_batch(self, rows):
+        """Flush in the database thread, retrying with backoff. While a flush
+        runs nothing else is dequeued, which is what builds backpressure."""
+        loop = asyncio.get_running_loop()
+        error = None
+        for attempt in range(FLUSH_RETRIES):
+            started = time.monotonic()
+            try:
+                await loop.run_in_executor(self.executor, self.flush, rows)
+            except Exception:
+                self.stats["flush_errors"] += 1
+                error = traceback.format_exc()
+                await self.log_error(error, f"IoT gateway flush failed (attempt {attempt + 1})")
+                await asyncio.sleep(2 ** attempt)
+                continue
+            self.stats["flushes"] += 1
+            self.stats["flushed_rows"] += len(rows)
+            self.stats["last_flush_seconds"] = round(time.monotonic() - started, 4)
+            return True
+        # Devices keep rows until next_expected_seq passes them, so they resend
+        self.stats["dropped_rows"] += len(rows)
+        await self.log_error(f"{len(rows)} rows dropped after {FLUSH_RETRIES} failed flushes; "
+                             f"devices resend them.\n\n{error}", "IoT gateway dropped rows")
+        return False
+
+    async def refresh_registry(self):
+        loop = asyncio.get_running_loop()
+        try:
+            if self.registry_loader:
+                self.sensors = await loop.run_in_executor(self.executor, self.registry_loader) or {}
+            if self.token_loader:
+                self.tokens = await loop.run_in_executor(self.executor, self.token_loader) or {}
+        except Exception:
+            await self.log_error(traceback.format_exc(), "IoT gateway registry refresh failed")
+
+    def authenticate(self, rpi_id, token):
+        """True when token is rpi_id's ingest token (or tokens are off)."""
+        if not self.require_token:
+            return True
+        expected = self.tokens.get(rpi_id) if rpi_id else None
+        if expected and token and hmac.compare_digest(str(expected).encode(), str(token).encode()):
+            return True
+        self.stats["unauthorized"] += 1
+        return False
+
+    async def log_error(self, message, title):
+        """Error Log entry, written from the database thread."""
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self.executor, _log_error, message, title)
+        except Exception:
+            # The database itself is down; flush_errors and dropped_rows on
+            # /health still count the failure
+            pass
+
+    async def run_registry_refresh(self):
+        while True:
+            await asyncio.sleep(self.registry_refresh_seconds)
+            await self.refresh_registry()
+
+    # -- HTTP ---------------------------------------------------------------
+
+    async def handle_http(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_http_request(reader)
+                    if request is None:
+                        break
+                    status, body, headers = await self.route(request)
+                except HttpError as e:
+                    request = None
+                    status, body, headers = e.status, {"error": e.message}, {}
+                keep_alive = bool(request) and request["headers"].get("connection", "").lower() != "close"
+                writer.write(_http_response(status, body, headers, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_http_request(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        try:
+            method, path, _version = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Malformed request line")
+        headers = {}
+        while True:
+            header = await reader.readline()
+            if header in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = header.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise HttpError(411, "Chunked uploads are not supported; send Content-Length")
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "Invalid Content-Length")
+        if length < 0:
+            raise HttpError(400, "Invalid Content-Length")
+        if length > self.max_body_bytes:
+            raise HttpError(413, f"Body larger than {self.max_body_bytes} bytes")
+        body = await reader.readexactly(length) if length else b""
+        return {"method": method.upper(), "path": path.split("?", 1)[0], "headers": headers, "body": body}
+
+    async def route(self, request):
+        if request["path"] == "/health":
+            return 200, dict(self.stats, queue_depth=self.queue.qsize(), queue_size=self.queue.maxsize), {}
+        if request["path"] != "/ingest":
+            raise HttpError(404, "Unknown path")
+        if request["method"] != "POST":
+            raise HttpError(405, "Use POST")
+
+        device, token = parse_authorization(request["headers"].get("authorization"))
+        if not self.authenticate(device, token):
+            raise HttpError(401, "Invalid or missing ingest token")
+        rpi_id = request["headers"].get("x-rpi-id")
+        rows = self.decode_body(request)
+        if isinstance(rows, dict):
+            rpi_id = rows.get("rpi_id") or rpi_id
+            rows = rows.get("readings")
+        if self.require_token:
+            if rpi_id and rpi_id != device:
+                self.stats["unauthorized"] += 1
+                raise HttpError(401, f"The token is not for rpi_id {rpi_id}")
+            rpi_id = device
+        if not isinstance(rows, list):
+            raise HttpError(400, "Body must be a list of readings or {\"readings\": [...]}")
+
+        valid, rejected = self.accept_rows(rows, rpi_id)
+        if len(valid) > self.free_slots():
+            self.stats["busy_responses"] += 1
+            return 503, {"error": "Gateway busy", "retry_after": self.retry_after_seconds,
+                         "queue_depth": self.queue.qsize()}, {"Retry-After": str(self.retry_after_seconds)}
+        limited = self.check_rate_limit(valid, rpi_id)
+        if limited:
+            return 429, limited, {"Retry-After": str(limited["retry_after"])}
+        self.enqueue_nowait(valid)
+        return 202, {"received": len(rows), "queued": len(valid), "rejected": rejected,
+                     "queue_depth": self.queue.qsize()}, {}
+
+    def decode_body(self, request):
+        content_type = request["headers"].get("content-type", "")
+        try:
+            if content_type.startswith("application/octet-stream"):
+                from rnd_warehouse_management.rnd_warehouse_management.iot_packed import decode_batch
+                return decode_batch(request["body"])
+            return json.loads(request["body"] or b"null")
+        except (ValueError, UnicodeDecodeError) as e:
+            raise HttpError(400, f"Invalid body: {e}")
+
+    # -- local publish socket -----------------------------------------------
+
+    async def handle_publish(self, reader, writer):
+        """Line protocol: "AUTH <rpi_id> <token>" -> "OK" or "ERR
+        unauthorized", then "PUB <topic> <json>" -> "OK <queued>" or
+        "ERR <code>"; "PING" -> "PONG". A full queue blocks the put, and
+        with it the reading of this connection."""
+        session = {"rpi_id": None}
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = await self.handle_publish_line(line.decode("utf-8").strip(), session)
+                writer.write((reply + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_publish_line(self, line, session=None):
+        session = {"rpi_id": None} if session is None else session
+        if line == "PING":
+            return "PONG"
+        command, _, rest = line.partition(" ")
+        if command == "AUTH":
+            rpi_id, _, token = rest.partition(" ")
+            if not self.authenticate(rpi_id, token):
+                return "ERR unauthorized"
+            session["rpi_id"] = rpi_id
+            return "OK"
+        if command != "PUB":
+            return "ERR unknown_command"
+        if self.require_token and not session["rpi_id"]:
+            return "ERR unauthorized"
+        topic, _, payload = rest.partition(" ")
+        try:
+            base = parse_topic(topic)
+            data = json.loads(payload)
+        except ValueError:
+            return "ERR invalid_message"
+        if self.require_token and base.get("rpi_id", session["rpi_id"]) != session["rpi_id"]:
+            return "ERR unauthorized"
+        rows = [dict(base, **item) for item in (data if isinstance(data, list) else [data])
+                if isinstance(item, dict)]
+        valid, rejected = self.accept_rows(rows, session["rpi_id"])
+        limited = self.check_rate_limit(valid, session["rpi_id"])
+        if limited:
+            return f"ERR rate_limited {limited['retry_after']}"
+        for row in valid:
+            await self.queue.put(row)
+        self.stats["queued"] += len(valid)
+        if rejected and not valid:
+            return f"ERR {rejected[0]['code']}"
+        return f"OK {len(valid)}"
+
+
+def _http_response(status, body, headers, keep_alive):
+    payload = json.dumps(body, default=str).encode()
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+             "Content-Type: application/json",
+             f"Content-Length: {len(payload)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + payload
+
+
+# ============================================================================
+# DATABASE THREAD
+# ============================================================================
+
+def _connect_db_thread(site, sites_path):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+
+
+def _log_error(message, title):
+    frappe.log_error(message, title)
+    frappe.db.commit()
+
+
+def _flush_to_db(rows):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import ingest_batch
+
+    try:
+        result = ingest_batch(rows)
+        frappe.db.commit()
+        return result
+    except Exception:
+        frappe.db.rollback()
+        raise
+
+
+def _load_sensor_registry():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_device_registry
+
+    return get_device_registry()["by_sensor"]
+
+
+def _load_device_tokens():
+    from frappe.utils.password import get_decrypted_password
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import IOT_DEVICE_DOCTYPE
+
+    tokens = {}
+    for name in frappe.get_all(IOT_DEVICE_DOCTYPE, pluck="name"):
+        token = get_decrypted_password(IOT_DEVICE_DOCTYPE, name, "ingest_token", raise_exception=False)
+        if token:
+            tokens[name] = token
+    return tokens
+
+
+# ============================================================================
+# ENTRY POINTS
+# ============================================================================
+
+def run(host=None, port=None, socket_path=None, batch_size=None, max_wait_seconds=None, queue_size=None):
+    """Run the gateway until SIGINT/SIGTERM. Needs an initialized site
+    (bench execute or main())."""
+    conf = get_gateway_config(host=host, port=port, socket_path=socket_path, batch_size=batch_size,
+                              max_wait_seconds=max_wait_seconds, queue_size=queue_size)
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="iot-gateway-db",
+                                  initializer=_connect_db_thread,
+                                  initargs=(frappe.local.site, frappe.local.sites_path))
+    gateway = IngestGateway(_flush_to_db, executor=executor, registry_loader=_load_sensor_registry,
+                            token_loader=_load_device_tokens, rate_limiter=check_rate_limit, **conf)
+    try:
+        asyncio.run(gateway.serve(conf["host"], int(conf["port"]), conf.get("socket_path")))
+    finally:
+        executor.shutdown(wait=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RND IoT ingestion gateway")
+    parser.add_argument("--site", required=True)
+    parser.add_argument("--sites-path", default=".")
+    parser.add_argument("--host")
+    parser.add_argument("--port", type=int)
+    parser.add_argument("--socket", dest="socket_path", help="Unix socket for PUB messages")
+    parser.add_argument("--batch-size", type=int)
+    parser.add_argument("--max-wait", dest="max_wait_seconds", type=float)
+    parser.add_argument("--queue-size", type=int)
+    args = parser.parse_args()
+
+    frappe.init(site=args.site, sites_path=args.sites_path)
+    frappe.connect()
+    try:
+        run(host=args.host, port=args.port, socket_path=args.socket_path, batch_size=args.batch_size,
+            max_wait_seconds=args.max_wait_seconds, queue_size=args.queue_size)
+    finally:
+        frappe.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""Phase 6.13: IoT Late Data
+Readings are bucketed on device_time, the time the RPi took them, not on
+when they reached the server. The lateness horizon (site_config
+iot_lateness_horizon_hours) splits the time axis in two:
+- hour buckets ending after now - horizon are maintained on ingest, so a
+  late reading is simply added to the (older) buckets it belongs to;
+- older hours are never touched on ingest. Readings for them mark the
+  (sensor_type, hour) dirty and reconcile_late_rollups rebuilds just those
+  hours from raw data, live and archived.
+Because the two sides never overlap, a rebuild can't race an additive
+update of the same bucket. Hours whose stored readings are changed in place
+(a calibration backfill) while still inside the horizon are deferred and
+marked dirty once they pass it. Lateness (arrival - device_time) is tracked per
+sensor type as hourly t-digests plus counters."""
+import frappe
+from frappe.utils import now_datetime, add_to_date, get_datetime
+from datetime import datetime, timedelta
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+    reading_time, floor_to_minutes, rebuild_rollups)
+from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import (
+    fold_into_sketches, merge_stored_sketches, sketch_quantile,
+    SKETCH_BUCKET_SECONDS, SKETCH_RETENTION_HOURS)
+
+
+DEFAULT_LATENESS_HORIZON_HOURS = 24
+# Readings taken more than this before they arrive count as late
+LATE_THRESHOLD_SECONDS = 60
+# Device clocks further ahead than this are not trusted
+MAX_CLOCK_SKEW_SECONDS = 300
+RECONCILE_MAX_HOURS_PER_RUN = 24
+
+DIRTY_HOURS_KEY = "iot_lateness|dirty_hours"
+DEFERRED_HOURS_KEY = "iot_lateness|deferred_hours"
+LATENESS_TYPES_KEY = "iot_lateness|types"
+
+# KEYS[1]: a type's counts hash. ARGV: hour bucket, rows, late, past_horizon,
+# max_seconds, ttl. Fields are "<bucket>|<counter>", so concurrent ingests
+# add to them in Redis instead of writing back what they read.
+COUNTS_SCRIPT = """
+local bucket = ARGV[1]
+redis.call('HINCRBY', KEYS[1], bucket .. '|rows', ARGV[2])
+redis.call('HINCRBY', KEYS[1], bucket .. '|late', ARGV[3])
+redis.call('HINCRBY', KEYS[1], bucket .. '|past_horizon', ARGV[4])
+local max_field = bucket .. '|max_seconds'
+if tonumber(ARGV[5]) > (tonumber(redis.call('HGET', KEYS[1], max_field)) or 0) then
+    redis.call('HSET', KEYS[1], max_field, ARGV[5])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[6])
+return 1
+"""
+COUNTERS = ("rows", "late", "past_horizon", "max_seconds")
+
+_counts_script = None
+
+
+def get_lateness_horizon():
+    return timedelta(hours=float(frappe.conf.get("iot_lateness_horizon_hours")
+                                 or DEFAULT_LATENESS_HORIZON_HOURS))
+
+
+def _lateness_key(sensor_type):
+    return f"iot_lateness|{sensor_type}"
+
+
+def _counts_key(sensor_type):
+    return f"iot_lateness_counts|{sensor_type}"
+
+
+def _hour_bucket(ts):
+    epoch = int(get_datetime(ts).timestamp())
+    return epoch - epoch % SKETCH_BUCKET_SECONDS
+
+
+# ============================================================================
+# INGEST
+# ============================================================================
+
+def resolve_device_time(value, now=None):
+    """Parse a row's device timestamp. Returns (device_time, warning);
+    device_time is None when missing, unparsable or too far in the future,
+    and the arrival time is used instead."""
+    if value in (None, ""):
+        return None, None
+    try:
+        device_time = get_datetime(value)
+    except Exception:
+        return None, f"Unparsable device timestamp {value!r}; using arrival time"
+    if not device_time:
+        return None, None
+    ahead = (device_time - (now or now_datetime())).total_seconds()
+    if ahead > MAX_CLOCK_SKEW_SECONDS:
+        return None, f"Device clock {ahead:.0f}s ahead; using arrival time"
+    return device_time, None
+
+
+def split_by_horizon(rows, now=None):
+    """(current, past): past rows belong to hours that ended before
+    now - horizon and are left to reconcile_late_rollups."""
+    boundary = (now or now_datetime()) - get_lateness_horizon()
+    current, past = [], []
+    for row in rows:
+        hour_end = floor_to_minutes(reading_time(row), 60) + timedelta(hours=1)
+        (past if hour_end <= boundary else current).append(row)
+    return current, past
+
+
+def _hour_members(rows):
+    return {f"{row['sensor_type']}|{_hour_bucket(reading_time(row))}"
+            for row in rows if row.get("sensor_type")}
+
+
+def mark_dirty_hours(rows):
+    """Queue the (sensor_type, hour) of past-horizon rows for reconciliation."""
+    members = _hour_members(rows)
+    if members:
+        cache = frappe.cache()
+        cache.sadd(DIRTY_HOURS_KEY, *members)
+
+
+def defer_dirty_hours(rows):
+    """Queue the (sensor_type, hour) of rows still inside the horizon; their
+    hours are marked dirty once they pass it (reconcile_late_rollups)."""
+    members = _hour_members(rows)
+    if members:
+        cache = frappe.cache()
+        cache.sadd(DEFERRED_HOURS_KEY, *members)
+
+
+def _promote_deferred_hours(now=None):
+    """Move deferred hours that have passed the horizon to the dirty set."""
+    boundary = (now or now_datetime()) - get_lateness_horizon()
+    cache = frappe.cache()
+    for member in cache.smembers(DEFERRED_HOURS_KEY) or ():
+        member = member.decode() if isinstance(member, bytes) else member
+        hour_end = datetime.fromtimestamp(int(member.rsplit("|", 1)[1])) + timedelta(hours=1)
+        if hour_end <= boundary:
+            cache.sadd(DIRTY_HOURS_KEY, member)
+            cache.srem(DEFERRED_HOURS_KEY, member)
+
+
+def record_lateness(rows, past=()):
+    """Fold arrival - device_time of ingested rows (current and past-horizon)
+    into the per-type lateness digests and counters of the current hour."""
+    now = now_datetime()
+    bucket = _hour_bucket(now)
+    values = {}
+    counts = {}
+    for is_past, group in ((False, rows), (True, past)):
+        for row in group:
+            sensor_type = row.get("sensor_type")
+            if not sensor_type:
+                continue
+            arrival = get_datetime(row.get("creation") or now)
+            lateness = max((arrival - reading_time(row, arrival)).total_seconds(), 0)
+            values.setdefault((_lateness_key(sensor_type), bucket), []).append(lateness)
+            c = counts.setdefault(sensor_type, {"rows": 0, "late": 0, "past_horizon": 0, "max_seconds": 0})
+            c["rows"] += 1
+            c["late"] += lateness > LATE_THRESHOLD_SECONDS
+            c["past_horizon"] += is_past
+            c["max_seconds"] = max(c["max_seconds"], lateness)
+    if not counts:
+        return
+
+    fold_into_sketches(values)
+    global _counts_script
+    cache = frappe.cache()
+    if _counts_script is None:
+        _counts_script = cache.register_script(COUNTS_SCRIPT)
+    for sensor_type, c in counts.items():
+        _counts_script(keys=[cache.make_key(_counts_key(sensor_type))],
+                       args=[bucket, c["rows"], c["late"], c["past_horizon"], c["max_seconds"],
+                             SKETCH_RETENTION_HOURS * 3600])
+    cache.sadd(LATENESS_TYPES_KEY, *counts)
+
+
+def _read_counts(sensor_types, cutoff):
+    """{sensor_type: totals} of the counters of hour buckets from cutoff on."""
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for sensor_type in sensor_types:
+        pipe.hgetall(cache.make_key(_counts_key(sensor_type)))
+    result = {}
+    for sensor_type, fields in zip(sensor_types, pipe.execute()):
+        totals = dict.fromkeys(COUNTERS, 0)
+        for field, value in (fields or {}).items():
+            field = field.decode() if isinstance(field, bytes) else field
+            bucket, _sep, counter = field.partition("|")
+            if counter not in totals or int(bucket) < cutoff:
+                continue
+            if counter == "max_seconds":
+                totals[counter] = max(totals[counter], float(value))
+            else:
+                totals[counter] += int(value)
+        result[sensor_type] = totals
+    return result
+
+
+# ============================================================================
+# RECONCILIATION (scheduler job)
+# ============================================================================
+
+def reconcile_late_rollups(max_hours=RECONCILE_MAX_HOURS_PER_RUN):
+    """Rebuild the rollups of the hours marked dirty by past-horizon
+    readings, oldest first, one (sensor_type, hour) at a time. Deferred
+    hours that have passed the horizon are added first."""
+    _promote_deferred_hours()
+    cache = frappe.cache()
+    members = sorted((m.decode() if isinstance(m, bytes) else m for m in cache.smembers(DIRTY_HOURS_KEY) or ()),
+                     key=lambda m: int(m.rsplit("|", 1)[1]))
+    rebuilt = []
+    for member in members[:int(max_hours)]:
+        sensor_type, epoch = member.rsplit("|", 1)
+        # Taken off first: readings arriving during the rebuild mark it again
+        cache.srem(DIRTY_HOURS_KEY, member)
+        # Bucket epochs come from naive local datetimes, so fromtimestamp inverts them
+        hour = datetime.fromtimestamp(int(epoch))
+        try:
+            rebuild_rollups(hour, hour + timedelta(hours=1), sensor_type)
+        except Exception:
+            frappe.db.rollback()
+            cache.sadd(DIRTY_HOURS_KEY, member)
+            frappe.log_error(frappe.get_traceback(), f"IoT late rollup reconciliation failed for {member}")
+            break
+        rebuilt.append({"sensor_type": sensor_type, "hour": str(hour)})
+    return {"rebuilt": rebuilt, "pending": max(len(members) - len(rebuilt), 0)}
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+@frappe.whitelist()
+def get_lateness_metrics(sensor_type=None, hours=24):
+    """How late readings arrive per sensor type over the last `hours`:
+    share of late readings, lateness percentiles, readings past the horizon
+    and hours still waiting for reconciliation."""
+    cache = frappe.cache()
+    if sensor_type:
+        types = [sensor_type]
+    else:
+        types = sorted(t.decode() if isinstance(t, bytes) else t
+                       for t in cache.smembers(LATENESS_TYPES_KEY) or ())
+    cutoff = _hour_bucket(add_to_date(now_datetime(), hours=-float(hours)))
+
+    counts = _read_counts(types, cutoff)
+    result = []
+    for t in types:
+        totals = counts[t]
+        sketch = merge_stored_sketches([_lateness_key(t)], hours)
+        entry = {"sensor_type": t, "readings": totals["rows"], "late": totals["late"],
+                 "late_pct": round(100 * totals["late"] / totals["rows"], 2) if totals["rows"] else None,
+                 "past_horizon": totals["past_horizon"], "max_seconds": totals["max_seconds"]}
+        for q in (0.5, 0.95, 0.99):
+            value = sketch_quantile(sketch, q)
+            entry[f"p{int(q * 100)}_seconds"] = round(value, 1) if value is not None else None
+        result.append(entry)
+
+    return {
+        "hours": float(hours),
+        "horizon_hours": get_lateness_horizon().total_seconds() / 3600,
+        "late_threshold_seconds": LATE_THRESHOLD_SECONDS,
+        "pending_reconciliation": len(cache.smembers(DIRTY_HOURS_KEY) or ()),
+        "deferred_reconciliation": len(cache.smembers(DEFERRED_HOURS_KEY) or ()),
+        "sensor_types": result,
+    }
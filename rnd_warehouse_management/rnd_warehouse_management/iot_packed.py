@@ -0,0 +1,336 @@
+"""Phase 6.8: Packed Binary Ingest
+Columnar binary upload format for RPi buffer flushes. A batch holds one
+section per sensor: a small header followed by packed int64 timestamps and
+one packed float array per field. The server decodes the arrays with
+memoryview casts (no per-value parsing) and hands the rows to the same
+validation, dedup and insert path as the JSON endpoint.
+
+Layout (little-endian):
+    batch   := MAGIC "IOTP" | version u8 | flags u8 | section_count u16 | section*
+    section := sensor_type str | sensor_id str | rpi_id str
+               | count u32 | field_count u8 | base_seq i64 (-1 = no seq)
+               | timestamps int64[count] (epoch microseconds, UTC)
+               | field*
+    field   := name str | typecode u8 | [decimals u8, "i" only] | values[count]
+    str     := length u8 | utf-8 bytes
+Typecodes: "i" int32 fixed-point (value * 10**decimals, exact and the
+cheapest to decode), "f" float32, "d" float64. Missing values are NaN, or
+INT32_MIN for "i"."""
+import frappe
+from frappe.utils import now_datetime, convert_utc_to_system_timezone
+import base64
+import json
+import math
+import struct
+import sys
+import time
+from array import array
+from datetime import datetime, timedelta
+
+
+PACKED_MAGIC = b"IOTP"
+PACKED_VERSION = 1
+PACKED_TYPECODES = ("i", "f", "d")
+DEFAULT_FIXED_DECIMALS = 2
+FIXED_MISSING = -2 ** 31
+
+# float32 carries ~7 significant digits; round it back to what sensors report
+FLOAT32_DECIMALS = 4
+
+_BATCH_HEADER = struct.Struct("<4sBBH")
+_SECTION_HEADER = struct.Struct("<IBq")
+_EPOCH = datetime(1970, 1, 1)
+_LITTLE_ENDIAN = sys.byteorder == "little"
+
+
+# ============================================================================
+# ENCODING - used by the RPi client, tests and the benchmark
+# ============================================================================
+
+def _pack_str(text):
+    data = (text or "").encode("utf-8")
+    if len(data) > 255:
+        raise ValueError(f"String too long for packed header: {text[:32]}...")
+    return struct.pack("<B", len(data)) + data
+
+
+def _packed_array(typecode, values):
+    arr = array(typecode, values)
+    if not _LITTLE_ENDIAN:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def encode_section(sensor_type, timestamps, fields, sensor_id=None, rpi_id=None, base_seq=None,
+                   typecode="i", decimals=DEFAULT_FIXED_DECIMALS):
+    """Pack one sensor's readings.
+    timestamps: epoch microseconds (int) or datetimes (naive UTC).
+    fields: {"temperature": [..], "humidity": [..]}; None means missing.
+    decimals only applies to the "i" fixed-point typecode."""
+    if typecode not in PACKED_TYPECODES:
+        raise ValueError(f"Unsupported typecode: {typecode}")
+    count = len(timestamps)
+    micros = [t if isinstance(t, int) else (t - _EPOCH) // timedelta(microseconds=1)
+              for t in timestamps]
+
+    parts = [
+        _pack_str(sensor_type), _pack_str(sensor_id), _pack_str(rpi_id),
+        _SECTION_HEADER.pack(count, len(fields), -1 if base_seq is None else int(base_seq)),
+        _packed_array("q", micros),
+    ]
+    for name, values in fields.items():
+        if len(values) != count:
+            raise ValueError(f"Field {name} has {len(values)} values, expected {count}")
+        parts.append(_pack_str(name))
+        parts.append(typecode.encode())
+        if typecode == "i":
+            scale = 10 ** decimals
+            parts.append(struct.pack("<B", decimals))
+            values = [FIXED_MISSING if v is None else int(round(v * scale)) for v in values]
+        else:
+            values = [math.nan if v is None else v for v in values]
+        parts.append(_packed_array(typecode, values))
+    return b"".join(parts)
+
+
+def encode_batch(sections):
+    """Join encoded sections into one upload payload."""
+    if len(sections) > 0xFFFF:
+        raise ValueError("Too many sections in one batch")
+    return _BATCH_HEADER.pack(PACKED_MAGIC, PACKED_VERSION, 0, len(sections)) + b"".join(sections)
+
+
+# ============================================================================
+# DECODING
+# ============================================================================
+
+def _read_str(view, offset):
+    (length,) = struct.unpack_from("<B", view, offset)
+    offset += 1
+    end = offset + length
+    if end > len(view):
+        raise ValueError("Truncated packed payload")
+    return bytes(view[offset:end]).decode("utf-8"), end
+
+
+def _read_array(view, offset, typecode, count):
+    """Values of a packed array. On little-endian hosts the payload bytes
+    are reinterpreted in place (memoryview.cast) rather than copied."""
+    size = array(typecode).itemsize * count
+    end = offset + size
+    if end > len(view):
+        raise ValueError("Truncated packed payload")
+    chunk = view[offset:end]
+    if _LITTLE_ENDIAN:
+        return chunk.cast(typecode).tolist(), end
+    arr = array(typecode, chunk)
+    arr.byteswap()
+    return arr.tolist(), end
+
+
+def _utc_offset(micros):
+    """System timezone offset at the given UTC instant."""
+    utc = _EPOCH + timedelta(microseconds=micros)
+    local = convert_utc_to_system_timezone(utc).replace(tzinfo=None)
+    return local - utc
+
+
+def decode_batch(payload):
+    """Decode a packed payload into reading dicts (sensor_type, sensor_id,
+    rpi_id, seq, timestamp and one key per field). NaN values are dropped
+    so they read as missing, as in the JSON format."""
+    view = memoryview(payload)
+    if len(view) < _BATCH_HEADER.size:
+        raise ValueError("Truncated packed payload")
+    magic, version, _flags, section_count = _BATCH_HEADER.unpack_from(view, 0)
+    if magic != PACKED_MAGIC:
+        raise ValueError("Not a packed IoT batch")
+    if version != PACKED_VERSION:
+        raise ValueError(f"Unsupported packed batch version: {version}")
+
+    offset = _BATCH_HEADER.size
+    rows = []
+    for _ in range(section_count):
+        sensor_type, offset = _read_str(view, offset)
+        sensor_id, offset = _read_str(view, offset)
+        rpi_id, offset = _read_str(view, offset)
+        if offset + _SECTION_HEADER.size > len(view):
+            raise ValueError("Truncated packed payload")
+        count, field_count, base_seq = _SECTION_HEADER.unpack_from(view, offset)
+        offset += _SECTION_HEADER.size
+        micros, offset = _read_array(view, offset, "q", count)
+
+        columns = []
+        for _ in range(field_count):
+            name, offset = _read_str(view, offset)
+            typecode = bytes(view[offset:offset + 1]).decode()
+            if typecode not in PACKED_TYPECODES:
+                raise ValueError(f"Unsupported typecode: {typecode!r}")
+            offset += 1
+            if typecode == "i":
+                (decimals,) = struct.unpack_from("<B", view, offset)
+                offset += 1
+            values, offset = _read_array(view, offset, typecode, count)
+            if typecode == "i":
+                # True division is correctly rounded: 2130 / 100 == 21.3
+                divisor = 10 ** decimals
+                if FIXED_MISSING in values:
+                    values = [math.nan if v == FIXED_MISSING else v / divisor for v in values]
+                else:
+                    values = [v / divisor for v in values]
+            elif typecode == "f":
+                values = [round(v, FLOAT32_DECIMALS) for v in values]
+            columns.append((name, values))
+
+        if not count:
+            continue
+        template = {"sensor_type": sensor_type}
+        if sensor_id:
+            template["sensor_id"] = sensor_id
+        if rpi_id:
+            template["rpi_id"] = rpi_id
+        # One timezone lookup per section; sections span seconds to minutes
+        base_time = _EPOCH + _utc_offset(micros[0])
+        keys = ["timestamp"]
+        arrays = [[base_time + timedelta(microseconds=us) for us in micros]]
+        if base_seq >= 0:
+            keys.append("seq")
+            arrays.append(range(base_seq, base_seq + count))
+        sparse = []
+        for name, values in columns:
+            keys.append(name)
+            arrays.append(values)
+            if any(v != v for v in values):
+                sparse.append(name)
+
+        section_rows = []
+        for values in zip(*arrays):
+            row = template.copy()
+            row.update(zip(keys, values))
+            section_rows.append(row)
+        for name in sparse:
+            for row in section_rows:
+                if row[name] != row[name]:
+                    del row[name]
+        rows.extend(section_rows)
+
+    if offset != len(view):
+        raise ValueError("Trailing bytes after packed payload")
+    return rows
+
+
+# ============================================================================
+# INGEST ENDPOINT
+# ============================================================================
+
+@frappe.whitelist(methods=["POST"])
+def ingest_packed(payload=None, rpi_id=None):
+    """Packed binary counterpart of iot_pipeline.ingest_readings.
+    The payload is the raw request body (application/octet-stream), or a
+    base64 string in `payload`. Only rows that were not stored ("ok") are
+    listed in results, to keep the response small."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        ingest_batch, INGEST_MAX_BATCH)
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rate_limit import check_rate_limit
+
+    if payload:
+        data = base64.b64decode(payload)
+    else:
+        data = frappe.request.get_data() if frappe.request else b""
+    if not data:
+        return {"error": "Empty payload"}
+
+    try:
+        rows = decode_batch(data)
+    except (ValueError, struct.error, UnicodeDecodeError) as e:
+        return {"error": f"Invalid packed payload: {e}"}
+    if len(rows) > INGEST_MAX_BATCH:
+        return {"error": f"Batch too large: {len(rows)} rows (max {INGEST_MAX_BATCH})"}
+    limited = check_rate_limit(rows, rpi_id)
+    if limited:
+        return limited
+    if not frappe.db.exists("DocType", "IoT Sensor Reading"):
+        return {"error": "IoT Sensor Reading doctype not found"}
+
+    response = ingest_batch(rows, rpi_id=rpi_id)
+    response["results"] = [r for r in response["results"] if r.get("code") not in ("ok", "spooled")]
+    response["payload_bytes"] = len(data)
+    return response
+
+
+# ============================================================================
+# BENCHMARK - bench execute ...iot_packed.benchmark
+# ============================================================================
+
+def _sample_columns(sensors, readings_per_sensor):
+    """Columnar buffers as an RPi keeps them: {sensor_id: (timestamps, fields)}."""
+    start = int((now_datetime() - _EPOCH).total_seconds()) * 1000000
+    buffers = {}
+    for s in range(sensors):
+        timestamps = [start + i * 10000000 for i in range(readings_per_sensor)]
+        buffers[f"BENCH-{s:02d}"] = (timestamps, {
+            "temperature": [round(20 + s + (i % 50) * 0.1, 1) for i in range(readings_per_sensor)],
+            "humidity": [round(45 + (i % 30) * 0.5, 1) for i in range(readings_per_sensor)],
+        })
+    return buffers
+
+
+def _encode_json(buffers):
+    rows = []
+    for sensor_id, (timestamps, fields) in buffers.items():
+        for i, ts in enumerate(timestamps):
+            rows.append({
+                "sensor_type": "DHT22", "sensor_id": sensor_id, "rpi_id": "RPi-BENCH", "seq": 1 + i,
+                "timestamp": (_EPOCH + timedelta(microseconds=ts)).isoformat(sep=" "),
+                "temperature": fields["temperature"][i], "humidity": fields["humidity"][i],
+            })
+    return json.dumps(rows).encode()
+
+
+def _encode_packed(buffers, typecode="i"):
+    return encode_batch([
+        encode_section("DHT22", timestamps, fields, sensor_id=sensor_id, rpi_id="RPi-BENCH",
+                       base_seq=1, typecode=typecode)
+        for sensor_id, (timestamps, fields) in buffers.items()
+    ])
+
+
+def _decode_json(payload):
+    """What the JSON endpoint needs before validation: rows plus a parsed
+    device timestamp."""
+    rows = json.loads(payload)
+    for row in rows:
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return rows
+
+
+def benchmark(sensors=10, readings_per_sensor=500, repeat=20):
+    """Payload size, client encode time and server decode time for the same
+    readings as JSON and as packed fixed-point / float32 / float64. Pure Python, no
+    database access: bench execute rnd_warehouse_management.rnd_warehouse_management.iot_packed.benchmark"""
+    buffers = _sample_columns(int(sensors), int(readings_per_sensor))
+
+    def best_of(fn):
+        timings = []
+        for _ in range(int(repeat)):
+            started = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - started)
+        return round(min(timings) * 1000, 3)
+
+    result = {"rows": int(sensors) * int(readings_per_sensor)}
+    formats = {
+        "json": (lambda: _encode_json(buffers), _decode_json),
+        "packed_i32": (lambda: _encode_packed(buffers, "i"), decode_batch),
+        "packed_f32": (lambda: _encode_packed(buffers, "f"), decode_batch),
+        "packed_f64": (lambda: _encode_packed(buffers, "d"), decode_batch),
+    }
+    for name, (encode, decode) in formats.items():
+        payload = encode()
+        result[name] = {
+            "bytes": len(payload),
+            "encode_ms": best_of(encode),
+            "decode_ms": best_of(lambda: decode(payload)),
+        }
+    print(json.dumps(result, indent=2))
+    return result
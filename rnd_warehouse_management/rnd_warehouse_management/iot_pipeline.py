@@ -3,11 +3,29 @@ Data validation, health monitoring, buffering support, drift detection,
 and compression for production-grade IoT pipeline reliability."""
 import frappe
 from frappe import _
-from frappe.utils import now_datetime, add_to_date, time_diff_in_seconds
+from frappe.utils import now_datetime, add_to_date, time_diff_in_seconds, get_datetime
+import bisect
+import hashlib
 import json
 import math
+import time
 from datetime import datetime, timedelta
 
+from rnd_warehouse_management.rnd_warehouse_management import iot_spool
+from rnd_warehouse_management.rnd_warehouse_management.iot_uptime import (
+    update_gap_index, close_gaps, get_sensor_uptime)
+from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import (
+    update_quantile_sketches, get_robust_stats, robust_outlier_warning)
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+    update_rollups, aggregate_series, floor_to_minutes, reading_time)
+from rnd_warehouse_management.rnd_warehouse_management.iot_compression import storage_filter, is_compressed
+from rnd_warehouse_management.rnd_warehouse_management.iot_fleet import (
+    count_device_ingest, update_device_backlog, get_fleet_backlog)
+from rnd_warehouse_management.rnd_warehouse_management.iot_lateness import (
+    resolve_device_time, split_by_horizon, mark_dirty_hours, record_lateness)
+from rnd_warehouse_management.rnd_warehouse_management.iot_rate_limit import check_rate_limit, get_throttle_stats
+from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import calibrate_batch
+
 
 # ============================================================================
 # SENSOR VALIDATION - Range checks, outlier detection
@@ -29,8 +47,12 @@ SENSOR_RANGES = {
 
 
 @frappe.whitelist()
-def validate_sensor_reading(sensor_type, value, field="temperature"):
+def validate_sensor_reading(sensor_type, value, field="temperature", sensor_id=None, rpi_id=None):
     """Validate a sensor reading: range check + outlier detection."""
+    limited = check_rate_limit([{"sensor_type": sensor_type, "sensor_id": sensor_id}], rpi_id)
+    if limited:
+        return dict(limited, valid=False, errors=["rate_limited"])
+
     try:
         value = float(value)
     except (ValueError, TypeError):
@@ -41,23 +63,19 @@ def validate_sensor_reading(sensor_type, value, field="temperature"):
 
     # Range check
     if sensor_type in SENSOR_RANGES:
-        r = SENSOR_RANGES[sensor_type]
-        if value < r["min"] or value > r["max"]:
-            errors.append(f"Out of range [{r['min']}, {r['max']}] {r['unit']}")
+        range_error = _check_range(sensor_type, value)
+        if range_error:
+            errors.append(range_error)
     else:
         warnings.append(f"Unknown sensor type: {sensor_type}, skipping range check")
 
-    # Outlier detection (3-sigma from recent readings)
-    if frappe.db.exists("DocType", "IoT Sensor Reading"):
-        try:
-            stats = get_sensor_stats(sensor_type, minutes=30)
-            if stats and stats.get("count", 0) >= 5:
-                mean = stats["mean"]
-                std = stats["std"]
-                if std > 0 and abs(value - mean) > 3 * std:
-                    warnings.append(f"Outlier: value {value} is {abs(value - mean) / std:.1f} sigma from mean {mean:.1f}")
-        except Exception:
-            pass
+    # Outlier detection (median/MAD from the quantile sketches)
+    try:
+        outlier = _outlier_warning(value, _get_outlier_stats(sensor_type, sensor_id))
+        if outlier:
+            warnings.append(outlier)
+    except Exception:
+        pass
 
     return {
         "valid": len(errors) == 0,
@@ -68,164 +86,1294 @@ def validate_sensor_reading(sensor_type, value, field="temperature"):
     }
 
 
-def get_sensor_stats(sensor_type, minutes=30):
-    """Get statistical summary of recent readings for a sensor type."""
-    if not frappe.db.exists("DocType", "IoT Sensor Reading"):
-        return None
+def _check_range(sensor_type, value):
+    """Return an error message if value is outside SENSOR_RANGES, else None."""
+    r = SENSOR_RANGES.get(sensor_type)
+    if r and (value < r["min"] or value > r["max"]):
+        return f"Out of range [{r['min']}, {r['max']}] {r['unit']}"
+    return None
 
-    cutoff = add_to_date(now_datetime(), minutes=-minutes)
-    readings = frappe.db.sql("""
-        SELECT temperature FROM `tabIoT Sensor Reading`
-        WHERE sensor_type = %s AND creation >= %s AND temperature IS NOT NULL
-        ORDER BY creation DESC LIMIT 100
-    """, (sensor_type, cutoff), as_dict=True)
 
-    if not readings:
-        return {"count": 0}
+def _outlier_warning(value, stats):
+    """Return a robust (median/MAD) outlier warning for value, else None.
+    The mean and sigma are dragged along by thermistor spikes; the median
+    and MAD of the quantile sketches are not."""
+    return robust_outlier_warning(value, stats)
 
-    values = [r.temperature for r in readings if r.temperature is not None]
-    if not values:
-        return {"count": 0}
 
-    n = len(values)
-    mean = sum(values) / n
-    variance = sum((v - mean) ** 2 for v in values) / n if n > 1 else 0
-    std = math.sqrt(variance)
+def _get_outlier_stats(sensor_type, sensor_id=None):
+    """Median/MAD used for outlier checks, from the last hour's quantile
+    sketches: per sensor_id when it has enough history, otherwise the whole
+    sensor type."""
+    return get_robust_stats(sensor_type, sensor_id, hours=1)
 
-    return {
+
+# ============================================================================
+# ROLLING STATISTICS CACHE - Welford buckets in Redis, updated on ingest
+# ============================================================================
+
+# Each sensor key holds one Welford accumulator (count, mean, M2) per time bucket.
+# Windows are answered by merging the buckets that overlap them, and buckets
+# older than the retention are evicted on write.
+STATS_BUCKET_SECONDS = 300
+STATS_RETENTION_MINUTES = 120
+STATS_LOCK_TIMEOUT = 10
+
+
+def _stats_cache_key(sensor_type, sensor_id=None):
+    if sensor_id:
+        return f"iot_stats|{sensor_type}|{sensor_id}"
+    return f"iot_stats|{sensor_type}"
+
+
+def _stats_bucket(ts):
+    """Start (epoch seconds) of the stats bucket containing datetime ts."""
+    epoch = int(ts.timestamp())
+    return epoch - epoch % STATS_BUCKET_SECONDS
+
+
+def _merge_welford(a, b):
+    """Merge two Welford accumulators (Chan et al. parallel update)."""
+    if not a or not a["count"]:
+        return dict(b)
+    if not b or not b["count"]:
+        return dict(a)
+    n = a["count"] + b["count"]
+    delta = b["mean"] - a["mean"]
+    merged = {
         "count": n,
-        "mean": mean,
-        "std": std,
-        "min": min(values),
-        "max": max(values),
-        "latest": values[0]
+        "mean": a["mean"] + delta * b["count"] / n,
+        "m2": a["m2"] + b["m2"] + delta * delta * a["count"] * b["count"] / n,
+        "min": min(a["min"], b["min"]),
+        "max": max(a["max"], b["max"]),
     }
+    latest = a if a.get("latest_ts", 0) > b.get("latest_ts", 0) else b
+    merged["latest"] = latest["latest"]
+    merged["latest_ts"] = latest["latest_ts"]
+    return merged
+
+
+def _welford_add(acc, value, epoch):
+    """Add one value to a Welford accumulator (in place)."""
+    acc["count"] += 1
+    delta = value - acc["mean"]
+    acc["mean"] += delta / acc["count"]
+    acc["m2"] += delta * (value - acc["mean"])
+    acc["min"] = min(acc["min"], value)
+    acc["max"] = max(acc["max"], value)
+    if epoch >= acc["latest_ts"]:
+        acc["latest"] = value
+        acc["latest_ts"] = epoch
+
+
+def update_rolling_stats(rows):
+    """Fold ingested rows into the per-sensor-type and per-sensor_id caches.
+    Rows are grouped per key and bucket first, so each bucket costs one
+    read and one write regardless of batch size. The read-merge-write of a
+    sensor type's buckets runs under that type's lock, so concurrent
+    ingests don't overwrite each other's counts."""
+    now = now_datetime()
+    cutoff = _stats_bucket(add_to_date(now, minutes=-STATS_RETENTION_MINUTES))
+    partials = {}
+    for row in rows:
+        value = row.get("temperature")
+        sensor_type = row.get("sensor_type")
+        if value is None or not sensor_type:
+            continue
+        ts = reading_time(row, now)
+        epoch = int(ts.timestamp())
+        bucket = _stats_bucket(ts)
+        if bucket < cutoff:
+            continue
+        value = float(value)
+        keys = [_stats_cache_key(sensor_type)]
+        if row.get("sensor_id"):
+            keys.append(_stats_cache_key(sensor_type, row.get("sensor_id")))
+        type_partials = partials.setdefault(sensor_type, {})
+        for key in keys:
+            acc = type_partials.get((key, bucket))
+            if acc is None:
+                acc = type_partials[(key, bucket)] = {
+                    "count": 0, "mean": 0.0, "m2": 0.0,
+                    "min": value, "max": value, "latest": value, "latest_ts": epoch
+                }
+            _welford_add(acc, value, epoch)
+
+    cache = frappe.cache()
+    for sensor_type in sorted(partials):
+        lock = cache.lock(cache.make_key(f"iot_stats_lock|{sensor_type}"), timeout=STATS_LOCK_TIMEOUT)
+        lock.acquire()
+        try:
+            touched = set()
+            for (key, bucket), acc in partials[sensor_type].items():
+                existing = cache.hget(key, str(bucket))
+                cache.hset(key, str(bucket), _merge_welford(existing, acc))
+                touched.add(key)
+
+            for key in touched:
+                stale = [k for k in cache.hkeys(key) if int(k) < cutoff]
+                for k in stale:
+                    cache.hdel(key, k.decode() if isinstance(k, bytes) else k)
+                cache.expire(cache.make_key(key), STATS_RETENTION_MINUTES * 60)
+        finally:
+            try:
+                lock.release()
+            except Exception:
+                # Expired while the buckets were written; nothing to release
+                pass
+
+
+def get_sensor_stats(sensor_type, minutes=30, sensor_id=None, rpi_id=None):
+    """Get statistical summary of recent readings for a sensor type, one
+    sensor_id (or a list of them) or the sensors of one rpi_id, from the
+    rolling stats cache. No SQL is issued."""
+    cutoff = _stats_bucket(add_to_date(now_datetime(), minutes=-int(minutes)))
+    sensor_ids = resolve_sensor_filter(sensor_id, rpi_id)
+    if sensor_ids is None:
+        keys = [_stats_cache_key(sensor_type)]
+    else:
+        keys = [_stats_cache_key(sensor_type, sid) for sid in sensor_ids]
+
+    acc = None
+    for key in keys:
+        for bucket, partial in (frappe.cache().hgetall(key) or {}).items():
+            if int(bucket) >= cutoff:
+                acc = _merge_welford(acc, partial)
+
+    if not acc or not acc["count"]:
+        return {"count": 0}
+
+    return {
+        "count": acc["count"],
+        "mean": acc["mean"],
+        "std": math.sqrt(acc["m2"] / acc["count"]) if acc["count"] > 1 else 0,
+        "min": acc["min"],
+        "max": acc["max"],
+        "latest": acc["latest"]
+    }
+
+
+def on_reading_before_insert(doc, method=None):
+    """doc_events hook: stamp device_time on readings inserted one at a time
+    through the REST API, falling back to the arrival time."""
+    if frappe.request:
+        limited = check_rate_limit([doc.as_dict()])
+        if limited:
+            frappe.throw(limited["error"], frappe.TooManyRequestsError)
+    device_time, _warning = resolve_device_time(doc.get("device_time"))
+    doc.device_time = device_time or now_datetime()
+    row = doc.as_dict()
+    if calibrate_batch([row]):
+        doc.update({field: row[field] for field in ("temperature", "humidity", "calibration") if field in row})
+
+
+def on_reading_insert(doc, method=None):
+    """doc_events hook: keep derived data current for readings inserted
+    one at a time through the REST API instead of ingest_readings."""
+    _after_ingest([doc.as_dict()])
 
 
 # ============================================================================
-# SENSOR HEALTH MONITORING
+# BULK INGESTION - One validation pass, one multi-row insert, one commit
 # ============================================================================
 
+INGEST_MAX_BATCH = 5000
+
+# Columns the server owns; never taken from the client payload
+INGEST_RESERVED_FIELDS = ("name", "owner", "creation", "modified", "modified_by",
+                          "docstatus", "idx", "parent", "parentfield", "parenttype")
+
+
 @frappe.whitelist()
-def check_sensor_health(sensor_type=None):
-    """Check health status of sensors. Returns uptime, error rate, last reading."""
+def ingest_readings(batch, rpi_id=None):
+    """Validate and store a batch of sensor readings (RPi buffer flush).
+    batch: list of {"sensor_type": str, "sensor_id": str, "temperature": float, ...}
+    ("value" is accepted as an alias for "temperature").
+    Rows stamped with "seq" (and rpi_id, per row or for the whole batch) are
+    accepted at most once per device; replays come back as "duplicate".
+    Returns per-row accept/reject codes in the order the rows were sent."""
+    if isinstance(batch, str):
+        batch = json.loads(batch)
+    if not isinstance(batch, list):
+        return {"error": "batch must be a list of readings"}
+    if len(batch) > INGEST_MAX_BATCH:
+        return {"error": f"Batch too large: {len(batch)} rows (max {INGEST_MAX_BATCH})"}
+    limited = check_rate_limit(batch, rpi_id)
+    if limited:
+        return limited
     if not frappe.db.exists("DocType", "IoT Sensor Reading"):
         return {"error": "IoT Sensor Reading doctype not found"}
 
-    if sensor_type:
-        return _check_single_sensor_health(sensor_type)
+    return ingest_batch(batch, rpi_id=rpi_id)
+
+
+def ingest_batch(batch, rpi_id=None, spool=True, received_at=None, before_commit=None):
+    """Validate, deduplicate and insert already-decoded reading dicts.
+    Shared by the JSON and packed binary ingest endpoints.
+    While the database is slow, valid rows go to the local spool instead
+    (status "accepted", code "spooled") and iot_spool.drain_spool inserts
+    them later. received_at (one datetime per batch row) and before_commit
+    are used by that replay.
+    With swinging-door compression on (iot_compression), accepted rows
+    the door drops are not stored; "stored" counts the rows actually
+    inserted.
+    Rows of sensors with an IoT Sensor Calibration get their value computed
+    from the raw input first (iot_calibration)."""
+    calibrate_batch(batch)
+    results, accepted = validate_reading_batch(batch)
+    if spool and accepted and iot_spool.should_spool():
+        return _spool_batch(batch, results, accepted, rpi_id)
+
+    started = time.monotonic()
+    try:
+        accepted, devices = _filter_replayed(batch, results, accepted, rpi_id)
+        _stamp_arrival(accepted, received_at)
+        with storage_filter(accepted) as stored:
+            names = _bulk_insert_readings(stored)
+            for (index, row), name in zip(stored, names):
+                row["name"] = name
+                if index is not None:
+                    results[index]["name"] = name
+            if before_commit:
+                before_commit()
+            if names or devices or before_commit:
+                # Releases the device row locks taken by _filter_replayed
+                frappe.db.commit()
+    except (frappe.QueryTimeoutError, frappe.QueryDeadlockError):
+        frappe.db.rollback()
+        iot_spool.mark_db_slow("lock timeout on ingest")
+        if not spool:
+            raise
+        return _spool_batch(batch, results, accepted, rpi_id)
+    iot_spool.record_db_latency(time.monotonic() - started)
+    if accepted:
+        _after_ingest([row for _index, row in accepted])
+
+    duplicates = sum(1 for r in results if r.get("code") == "duplicate")
+    response = {
+        "received": len(batch),
+        "accepted": len(accepted),
+        "stored": len(names),
+        "duplicates": duplicates,
+        "rejected": len(batch) - len(accepted) - duplicates,
+        "results": results,
+        "server_time": str(now_datetime())
+    }
+    if devices:
+        response["next_expected_seq"] = devices
+    return response
+
+
+def _spool_batch(batch, results, accepted, rpi_id=None):
+    """Append the batch to the spool. Every dict row is kept, not only the
+    valid ones, so the replay consumes rejected rows' seqs as ingest would."""
+    rows = [dict(raw, rpi_id=raw.get("rpi_id") or rpi_id) if rpi_id else raw
+            for raw in batch if isinstance(raw, dict)]
+    iot_spool.append(rows, rpi_id)
+    for index, _row in accepted:
+        results[index]["code"] = "spooled"
+    duplicates = sum(1 for r in results if r.get("code") == "duplicate")
+    return {
+        "received": len(batch),
+        "accepted": len(accepted),
+        "spooled": len(accepted),
+        "duplicates": duplicates,
+        "rejected": len(batch) - len(accepted) - duplicates,
+        "results": results,
+        "server_time": str(now_datetime())
+    }
+
+
+def validate_reading_batch(batch):
+    """Validate all rows of a batch against SENSOR_RANGES in one pass.
+    Outlier stats are fetched once per sensor, not once per row.
+    Returns (results, accepted) where accepted is a list of (index, row)."""
+    results = []
+    accepted = []
+    stats_by_sensor = {}
+
+    for index, raw in enumerate(batch):
+        result = {"index": index, "status": "rejected", "warnings": []}
+        results.append(result)
+
+        if not isinstance(raw, dict):
+            result["code"] = "invalid_row"
+            continue
+        sensor_type = raw.get("sensor_type")
+        if not sensor_type:
+            result["code"] = "missing_sensor_type"
+            continue
+
+        row = dict(raw)
+        if "value" in row:
+            row.setdefault("temperature", row.pop("value"))
+        try:
+            value = float(row.get("temperature"))
+        except (ValueError, TypeError):
+            result["code"] = "non_numeric"
+            continue
+        if math.isnan(value) or math.isinf(value):
+            result["code"] = "non_numeric"
+            continue
+        row["temperature"] = value
+
+        device_time, clock_warning = resolve_device_time(row.get("device_time") or row.get("timestamp"))
+        row["device_time"] = device_time
+        if clock_warning:
+            result["warnings"].append(clock_warning)
 
-    # Check all sensor types
-    types = frappe.db.sql("""
-        SELECT DISTINCT sensor_type FROM `tabIoT Sensor Reading`
-        WHERE sensor_type IS NOT NULL
-    """, as_dict=True)
+        if sensor_type not in SENSOR_RANGES:
+            result["warnings"].append(f"Unknown sensor type: {sensor_type}, skipping range check")
+        else:
+            range_error = _check_range(sensor_type, value)
+            if range_error:
+                result["code"] = "out_of_range"
+                result["error"] = range_error
+                continue
 
-    results = {}
-    for t in types:
-        results[t.sensor_type] = _check_single_sensor_health(t.sensor_type)
-    return results
+        stats_key = (sensor_type, row.get("sensor_id"))
+        if stats_key not in stats_by_sensor:
+            try:
+                stats_by_sensor[stats_key] = _get_outlier_stats(*stats_key)
+            except Exception:
+                stats_by_sensor[stats_key] = None
+        outlier = _outlier_warning(value, stats_by_sensor[stats_key])
+        if outlier:
+            result["warnings"].append(outlier)
 
+        result["status"] = "accepted"
+        result["code"] = "ok"
+        accepted.append((index, row))
 
-def _check_single_sensor_health(sensor_type):
-    """Health check for a single sensor type."""
+    return results, accepted
+
+
+def _after_ingest(rows):
+    """Update the derived structures fed by ingest. Failures here are logged
+    and never reject readings that are already committed. Rows taken before
+    the lateness horizon only mark their hours for reconciliation and close
+    the gaps they fall in."""
+    try:
+        count_device_ingest(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT fleet ingest count failed")
+    try:
+        # Late readings, past the horizon or not, can fill recorded gaps
+        close_gaps(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT gap close failed")
+    try:
+        rows, past = split_by_horizon(rows)
+        record_lateness(rows, past)
+        # Compressed types can't be rebuilt from stored rows; their late
+        # readings are added to the rollups directly instead
+        compressed = [row for row in past if is_compressed(row.get("sensor_type"))]
+        mark_dirty_hours([row for row in past if not is_compressed(row.get("sensor_type"))])
+        if compressed:
+            update_rollups(compressed)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT lateness tracking failed")
+    if not rows:
+        return
+    try:
+        update_rolling_stats(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT rolling stats update failed")
+    try:
+        update_rollups(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT rollup update failed")
+    try:
+        update_quantile_sketches(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT quantile sketch update failed")
+    try:
+        # Reads the snapshots' previous last_seen, so it runs first
+        update_gap_index(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT gap index update failed")
+    try:
+        update_health_snapshot(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT health snapshot update failed")
+    try:
+        update_drift_state(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT drift state update failed")
+    try:
+        update_latest_values(rows)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT latest value update failed")
+    try:
+        mark_dashboard_dirty(row.get("sensor_type") for row in rows)
+        flush_dashboard_deltas()
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT dashboard delta publish failed")
+
+
+def _stamp_arrival(accepted, received_at=None):
+    """Set creation to the arrival time, taken from received_at[index] for
+    spooled rows; device_time defaults to it when the device sent none."""
     now = now_datetime()
-    one_hour_ago = add_to_date(now, hours=-1)
-    one_day_ago = add_to_date(now, hours=-24)
+    for index, row in accepted:
+        row["creation"] = received_at[index] if received_at else now
+        row["device_time"] = row.get("device_time") or row["creation"]
 
-    # Recent readings count
-    hour_count = frappe.db.count("IoT Sensor Reading", filters={
-        "sensor_type": sensor_type,
-        "creation": [">=", one_hour_ago]
-    })
 
-    day_count = frappe.db.count("IoT Sensor Reading", filters={
-        "sensor_type": sensor_type,
-        "creation": [">=", one_day_ago]
-    })
+def _bulk_insert_readings(accepted):
+    """Write accepted (index, row) pairs, stamped by _stamp_arrival, to IoT
+    Sensor Reading with a single multi-row INSERT. Only keys that are real
+    columns of the doctype are persisted.
+    Returns the generated document names in row order."""
+    if not accepted:
+        return []
 
-    # Last reading
-    last = frappe.db.sql("""
-        SELECT creation, temperature FROM `tabIoT Sensor Reading`
-        WHERE sensor_type = %s ORDER BY creation DESC LIMIT 1
-    """, (sensor_type,), as_dict=True)
+    now = now_datetime()
+    valid_columns = set(frappe.get_meta("IoT Sensor Reading").get_valid_columns())
+    data_fields = []
+    for _index, row in accepted:
+        for key in row:
+            if key in valid_columns and key not in INGEST_RESERVED_FIELDS and key not in data_fields:
+                data_fields.append(key)
 
-    last_reading_time = last[0].creation if last else None
-    seconds_since = time_diff_in_seconds(now, last_reading_time) if last_reading_time else None
+    user = frappe.session.user
+    fields = ["name", "owner", "modified_by", "creation", "modified", "docstatus"] + data_fields
+    names = []
+    values = []
+    for _index, row in accepted:
+        name = frappe.generate_hash(length=10)
+        names.append(name)
+        values.append([name, user, user, row["creation"], now, 0] + [row.get(f) for f in data_fields])
 
-    # Determine status
-    if seconds_since is None:
-        status = "no_data"
-    elif seconds_since < 120:
-        status = "active"
-    elif seconds_since < 600:
-        status = "warning"
+    frappe.db.bulk_insert("IoT Sensor Reading", fields, values)
+    return names
+
+
+# ============================================================================
+# DEVICE SEQUENCES - idempotent replay of RPi buffer flushes
+# ============================================================================
+
+# Each RPi stamps readings with a monotonic seq. IoT Device keeps the
+# high-water mark (every seq below next_expected_seq was received) plus the
+# received ranges above it, so retried or parallel chunks are deduplicated
+# against one locked row instead of the readings table.
+IOT_DEVICE_DOCTYPE = "IoT Device"
+SEQ_MAX_PENDING_RANGES = 256
+
+
+def _seq_seen(seq, next_expected, ranges):
+    if seq < next_expected:
+        return True
+    i = bisect.bisect_right(ranges, [seq, float("inf")]) - 1
+    return i >= 0 and ranges[i][0] <= seq <= ranges[i][1]
+
+
+def apply_sequences(next_expected, ranges, seqs):
+    """Record seqs against a high-water mark and sorted [start, end] ranges.
+    Returns (next_expected, ranges, fresh, duplicates). When more than
+    SEQ_MAX_PENDING_RANGES gaps are open, the oldest gaps are given up."""
+    fresh = set()
+    duplicates = []
+    for seq in seqs:
+        if seq in fresh or _seq_seen(seq, next_expected, ranges):
+            duplicates.append(seq)
+        else:
+            fresh.add(seq)
+
+    merged = []
+    for start, end in sorted([list(r) for r in ranges] + [[seq, seq] for seq in fresh]):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+
+    while merged and (merged[0][0] <= next_expected or len(merged) > SEQ_MAX_PENDING_RANGES):
+        next_expected = max(next_expected, merged.pop(0)[1] + 1)
+
+    return next_expected, merged, fresh, duplicates
+
+
+def _ensure_device(rpi_id):
+    now = now_datetime()
+    user = frappe.session.user
+    frappe.db.sql(f"""
+        INSERT IGNORE INTO `tab{IOT_DEVICE_DOCTYPE}`
+            (name, rpi_id, creation, modified, owner, modified_by, next_expected_seq)
+        VALUES (%s, %s, %s, %s, %s, %s, 1)
+    """, (rpi_id, rpi_id, now, now, user, user))
+
+
+def claim_sequences(rpi_id, seqs):
+    """Lock the device row (SELECT ... FOR UPDATE) and claim seqs for it.
+    Returns {"fresh", "duplicates", "next_expected_seq"}. The caller commits,
+    so the claim and the insert of the fresh readings land together."""
+    _ensure_device(rpi_id)
+    device = frappe.db.sql(f"""
+        SELECT next_expected_seq, pending_ranges FROM `tab{IOT_DEVICE_DOCTYPE}`
+        WHERE name = %s FOR UPDATE
+    """, rpi_id, as_dict=True)[0]
+
+    ranges = json.loads(device.pending_ranges or "[]")
+    next_expected, ranges, fresh, duplicates = apply_sequences(
+        max(device.next_expected_seq or 1, 1), ranges, seqs)
+
+    now = now_datetime()
+    frappe.db.sql(f"""
+        UPDATE `tab{IOT_DEVICE_DOCTYPE}`
+        SET next_expected_seq = %s, pending_ranges = %s,
+            received_total = received_total + %s, duplicate_total = duplicate_total + %s,
+            last_seen = %s, modified = %s
+        WHERE name = %s
+    """, (next_expected, json.dumps(ranges) if ranges else None,
+          len(fresh), len(duplicates), now, now, rpi_id))
+
+    return {"fresh": fresh, "duplicates": duplicates, "next_expected_seq": next_expected}
+
+
+def _filter_replayed(batch, results, accepted, rpi_id=None):
+    """Drop rows whose (rpi_id, seq) was already received. Rejected rows also
+    consume their seq, so the device never has to resend them. Returns the
+    remaining accepted rows and {rpi_id: next_expected_seq}. The batch
+    rpi_id is stamped on accepted rows that carry none, with or without seqs."""
+    if rpi_id:
+        for _index, row in accepted:
+            row["rpi_id"] = row.get("rpi_id") or rpi_id
+
+    seqs_by_device = {}
+    index_by_key = {}
+    for index, raw in enumerate(batch):
+        if not isinstance(raw, dict) or raw.get("seq") in (None, ""):
+            continue
+        device = raw.get("rpi_id") or rpi_id
+        try:
+            seq = int(raw["seq"])
+        except (ValueError, TypeError):
+            seq = 0
+        if not device or seq < 1:
+            results[index].update(status="rejected", code="invalid_seq")
+            continue
+        seqs_by_device.setdefault(device, []).append(seq)
+        index_by_key.setdefault((device, seq), []).append(index)
+
+    if not seqs_by_device:
+        return accepted, {}
+
+    replayed = set()
+    devices = {}
+    # Fixed lock order so concurrent flushes cannot deadlock
+    for device in sorted(seqs_by_device):
+        claim = claim_sequences(device, seqs_by_device[device])
+        devices[device] = claim["next_expected_seq"]
+        for seq in set(claim["duplicates"]):
+            indexes = index_by_key[(device, seq)]
+            # A seq repeated inside this batch keeps its first row
+            if seq in claim["fresh"]:
+                indexes = indexes[1:]
+            replayed.update(indexes)
+
+    for index in replayed:
+        results[index].update(status="duplicate", code="duplicate", warnings=[])
+        results[index].pop("error", None)
+    rejected = {i for i, r in enumerate(results) if r.get("code") == "invalid_seq"}
+    accepted = [(i, row) for i, row in accepted if i not in replayed and i not in rejected]
+    return accepted, devices
+
+
+# ============================================================================
+# DEVICE REGISTRY - (rpi_id, sensor_id) to warehouse / zone
+# ============================================================================
+
+DEVICE_REGISTRY_CACHE_KEY = "iot_device_registry"
+
+
+def _load_device_registry():
+    rows = frappe.db.sql(f"""
+        SELECT d.name as rpi_id, s.sensor_id, s.sensor_type,
+               COALESCE(s.warehouse, d.warehouse) as warehouse, s.zone, s.expected_interval
+        FROM `tab{IOT_DEVICE_DOCTYPE}` d
+        INNER JOIN `tabIoT Device Sensor` s
+            ON s.parent = d.name AND s.parenttype = %s
+    """, IOT_DEVICE_DOCTYPE, as_dict=True)
+
+    registry = {"by_sensor": {}, "by_device": {}, "by_warehouse": {}, "by_zone": {}}
+    for r in rows:
+        registry["by_sensor"][r.sensor_id] = dict(r)
+        registry["by_device"].setdefault(r.rpi_id, []).append(r.sensor_id)
+        if r.warehouse:
+            registry["by_warehouse"].setdefault(r.warehouse, []).append(r.sensor_id)
+        if r.zone:
+            registry["by_zone"].setdefault(r.zone, []).append(r.sensor_id)
+    return registry
+
+
+def get_device_registry():
+    """Sensor registry from IoT Device, cached until a device is saved."""
+    return frappe.cache().get_value(DEVICE_REGISTRY_CACHE_KEY, generator=_load_device_registry)
+
+
+def get_sensor_ids(rpi_id=None, warehouse=None, zone=None):
+    """Registered sensor_ids of a device, warehouse or zone (intersected
+    when several are given). None when no filter is given."""
+    if not (rpi_id or warehouse or zone):
+        return None
+    registry = get_device_registry()
+    selected = None
+    for index, key in (("by_device", rpi_id), ("by_warehouse", warehouse), ("by_zone", zone)):
+        if key:
+            ids = set(registry[index].get(key, []))
+            selected = ids if selected is None else selected & ids
+    return sorted(selected)
+
+
+def resolve_sensor_filter(sensor_id=None, rpi_id=None):
+    """Turn the sensor_id / rpi_id API parameters into the sensor_id list
+    the pipeline queries filter on, or None for no filter. sensor_id may
+    already be a list."""
+    if isinstance(sensor_id, (list, tuple, set)):
+        sensor_ids = list(sensor_id)
     else:
-        status = "offline"
+        sensor_ids = [sensor_id] if sensor_id else None
+    if not rpi_id:
+        return sensor_ids
+    device_ids = get_sensor_ids(rpi_id=rpi_id)
+    if sensor_ids is None:
+        return device_ids
+    return [sid for sid in sensor_ids if sid in device_ids]
 
-    # Get stats
-    stats = get_sensor_stats(sensor_type, minutes=60)
 
-    return {
+# ============================================================================
+# LATEST VALUES - Redis rings of recent readings per sensor and warehouse
+# ============================================================================
+
+# Ingest LPUSHes every reading onto a capped list for its sensor and for the
+# sensor's registered warehouse, so "current value" lookups are one LRANGE.
+# The primed flag is set once the rings were loaded from the database; its
+# absence (Redis restart, first deploy) is the only time readers hit SQL.
+LATEST_RING_SIZE = 120
+LATEST_WAREHOUSE_RING_SIZE = 500
+LATEST_WINDOW_MINUTES = 30
+LATEST_PRIMED_KEY = "iot_latest|primed"
+
+
+def _latest_key(kind, name):
+    return f"iot_latest|{kind}|{name}"
+
+
+def update_latest_values(rows):
+    """Push ingested rows onto the sensor and warehouse rings, oldest first
+    so the newest reading ends up at the head."""
+    by_sensor = get_device_registry()["by_sensor"]
+    rings = {}
+    for row in sorted(rows, key=reading_time):
+        sensor_id = row.get("sensor_id")
+        if not sensor_id:
+            continue
+        entry = json.dumps({
+            "t": str(reading_time(row)),
+            "id": sensor_id,
+            "type": row.get("sensor_type"),
+            "v": row.get("temperature"),
+            "h": row.get("humidity"),
+        })
+        rings.setdefault(("sensor", sensor_id), []).append(entry)
+        warehouse = (by_sensor.get(sensor_id) or {}).get("warehouse")
+        if warehouse:
+            rings.setdefault(("warehouse", warehouse), []).append(entry)
+    if not rings:
+        return
+
+    cache = frappe.cache()
+    pipe = cache.pipeline()
+    for (kind, name), entries in rings.items():
+        key = cache.make_key(_latest_key(kind, name))
+        size = LATEST_WAREHOUSE_RING_SIZE if kind == "warehouse" else LATEST_RING_SIZE
+        pipe.lpush(key, *entries[-size:])
+        pipe.ltrim(key, 0, size - 1)
+        pipe.expire(key, LATEST_WINDOW_MINUTES * 60 * 2)
+    pipe.execute()
+
+
+def warm_latest_values():
+    """Load the last window of readings into the rings after a cold start.
+    Returns False if another worker already did (or is doing) it."""
+    cache = frappe.cache()
+    if not cache.set(cache.make_key(LATEST_PRIMED_KEY), 1, nx=True):
+        return False
+    if not frappe.db.exists("DocType", "IoT Sensor Reading"):
+        return True
+    rows = frappe.db.sql("""
+        SELECT sensor_type, sensor_id, temperature, humidity, device_time, creation
+        FROM `tabIoT Sensor Reading`
+        WHERE device_time >= %s AND sensor_id IS NOT NULL AND sensor_id != ''
+    """, add_to_date(now_datetime(), minutes=-LATEST_WINDOW_MINUTES), as_dict=True)
+    update_latest_values(rows)
+    return True
+
+
+def get_recent_readings(sensor_id=None, warehouse=None, minutes=LATEST_WINDOW_MINUTES, limit=None):
+    """Readings of a sensor (or of a warehouse's registered sensors) from the
+    last minutes, newest first, served from the rings."""
+    cache = frappe.cache()
+    if not cache.get(cache.make_key(LATEST_PRIMED_KEY)):
+        warm_latest_values()
+    key = _latest_key("sensor", sensor_id) if sensor_id else _latest_key("warehouse", warehouse)
+    cutoff = add_to_date(now_datetime(), minutes=-int(minutes))
+
+    readings = []
+    seen = set()
+    for raw in cache.lrange(key, 0, -1):
+        entry = json.loads(raw)
+        reading_time = get_datetime(entry["t"])
+        # The warm-up can push readings that ingest already pushed
+        if reading_time < cutoff or (entry["id"], entry["t"]) in seen:
+            continue
+        seen.add((entry["id"], entry["t"]))
+        readings.append(frappe._dict(
+            sensor_type=entry["type"], sensor_id=entry["id"],
+            temperature=entry["v"], humidity=entry["h"], reading_time=reading_time))
+    readings.sort(key=lambda r: r.reading_time, reverse=True)
+    return readings[:int(limit)] if limit else readings
+
+
+@frappe.whitelist()
+def get_latest_reading(sensor_id=None, warehouse=None):
+    """Newest reading of a sensor or warehouse in the last
+    LATEST_WINDOW_MINUTES, or None."""
+    if not (sensor_id or warehouse):
+        frappe.throw(_("Pass a sensor_id or a warehouse"))
+    readings = get_recent_readings(sensor_id=sensor_id, warehouse=warehouse, limit=1)
+    return readings[0] if readings else None
+
+
+# ============================================================================
+# SENSOR HEALTH MONITORING
+# ============================================================================
+
+HEALTH_SNAPSHOT_DOCTYPE = "Sensor Health Snapshot"
+HEALTH_ACTIVE_SECONDS = 120
+HEALTH_WARNING_SECONDS = 600
+
+_SNAPSHOT_COLUMNS = (
+    "name", "creation", "modified", "owner", "modified_by",
+    "sensor_type", "sensor_id", "status", "first_seen", "last_seen", "last_value",
+    "hour_bucket", "hour_count", "prev_hour_count",
+    "day_bucket", "day_count", "prev_day_count", "total_count"
+)
+
+# Counters roll over when a newer bucket arrives: the current count becomes
+# the previous one if the buckets are adjacent. MariaDB evaluates these
+# assignments left to right, so each line still sees the old bucket columns.
+_SNAPSHOT_UPDATE = """
+    last_value = IF(VALUES(last_seen) >= last_seen, VALUES(last_value), last_value),
+    status = IF(VALUES(last_seen) >= last_seen, VALUES(status), status),
+    last_seen = GREATEST(last_seen, VALUES(last_seen)),
+    prev_hour_count = CASE
+        WHEN VALUES(hour_bucket) <= hour_bucket THEN prev_hour_count
+        WHEN VALUES(hour_bucket) = hour_bucket + INTERVAL 1 HOUR THEN hour_count
+        ELSE 0 END,
+    hour_count = CASE
+        WHEN VALUES(hour_bucket) = hour_bucket THEN hour_count + VALUES(hour_count)
+        WHEN VALUES(hour_bucket) < hour_bucket THEN hour_count
+        ELSE VALUES(hour_count) END,
+    hour_bucket = GREATEST(hour_bucket, VALUES(hour_bucket)),
+    prev_day_count = CASE
+        WHEN VALUES(day_bucket) <= day_bucket THEN prev_day_count
+        WHEN VALUES(day_bucket) = day_bucket + INTERVAL 1 DAY THEN day_count
+        ELSE 0 END,
+    day_count = CASE
+        WHEN VALUES(day_bucket) = day_bucket THEN day_count + VALUES(day_count)
+        WHEN VALUES(day_bucket) < day_bucket THEN day_count
+        ELSE VALUES(day_count) END,
+    day_bucket = GREATEST(day_bucket, VALUES(day_bucket)),
+    total_count = total_count + VALUES(total_count),
+    modified = VALUES(modified)
+"""
+
+
+def _health_status(seconds_since):
+    if seconds_since is None:
+        return "no_data"
+    if seconds_since < HEALTH_ACTIVE_SECONDS:
+        return "active"
+    if seconds_since < HEALTH_WARNING_SECONDS:
+        return "warning"
+    return "offline"
+
+
+def snapshot_name(sensor_type, sensor_id=None):
+    return hashlib.md5(f"{sensor_type}|{sensor_id or ''}".encode()).hexdigest()
+
+
+def update_health_snapshot(rows):
+    """Fold ingested rows into Sensor Health Snapshot with one upsert.
+    Only rows in the newest hour/day bucket of a sensor feed its counters."""
+    now = now_datetime()
+    snapshots = {}
+    for row in rows:
+        sensor_type = row.get("sensor_type")
+        if not sensor_type:
+            continue
+        ts = reading_time(row, now)
+        key = (sensor_type, row.get("sensor_id") or "")
+        hour = floor_to_minutes(ts, 60)
+        day = floor_to_minutes(ts, 1440)
+        snap = snapshots.get(key)
+        if snap is None:
+            snap = snapshots[key] = {
+                "first_seen": ts, "last_seen": ts, "last_value": row.get("temperature"),
+                "hour_bucket": hour, "hour_count": 0, "day_bucket": day, "day_count": 0, "total": 0
+            }
+        snap["total"] += 1
+        snap["first_seen"] = min(snap["first_seen"], ts)
+        if ts >= snap["last_seen"]:
+            snap["last_seen"] = ts
+            snap["last_value"] = row.get("temperature")
+        if hour > snap["hour_bucket"]:
+            snap["hour_bucket"], snap["hour_count"] = hour, 0
+        if hour == snap["hour_bucket"]:
+            snap["hour_count"] += 1
+        if day > snap["day_bucket"]:
+            snap["day_bucket"], snap["day_count"] = day, 0
+        if day == snap["day_bucket"]:
+            snap["day_count"] += 1
+
+    if not snapshots:
+        return
+
+    user = frappe.session.user
+    values = []
+    for (sensor_type, sensor_id), snap in snapshots.items():
+        values.append((
+            snapshot_name(sensor_type, sensor_id), now, now, user, user,
+            sensor_type, sensor_id or None,
+            _health_status(time_diff_in_seconds(now, snap["last_seen"])),
+            snap["first_seen"], snap["last_seen"], snap["last_value"],
+            snap["hour_bucket"], snap["hour_count"], 0,
+            snap["day_bucket"], snap["day_count"], 0, snap["total"]
+        ))
+
+    row_placeholder = "(" + ", ".join(["%s"] * len(_SNAPSHOT_COLUMNS)) + ")"
+    frappe.db.sql(
+        f"INSERT INTO `tab{HEALTH_SNAPSHOT_DOCTYPE}` ({', '.join(_SNAPSHOT_COLUMNS)}) VALUES "
+        + ", ".join([row_placeholder] * len(values))
+        + f" ON DUPLICATE KEY UPDATE {_SNAPSHOT_UPDATE}",
+        [v for row in values for v in row]
+    )
+
+
+def _sliding_count(now, bucket, count, prev_count, bucket_seconds):
+    """Approximate the count over the trailing bucket_seconds from the current
+    and previous fixed buckets (sliding-window counter)."""
+    if not bucket:
+        return 0
+    bucket = get_datetime(bucket)
+    elapsed = time_diff_in_seconds(now, bucket)
+    if elapsed < bucket_seconds:
+        return int(round((count or 0) + (prev_count or 0) * (1 - elapsed / bucket_seconds)))
+    if elapsed < 2 * bucket_seconds:
+        return int(round((count or 0) * (1 - (elapsed - bucket_seconds) / bucket_seconds)))
+    return 0
+
+
+def get_health_snapshots(sensor_type=None, sensor_id=None):
+    """Snapshot rows (one indexed read), optionally for one type (or a list
+    of types) and one sensor_id (or a list of them)."""
+    filters = {}
+    if isinstance(sensor_type, (list, tuple, set)):
+        filters["sensor_type"] = ["in", list(sensor_type)]
+    elif sensor_type:
+        filters["sensor_type"] = sensor_type
+    if isinstance(sensor_id, (list, tuple, set)):
+        if not sensor_id:
+            return []
+        filters["sensor_id"] = ["in", list(sensor_id)]
+    elif sensor_id:
+        filters["sensor_id"] = sensor_id
+    return frappe.get_all(HEALTH_SNAPSHOT_DOCTYPE, filters=filters, fields=[
+        "sensor_type", "sensor_id", "first_seen", "last_seen", "last_value",
+        "hour_bucket", "hour_count", "prev_hour_count",
+        "day_bucket", "day_count", "prev_day_count", "total_count"
+    ], order_by="sensor_type asc, sensor_id asc", limit_page_length=0)
+
+
+@frappe.whitelist()
+def check_sensor_health(sensor_type=None, sensor_id=None, rpi_id=None):
+    """Check health status of sensors. Returns uptime, error rate, last reading.
+    Narrowed to one sensor_id or to the sensors registered on rpi_id.
+    Served from Sensor Health Snapshot and the stats cache."""
+    if sensor_type:
+        return _check_single_sensor_health(sensor_type, sensor_id=sensor_id, rpi_id=rpi_id)
+
+    sensor_ids = resolve_sensor_filter(sensor_id, rpi_id)
+    by_type = {}
+    for snap in get_health_snapshots(sensor_id=sensor_ids):
+        by_type.setdefault(snap.sensor_type, []).append(snap)
+
+    return {t: _summarize_health(t, snaps, sensor_ids) for t, snaps in by_type.items()}
+
+
+def _check_single_sensor_health(sensor_type, sensor_id=None, rpi_id=None):
+    """Health check for a single sensor type (or some of its sensors)."""
+    sensor_ids = resolve_sensor_filter(sensor_id, rpi_id)
+    result = _summarize_health(sensor_type, get_health_snapshots(sensor_type, sensor_ids), sensor_ids)
+    if sensor_id:
+        result["sensor_id"] = sensor_id
+        result["recent"] = get_recent_readings(sensor_id=sensor_id, limit=10)
+        uptime = get_sensor_uptime(sensor_type, sensor_id=sensor_id)["sensors"]
+        result["uptime_7d"] = uptime[0]["uptime_pct"] if uptime else None
+    if rpi_id:
+        result["rpi_id"] = rpi_id
+    return result
+
+
+def _summarize_health(sensor_type, snapshots, sensor_ids=None):
+    """Combine the snapshots of one sensor type into a health entry."""
+    now = now_datetime()
+    hour_count = 0
+    day_count = 0
+    last = None
+    sensors = []
+
+    for snap in snapshots:
+        hour_count += _sliding_count(now, snap.hour_bucket, snap.hour_count, snap.prev_hour_count, 3600)
+        day_count += _sliding_count(now, snap.day_bucket, snap.day_count, snap.prev_day_count, 86400)
+        if snap.last_seen and (last is None or snap.last_seen > last.last_seen):
+            last = snap
+        seconds = time_diff_in_seconds(now, snap.last_seen) if snap.last_seen else None
+        sensors.append({
+            "sensor_id": snap.sensor_id,
+            "status": _health_status(seconds),
+            "last_reading_time": str(snap.last_seen) if snap.last_seen else None,
+            "last_value": snap.last_value
+        })
+
+    last_reading_time = last.last_seen if last else None
+    seconds_since = time_diff_in_seconds(now, last_reading_time) if last_reading_time else None
+
+    result = {
         "sensor_type": sensor_type,
-        "status": status,
+        "status": _health_status(seconds_since),
         "readings_last_hour": hour_count,
         "readings_last_24h": day_count,
         "last_reading_time": str(last_reading_time) if last_reading_time else None,
         "seconds_since_last": seconds_since,
-        "last_value": last[0].temperature if last else None,
-        "stats": stats
+        "last_value": last.last_value if last else None,
+        "total_readings": sum(s.total_count or 0 for s in snapshots),
+        "sensors": sensors,
+        "stats": get_sensor_stats(sensor_type, minutes=60, sensor_id=sensor_ids)
     }
+    return result
+
+
+def refresh_health_snapshot_status():
+    """Scheduler job: age the stored status of sensors that stopped reporting,
+    so list views and filters on Sensor Health Snapshot stay truthful."""
+    now = now_datetime()
+    status_case = """CASE
+            WHEN last_seen IS NULL THEN 'no_data'
+            WHEN last_seen > %(active)s THEN 'active'
+            WHEN last_seen > %(warning)s THEN 'warning'
+            ELSE 'offline' END"""
+    params = {"active": add_to_date(now, seconds=-HEALTH_ACTIVE_SECONDS),
+              "warning": add_to_date(now, seconds=-HEALTH_WARNING_SECONDS)}
+    changed = frappe.db.sql_list(f"""
+        SELECT DISTINCT sensor_type FROM `tab{HEALTH_SNAPSHOT_DOCTYPE}`
+        WHERE status != {status_case}
+    """, params)
+    if not changed:
+        return
+    frappe.db.sql(f"""
+        UPDATE `tab{HEALTH_SNAPSHOT_DOCTYPE}`
+        SET status = {status_case}
+        WHERE sensor_type IN %(changed)s
+    """, dict(params, changed=tuple(changed)))
+    frappe.db.commit()
+    mark_dashboard_dirty(changed)
 
 
 # ============================================================================
-# DRIFT DETECTION
+# REALTIME DASHBOARD DELTAS - coalesced push of changed sensor types
 # ============================================================================
 
+# Ingest marks sensor types dirty in a Redis set. At most once per tick (a
+# SET NX lock with a tick-long TTL) the dirty set is drained, the health
+# entries of those types are recomputed once, and a single delta carrying a
+# sequence number is published to the Sensor Health Snapshot doctype room.
+# Clients load get_dashboard_snapshot() once, then apply deltas whose seq is
+# newer; a gap in seq means a missed delta and a fresh snapshot.
+DASHBOARD_DIRTY_KEY = "iot_dashboard|dirty"
+DASHBOARD_SEQ_KEY = "iot_dashboard|seq"
+DASHBOARD_TICK_LOCK_KEY = "iot_dashboard|tick"
+DASHBOARD_EVENT = "iot_dashboard_delta"
+DEFAULT_DASHBOARD_TICK_SECONDS = 2
+
+
+def get_dashboard_tick_seconds():
+    """Publish tick, overridable with iot_dashboard_tick_seconds in site_config."""
+    return max(int(frappe.conf.get("iot_dashboard_tick_seconds") or DEFAULT_DASHBOARD_TICK_SECONDS), 1)
+
+
+def mark_dashboard_dirty(sensor_types):
+    sensor_types = {t for t in sensor_types if t}
+    if sensor_types:
+        frappe.cache().sadd(DASHBOARD_DIRTY_KEY, *sensor_types)
+
+
+def get_dashboard_seq():
+    cache = frappe.cache()
+    return int(cache.get(cache.make_key(DASHBOARD_SEQ_KEY)) or 0)
+
+
+def flush_dashboard_deltas(force=False):
+    """Publish the health of every dirty sensor type as one delta, unless a
+    delta already went out in the current tick. Returns the published seq,
+    or None when nothing was sent."""
+    cache = frappe.cache()
+    if not force and not cache.set(cache.make_key(DASHBOARD_TICK_LOCK_KEY), 1,
+                                   nx=True, ex=get_dashboard_tick_seconds()):
+        return None
+
+    sensor_types = sorted({t.decode() if isinstance(t, bytes) else t
+                           for t in cache.smembers(DASHBOARD_DIRTY_KEY)})
+    if not sensor_types:
+        return None
+    cache.srem(DASHBOARD_DIRTY_KEY, *sensor_types)
+
+    by_type = {t: [] for t in sensor_types}
+    for snap in get_health_snapshots(sensor_types):
+        by_type[snap.sensor_type].append(snap)
+
+    seq = cache.incr(cache.make_key(DASHBOARD_SEQ_KEY))
+    frappe.publish_realtime(DASHBOARD_EVENT, {
+        "seq": seq,
+        "server_time": str(now_datetime()),
+        # None means the sensor type no longer has any snapshot
+        "sensors": {t: _summarize_health(t, snaps) if snaps else None
+                    for t, snaps in by_type.items()},
+    }, doctype=HEALTH_SNAPSHOT_DOCTYPE, after_commit=True)
+    return seq
+
+
+def publish_pending_dashboard_deltas():
+    """Scheduler job: flush types left dirty when ingest went quiet
+    before the tick lock expired."""
+    flush_dashboard_deltas(force=True)
+
+
 @frappe.whitelist()
-def detect_sensor_drift(sensor_type, window_hours=24):
-    """Detect if a sensor is drifting from its expected baseline."""
-    if not frappe.db.exists("DocType", "IoT Sensor Reading"):
-        return {"error": "IoT Sensor Reading doctype not found"}
+def get_dashboard_snapshot():
+    """Full pipeline dashboard plus the delta sequence it is current to.
+    The seq is read first, so replaying any newer delta is safe: deltas
+    carry complete per-type entries."""
+    seq = get_dashboard_seq()
+    return {
+        "seq": seq,
+        "event": DASHBOARD_EVENT,
+        "doctype": HEALTH_SNAPSHOT_DOCTYPE,
+        "tick_seconds": get_dashboard_tick_seconds(),
+        "dashboard": get_pipeline_dashboard(),
+    }
+
+
+# ============================================================================
+# DRIFT DETECTION
+# ============================================================================
+
+# Streaming EWMA + two-sided CUSUM per sensor. Each sensor keeps a slow EWMA
+# baseline and EW variance; every reading is standardized against them and
+# folded into the S+/S- accumulators. Crossing drift_cusum_h raises a drift
+# event and restarts the warm-up so the baseline is re-learned at the new level.
+DRIFT_CACHE_PREFIX = "iot_drift"
+DRIFT_WARMUP_READINGS = 60
+DRIFT_BASELINE_ALPHA = 0.002
+DRIFT_FAST_ALPHA = 0.1
+DRIFT_MIN_SIGMA_FRACTION = 0.001
+DEFAULT_DRIFT_PARAMS = {"drift_cusum_k": 0.5, "drift_cusum_h": 10.0}
+
+
+def _drift_cache_key(sensor_type):
+    return f"{DRIFT_CACHE_PREFIX}|{sensor_type}"
+
+
+def get_drift_params(sensor_type):
+    """CUSUM slack (k) and decision threshold (h), in sigma units, from the
+    sensor registry. PLC and unregistered types use DEFAULT_DRIFT_PARAMS."""
+    from rnd_warehouse_management.rnd_warehouse_management.sensor_discovery import DEFAULT_SENSOR_REGISTRY
+
+    entry = DEFAULT_SENSOR_REGISTRY.get(sensor_type, {})
+    params = {}
+    for key, default in DEFAULT_DRIFT_PARAMS.items():
+        params[key] = float(entry.get(key, default))
+    return params
+
+
+def _new_drift_state():
+    return {"n": 0, "baseline": 0.0, "var": 0.0, "fast": 0.0,
+            "s_pos": 0.0, "s_neg": 0.0, "events": 0, "last_event": None}
+
+
+def _drift_min_sigma(sensor_type):
+    """Floor for sigma so quantized or flat-lining sensors don't blow up z."""
+    limits = SENSOR_RANGES.get(sensor_type)
+    if not limits:
+        return 1e-6
+    return max((limits["max"] - limits["min"]) * DRIFT_MIN_SIGMA_FRACTION, 1e-6)
+
+
+def _drift_step(state, value, params, min_sigma=1e-6):
+    """Fold one reading into a drift state (in place). Returns "up" or "down"
+    when the CUSUM crosses its threshold, else None."""
+    state["n"] += 1
+    n = state["n"]
 
+    if n <= DRIFT_WARMUP_READINGS:
+        # Welford warm-up: baseline is the plain mean, var the population variance
+        delta = value - state["baseline"]
+        state["baseline"] += delta / n
+        m2 = state["var"] * (n - 1) + delta * (value - state["baseline"])
+        state["var"] = m2 / n
+        state["fast"] = state["baseline"]
+        return None
+
+    sigma = max(math.sqrt(state["var"]), min_sigma)
+    z = (value - state["baseline"]) / sigma
+    k = params["drift_cusum_k"]
+    state["s_pos"] = max(0.0, state["s_pos"] + z - k)
+    state["s_neg"] = max(0.0, state["s_neg"] - z - k)
+    state["fast"] += DRIFT_FAST_ALPHA * (value - state["fast"])
+
+    h = params["drift_cusum_h"]
+    if state["s_pos"] > h or state["s_neg"] > h:
+        direction = "up" if state["s_pos"] > h else "down"
+        # Re-learn baseline and variance at the new level
+        state.update(n=0, baseline=0.0, var=0.0, s_pos=0.0, s_neg=0.0)
+        state["events"] += 1
+        return direction
+
+    diff = value - state["baseline"]
+    incr = DRIFT_BASELINE_ALPHA * diff
+    state["baseline"] += incr
+    state["var"] = (1 - DRIFT_BASELINE_ALPHA) * (state["var"] + diff * incr)
+    return None
+
+
+def update_drift_state(rows):
+    """Advance the per-sensor drift detectors with ingested rows, in row
+    order. One cache read and write per sensor touched by the batch."""
+    by_sensor = {}
+    for row in rows:
+        value = row.get("temperature")
+        sensor_type = row.get("sensor_type")
+        if value is None or not sensor_type:
+            continue
+        by_sensor.setdefault((sensor_type, row.get("sensor_id") or ""), []).append(float(value))
+
+    if not by_sensor:
+        return
+
+    cache = frappe.cache()
     now = now_datetime()
+    for (sensor_type, sensor_id), values in by_sensor.items():
+        key = _drift_cache_key(sensor_type)
+        state = cache.hget(key, sensor_id) or _new_drift_state()
+        for event in advance_drift_state(state, sensor_type, [(value, now) for value in values]):
+            _publish_drift_event(sensor_type, sensor_id, event)
+        state["updated"] = str(now)
+        cache.hset(key, sensor_id, state)
 
-    # Get first half and second half averages
-    mid = add_to_date(now, hours=-(window_hours // 2))
-    start = add_to_date(now, hours=-window_hours)
 
-    first_half = frappe.db.sql("""
-        SELECT AVG(temperature) as avg_val, COUNT(*) as cnt
-        FROM `tabIoT Sensor Reading`
-        WHERE sensor_type = %s AND creation >= %s AND creation < %s
-        AND temperature IS NOT NULL
-    """, (sensor_type, start, mid), as_dict=True)
+def advance_drift_state(state, sensor_type, points):
+    """Fold (value, time) points into a drift state in order. Returns the
+    drift events raised; the last one is kept as state["last_event"]."""
+    params = get_drift_params(sensor_type)
+    min_sigma = _drift_min_sigma(sensor_type)
+    events = []
+    for value, ts in points:
+        baseline, level = state["baseline"], state["fast"]
+        direction = _drift_step(state, value, params, min_sigma)
+        if direction:
+            state["last_event"] = {
+                "direction": direction,
+                "baseline": baseline,
+                "level": level,
+                "value": value,
+                "time": str(ts),
+            }
+            events.append(state["last_event"])
+    return events
 
-    second_half = frappe.db.sql("""
-        SELECT AVG(temperature) as avg_val, COUNT(*) as cnt
-        FROM `tabIoT Sensor Reading`
-        WHERE sensor_type = %s AND creation >= %s
-        AND temperature IS NOT NULL
-    """, (sensor_type, mid), as_dict=True)
 
-    if not first_half[0].cnt or not second_half[0].cnt:
-        return {"drift_detected": False, "reason": "insufficient_data"}
+def _publish_drift_event(sensor_type, sensor_id, event):
+    message = (f"IoT drift {event['direction']}: {sensor_type} {sensor_id or ''} "
+               f"baseline {event['baseline']:.3f}, level {event['level']:.3f}, value {event['value']:.3f}")
+    frappe.logger().warning(message)
+    frappe.publish_realtime("iot_sensor_drift", dict(event, sensor_type=sensor_type, sensor_id=sensor_id))
 
-    first_avg = first_half[0].avg_val or 0
-    second_avg = second_half[0].avg_val or 0
-    drift = second_avg - first_avg
-    drift_pct = (drift / first_avg * 100) if first_avg != 0 else 0
 
-    threshold = 5.0  # 5% drift threshold
+def _drift_report(sensor_type, sensor_id, state, params):
+    # After a drift event the baseline is re-learned at the new level, so
+    # measure the shift against the baseline the event fired on.
+    event = state.get("last_event")
+    baseline = event["baseline"] if event else state["baseline"]
+    drift = state["fast"] - baseline
+    drift_pct = (drift / baseline * 100) if baseline else 0
+    h = params["drift_cusum_h"]
     return {
-        "sensor_type": sensor_type,
-        "drift_detected": abs(drift_pct) > threshold,
+        "sensor_id": sensor_id or None,
+        "warming_up": state["n"] <= DRIFT_WARMUP_READINGS,
+        "drift_detected": bool(event) or max(state["s_pos"], state["s_neg"]) > h / 2,
         "drift_value": round(drift, 3),
         "drift_percent": round(drift_pct, 2),
-        "first_half_avg": round(first_avg, 3),
-        "second_half_avg": round(second_avg, 3),
-        "threshold_pct": threshold,
-        "window_hours": window_hours
+        "baseline": round(baseline, 3),
+        "current_level": round(state["fast"], 3),
+        "sigma": round(math.sqrt(state["var"]), 4),
+        "cusum_pos": round(state["s_pos"], 3),
+        "cusum_neg": round(state["s_neg"], 3),
+        "readings": state["n"],
+        "events": state["events"],
+        "last_event": event,
+    }
+
+
+@frappe.whitelist()
+def detect_sensor_drift(sensor_type, window_hours=24, sensor_id=None, rpi_id=None):
+    """Report the streaming drift state of a sensor type (or one sensor_id,
+    or the sensors registered on rpi_id).
+    State is maintained on ingest, so this is a cache lookup. A sensor is
+    flagged once it has raised a drift event or its CUSUM is past half the
+    threshold. window_hours only bounds which last_event still counts."""
+    window_hours = int(window_hours)
+    params = get_drift_params(sensor_type)
+    key = _drift_cache_key(sensor_type)
+    sensor_ids = resolve_sensor_filter(sensor_id, rpi_id)
+    if sensor_ids is None:
+        states = frappe.cache().hgetall(key) or {}
+    else:
+        states = {sid: frappe.cache().hget(key, sid) for sid in sensor_ids}
+        states = {sid: state for sid, state in states.items() if state}
+
+    if not states:
+        return {"sensor_type": sensor_type, "drift_detected": False, "reason": "insufficient_data"}
+
+    cutoff = add_to_date(now_datetime(), hours=-window_hours)
+    sensors = []
+    for sid, state in states.items():
+        sid = sid.decode() if isinstance(sid, bytes) else sid
+        if state.get("last_event") and get_datetime(state["last_event"]["time"]) < cutoff:
+            state = dict(state, last_event=None)
+        sensors.append(_drift_report(sensor_type, sid, state, params))
+
+    sensors.sort(key=lambda r: abs(r["drift_percent"]), reverse=True)
+    worst = sensors[0]
+    return {
+        "sensor_type": sensor_type,
+        "drift_detected": any(r["drift_detected"] for r in sensors),
+        "drift_value": worst["drift_value"],
+        "drift_percent": worst["drift_percent"],
+        "threshold_sigma": params["drift_cusum_h"],
+        "slack_sigma": params["drift_cusum_k"],
+        "window_hours": window_hours,
+        "sensors": sensors,
     }
 
 
@@ -234,28 +1382,15 @@ def detect_sensor_drift(sensor_type, window_hours=24):
 # ============================================================================
 
 @frappe.whitelist()
-def get_aggregated_readings(sensor_type, interval_minutes=60, hours=24):
-    """Get aggregated sensor readings (avg, min, max, count per interval)."""
-    if not frappe.db.exists("DocType", "IoT Sensor Reading"):
-        return []
-
-    start = add_to_date(now_datetime(), hours=-hours)
-
-    readings = frappe.db.sql("""
-        SELECT
-            DATE_FORMAT(creation, %s) as time_bucket,
-            AVG(temperature) as avg_temp,
-            MIN(temperature) as min_temp,
-            MAX(temperature) as max_temp,
-            COUNT(*) as reading_count
-        FROM `tabIoT Sensor Reading`
-        WHERE sensor_type = %s AND creation >= %s AND temperature IS NOT NULL
-        GROUP BY time_bucket
-        ORDER BY time_bucket
-    """, (f"%Y-%m-%d %H:{':00' if interval_minutes >= 60 else '%i'}",
-          sensor_type, start), as_dict=True)
-
-    return readings
+def get_aggregated_readings(sensor_type, interval_minutes=60, hours=24, metric=None, sensor_id=None,
+                            rpi_id=None):
+    """Get aggregated sensor readings (avg, min, max, count per interval),
+    optionally for one sensor_id or the sensors registered on rpi_id.
+    Served from the coarsest rollup (1/15/60 min) that divides the interval."""
+    interval_minutes = max(int(interval_minutes), 1)
+    start = add_to_date(now_datetime(), hours=-int(hours))
+    return aggregate_series(sensor_type, interval_minutes, start, metric=metric,
+                            sensor_id=resolve_sensor_filter(sensor_id, rpi_id))
 
 
 # ============================================================================
@@ -263,14 +1398,52 @@ def get_aggregated_readings(sensor_type, interval_minutes=60, hours=24):
 # ============================================================================
 
 @frappe.whitelist()
-def report_buffer_status(rpi_id, buffered_count=0, last_sync=None):
-    """RPi reports its buffer status to ERPNext for monitoring."""
+def report_buffer_status(rpi_id, buffered_count=0, last_sync=None, reset_seq=None, buffer_capacity=None):
+    """RPi reports its buffer status to ERPNext for monitoring. The reply
+    carries the next seq the server expects, so the device can drop what
+    was already received and split the rest into parallel chunks, and the
+    backlog projection from iot_fleet.
+    reset_seq restarts the device's sequence (e.g. after losing its counter).
+    buffer_capacity (readings the device can hold) enables overflow warnings."""
+    now = now_datetime()
+    _ensure_device(rpi_id)
+    device = frappe.db.sql(f"""
+        SELECT next_expected_seq, pending_ranges, buffer_capacity FROM `tab{IOT_DEVICE_DOCTYPE}`
+        WHERE name = %s FOR UPDATE
+    """, rpi_id, as_dict=True)[0]
+
+    next_expected = device.next_expected_seq or 1
+    pending_ranges = device.pending_ranges
+    if reset_seq not in (None, ""):
+        next_expected = max(int(reset_seq), 1)
+        pending_ranges = None
+    if buffer_capacity not in (None, ""):
+        device.buffer_capacity = int(buffer_capacity)
+
+    backlog = update_device_backlog(rpi_id, int(buffered_count), device.buffer_capacity, now)
+    columns = backlog.pop("columns")
+    frappe.db.sql(f"""
+        UPDATE `tab{IOT_DEVICE_DOCTYPE}`
+        SET buffered_count = %s, last_sync = %s, last_seen = %s,
+            next_expected_seq = %s, pending_ranges = %s, buffer_capacity = %s,
+            ingest_rate = %s, backlog_trend = %s, backlog_status = %s,
+            projected_drain_at = %s, projected_overflow_at = %s, modified = %s
+        WHERE name = %s
+    """, (int(buffered_count), get_datetime(last_sync) if last_sync else now, now,
+          next_expected, pending_ranges, device.buffer_capacity or 0,
+          columns["ingest_rate"], columns["backlog_trend"], columns["backlog_status"],
+          columns["projected_drain_at"], columns["projected_overflow_at"], now, rpi_id))
+    frappe.db.commit()
+
     return {
         "received": True,
         "rpi_id": rpi_id,
         "buffered_count": int(buffered_count),
-        "last_sync": last_sync or str(now_datetime()),
-        "server_time": str(now_datetime())
+        "last_sync": last_sync or str(now),
+        "next_expected_seq": next_expected,
+        "pending_ranges": json.loads(pending_ranges or "[]"),
+        "backlog": backlog,
+        "server_time": str(now)
     }
 
 
@@ -281,7 +1454,7 @@ def get_pipeline_dashboard():
         return {"error": "IoT Sensor Reading doctype not found"}
 
     health = check_sensor_health()
-    total_readings = frappe.db.count("IoT Sensor Reading")
+    total_readings = sum(h.get("total_readings", 0) for h in health.values())
 
     active = sum(1 for h in health.values() if h.get("status") == "active")
     warning = sum(1 for h in health.values() if h.get("status") == "warning")
@@ -293,5 +1466,7 @@ def get_pipeline_dashboard():
         "warning": warning,
         "offline": offline,
         "total_readings": total_readings,
+        "fleet": get_fleet_backlog()["summary"],
+        "throttling": get_throttle_stats(),
         "sensors": health
     }
@@ -0,0 +1,293 @@
+"""Phase 6.11: IoT Quantile Sketches
+Merging t-digest per sensor and hour, kept in Redis and updated on ingest.
+Medians, MAD and percentiles for any window are answered by merging the
+hour digests, so memory per sensor is bounded by the compression and the
+retention, not by the number of readings."""
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, add_to_date, get_datetime
+import math
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import reading_time
+
+
+SKETCH_COMPRESSION = 100
+SKETCH_BUCKET_SECONDS = 3600
+SKETCH_RETENTION_HOURS = 48
+SKETCH_PRECISION = 4
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+# Robust outlier rule (Iglewicz & Hoaglin): modified z = 0.6745 (x - median) / MAD
+OUTLIER_MODIFIED_Z = 3.5
+OUTLIER_MIN_COUNT = 20
+_MAD_TO_SIGMA = 0.6745
+_IQR_TO_SIGMA = 1.349
+
+
+# ============================================================================
+# T-DIGEST - {"centroids": [[mean, weight], ...], "count", "min", "max"}
+# ============================================================================
+
+def _q_to_k(q, compression):
+    return compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+
+def _k_to_q(k, compression):
+    if k >= compression / 4:
+        return 1.0
+    return (math.sin(k * 2 * math.pi / compression) + 1) / 2
+
+
+def new_sketch():
+    return {"centroids": [], "count": 0, "min": None, "max": None}
+
+
+def _compress(centroids, compression=SKETCH_COMPRESSION):
+    """One merging pass: neighbouring centroids are combined while the
+    k1 scale function allows it, so the tails stay finely resolved and
+    the result holds at most about `compression` centroids."""
+    if not centroids:
+        return []
+    centroids = sorted(centroids)
+    total = sum(w for _m, w in centroids)
+    merged = []
+    so_far = 0
+    limit = _k_to_q(_q_to_k(0, compression) + 1, compression) * total
+    mean, weight = centroids[0]
+    for m, w in centroids[1:]:
+        if so_far + weight + w <= limit:
+            weight += w
+            mean += (m - mean) * w / weight
+        else:
+            merged.append([round(mean, SKETCH_PRECISION), weight])
+            so_far += weight
+            limit = _k_to_q(_q_to_k(so_far / total, compression) + 1, compression) * total
+            mean, weight = m, w
+    merged.append([round(mean, SKETCH_PRECISION), weight])
+    return merged
+
+
+def sketch_add(sketch, values):
+    """Add values to a sketch (in place) with a single compression."""
+    values = [float(v) for v in values]
+    if not values:
+        return sketch
+    sketch["centroids"] = _compress(sketch["centroids"] + [[v, 1] for v in values])
+    sketch["count"] += len(values)
+    low, high = min(values), max(values)
+    sketch["min"] = low if sketch["min"] is None else min(sketch["min"], low)
+    sketch["max"] = high if sketch["max"] is None else max(sketch["max"], high)
+    return sketch
+
+
+def sketch_merge(a, b):
+    """Merge two sketches into a new one."""
+    if not a or not a["count"]:
+        return dict(b) if b else new_sketch()
+    if not b or not b["count"]:
+        return dict(a)
+    return {
+        "centroids": _compress(a["centroids"] + b["centroids"]),
+        "count": a["count"] + b["count"],
+        "min": min(a["min"], b["min"]),
+        "max": max(a["max"], b["max"]),
+    }
+
+
+def sketch_quantile(sketch, q):
+    """Estimate quantile q (0..1), interpolating between centroid centres
+    and pinning the ends to the exact min and max."""
+    centroids = sketch["centroids"]
+    if not centroids:
+        return None
+    if q <= 0:
+        return sketch["min"]
+    if q >= 1:
+        return sketch["max"]
+    total = sum(w for _m, w in centroids)
+    target = q * total
+    # Centre of centroid i sits at cumulative weight before it + w/2
+    cumulative = 0
+    prev_center, prev_mean = 0, sketch["min"]
+    for mean, weight in centroids:
+        center = cumulative + weight / 2
+        if target < center:
+            span = center - prev_center
+            if span <= 0:
+                return mean
+            return prev_mean + (mean - prev_mean) * (target - prev_center) / span
+        prev_center, prev_mean = center, mean
+        cumulative += weight
+    span = total - prev_center
+    if span <= 0:
+        return sketch["max"]
+    return prev_mean + (sketch["max"] - prev_mean) * (target - prev_center) / span
+
+
+def sketch_mad(sketch, median=None):
+    """Median absolute deviation, from the centroids' distances to the median."""
+    if not sketch["centroids"]:
+        return None
+    if median is None:
+        median = sketch_quantile(sketch, 0.5)
+    deviations = sorted((abs(m - median), w) for m, w in sketch["centroids"])
+    half = sum(w for _d, w in deviations) / 2
+    cumulative = 0
+    for deviation, weight in deviations:
+        cumulative += weight
+        if cumulative >= half:
+            return deviation
+    return deviations[-1][0]
+
+
+# ============================================================================
+# REDIS STORAGE - one hash per sensor, one field per hour bucket
+# ============================================================================
+
+def _sketch_cache_key(sensor_type, sensor_id=None):
+    if sensor_id:
+        return f"iot_quantiles|{sensor_type}|{sensor_id}"
+    return f"iot_quantiles|{sensor_type}"
+
+
+def _sketch_bucket(ts):
+    epoch = int(get_datetime(ts).timestamp())
+    return epoch - epoch % SKETCH_BUCKET_SECONDS
+
+
+def update_quantile_sketches(rows):
+    """Fold ingested rows into the hour digests of their sensor type and
+    sensor_id. Values are grouped per key and bucket first, so each digest
+    is read, compressed and written once per batch."""
+    now = now_datetime()
+    values = {}
+    for row in rows:
+        value = row.get("temperature")
+        sensor_type = row.get("sensor_type")
+        if value is None or not sensor_type:
+            continue
+        bucket = _sketch_bucket(reading_time(row, now))
+        values.setdefault((_sketch_cache_key(sensor_type), bucket), []).append(value)
+        if row.get("sensor_id"):
+            values.setdefault((_sketch_cache_key(sensor_type, row.get("sensor_id")), bucket), []).append(value)
+    fold_into_sketches(values)
+
+
+def fold_into_sketches(values):
+    """Add {(cache_key, hour_bucket): [values]} to the stored hour digests,
+    evicting buckets past the retention. Shared with the lateness metrics."""
+    if not values:
+        return
+
+    cache = frappe.cache()
+    cutoff = _sketch_bucket(add_to_date(now_datetime(), hours=-SKETCH_RETENTION_HOURS))
+    touched = set()
+    for (key, bucket), batch in values.items():
+        if bucket < cutoff:
+            continue
+        sketch = cache.hget(key, str(bucket)) or new_sketch()
+        cache.hset(key, str(bucket), sketch_add(sketch, batch))
+        touched.add(key)
+
+    for key in touched:
+        for field in cache.hkeys(key):
+            field = field.decode() if isinstance(field, bytes) else field
+            if int(field) < cutoff:
+                cache.hdel(key, field)
+        cache.expire(cache.make_key(key), SKETCH_RETENTION_HOURS * 3600)
+
+
+def get_merged_sketch(sensor_type, sensor_ids=None, hours=1):
+    """Merge the hour digests overlapping the last `hours` for a sensor
+    type or a list of its sensor_ids."""
+    if sensor_ids is None:
+        keys = [_sketch_cache_key(sensor_type)]
+    else:
+        keys = [_sketch_cache_key(sensor_type, sid) for sid in sensor_ids]
+    return merge_stored_sketches(keys, hours)
+
+
+def merge_stored_sketches(keys, hours=1):
+    """Merge the hour digests of several cache keys over the last `hours`."""
+    cutoff = _sketch_bucket(add_to_date(now_datetime(), hours=-float(hours)))
+    merged = new_sketch()
+    for key in keys:
+        for bucket, sketch in (frappe.cache().hgetall(key) or {}).items():
+            if int(bucket) >= cutoff:
+                merged = sketch_merge(merged, sketch)
+    return merged
+
+
+def robust_stats(sketch):
+    """Median, MAD and IQR of a sketch, for outlier checks."""
+    if not sketch["count"]:
+        return {"count": 0}
+    median = sketch_quantile(sketch, 0.5)
+    return {
+        "count": sketch["count"],
+        "median": median,
+        "mad": sketch_mad(sketch, median),
+        "iqr": sketch_quantile(sketch, 0.75) - sketch_quantile(sketch, 0.25),
+    }
+
+
+def get_robust_stats(sensor_type, sensor_id=None, hours=1):
+    """Robust stats per sensor_id when it has enough history, otherwise
+    for the whole sensor type."""
+    if sensor_id:
+        stats = robust_stats(get_merged_sketch(sensor_type, [sensor_id], hours))
+        if stats["count"] >= OUTLIER_MIN_COUNT:
+            return stats
+    return robust_stats(get_merged_sketch(sensor_type, None, hours))
+
+
+def robust_outlier_warning(value, stats):
+    """Modified z-score outlier warning, else None. Falls back to the IQR
+    when more than half the readings share one value (MAD of zero)."""
+    if not stats or stats.get("count", 0) < OUTLIER_MIN_COUNT:
+        return None
+    median = stats["median"]
+    if stats["mad"]:
+        z = _MAD_TO_SIGMA * (value - median) / stats["mad"]
+    elif stats["iqr"]:
+        z = _IQR_TO_SIGMA * (value - median) / stats["iqr"]
+    else:
+        return None
+    if abs(z) > OUTLIER_MODIFIED_Z:
+        return f"Outlier: value {value} has robust z {abs(z):.1f} from median {median:.1f}"
+    return None
+
+
+@frappe.whitelist()
+def get_sensor_quantiles(sensor_type, sensor_id=None, rpi_id=None, hours=1, quantiles=None):
+    """Quantiles of recent readings for a sensor type, one sensor_id or the
+    sensors of one rpi_id. quantiles is a comma-separated list of 0..1
+    values (default 0.05,0.25,0.5,0.75,0.95). No SQL is issued."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import resolve_sensor_filter
+
+    if quantiles:
+        if isinstance(quantiles, str):
+            quantiles = quantiles.split(",")
+        quantiles = [float(q) for q in quantiles]
+        if any(q < 0 or q > 1 for q in quantiles):
+            frappe.throw(_("Quantiles must be between 0 and 1"))
+    else:
+        quantiles = DEFAULT_QUANTILES
+
+    sketch = get_merged_sketch(sensor_type, resolve_sensor_filter(sensor_id, rpi_id), hours)
+    result = {
+        "sensor_type": sensor_type,
+        "sensor_id": sensor_id,
+        "rpi_id": rpi_id,
+        "hours": float(hours),
+        "count": sketch["count"],
+    }
+    if not sketch["count"]:
+        return result
+    result.update(robust_stats(sketch))
+    result.update({
+        "min": sketch["min"],
+        "max": sketch["max"],
+        "quantiles": {str(q): round(sketch_quantile(sketch, q), SKETCH_PRECISION) for q in quantiles},
+    })
+    return result
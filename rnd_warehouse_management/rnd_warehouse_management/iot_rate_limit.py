@@ -0,0 +1,192 @@
+"""Phase 6.18: IoT Ingest Rate Limits
+Token buckets per rpi_id and per sensor type, checked in one Redis Lua call
+before an ingest or validation request touches the database. Tokens are
+readings: a call costs its row count, and at least min_call_cost so a Pi
+posting single readings every few milliseconds drains its bucket as fast as
+one posting large batches. A call is admitted only if every bucket it
+touches has the tokens; otherwise nothing is taken and the caller gets 429
+with retry_after, the seconds until the emptiest bucket has refilled enough.
+
+Limits (site_config "iot_rate_limits", merged over DEFAULT_RATE_LIMITS):
+    {"enabled": true, "min_call_cost": 10,
+     "rpi": {"rate": 100, "burst": 6000},
+     "sensor_type": {"rate": 2000, "burst": 20000},
+     "rpi_overrides": {"RPi-07": {"rate": 20, "burst": 1000}},
+     "sensor_type_overrides": {"PLC_pH": {"rate": 0}}}
+rate is tokens per second (0 disables that bucket), burst the bucket size.
+If Redis fails the check lets the call through."""
+import frappe
+import math
+
+DEFAULT_RATE_LIMITS = {
+    "enabled": True,
+    "min_call_cost": 10,
+    "rpi": {"rate": 100, "burst": 6000},
+    "sensor_type": {"rate": 2000, "burst": 20000},
+    "rpi_overrides": {},
+    "sensor_type_overrides": {},
+}
+
+RATE_LIMIT_PREFIX = "iot_rate_limit"
+THROTTLED_KEYS = "iot_rate_limit|throttled"
+# Throttle counters are dropped a day after a key was last throttled
+THROTTLE_STATS_TTL = 86400
+
+# KEYS: buckets. ARGV: per bucket rate, burst, cost. All or nothing; returns
+# {1, "0", 0} or {0, seconds to wait, index of the bucket that is short}.
+TOKEN_BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local levels = {}
+local wait, short = 0, 0
+for i, key in ipairs(KEYS) do
+    local rate, burst, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    levels[i] = tokens
+    if tokens < cost and (cost - tokens) / rate > wait then
+        wait, short = (cost - tokens) / rate, i
+    end
+end
+if short > 0 then
+    return {0, tostring(wait), short}
+end
+for i, key in ipairs(KEYS) do
+    local rate, burst, cost = tonumber(ARGV[i * 3 - 2]), tonumber(ARGV[i * 3 - 1]), tonumber(ARGV[i * 3])
+    redis.call('HSET', key, 'tokens', tostring(levels[i] - cost), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 60)
+end
+return {1, '0', 0}
+"""
+
+_script = None
+
+
+def get_rate_limits():
+    limits = dict(DEFAULT_RATE_LIMITS)
+    limits.update(frappe.conf.get("iot_rate_limits") or {})
+    return limits
+
+
+def _bucket_limit(limits, scope, name):
+    spec = dict(limits[scope])
+    spec.update((limits.get(f"{scope}_overrides") or {}).get(name) or {})
+    return float(spec.get("rate") or 0), float(spec.get("burst") or 0)
+
+
+def plan_buckets(rows, rpi_id=None, limits=None, by_sensor=None):
+    """[(scope, name, rate, burst, cost)] a call of rows must draw from.
+    Rows without rpi_id are charged to the batch's rpi_id, else to the
+    device the sensor_id is registered on."""
+    limits = limits or get_rate_limits()
+    min_cost = int(limits.get("min_call_cost") or 1)
+    per_device, per_type = {}, {}
+    for row in rows:
+        device = row.get("rpi_id") or rpi_id or ((by_sensor or {}).get(row.get("sensor_id")) or {}).get("rpi_id")
+        if device:
+            per_device[device] = per_device.get(device, 0) + 1
+        if row.get("sensor_type"):
+            per_type[row["sensor_type"]] = per_type.get(row["sensor_type"], 0) + 1
+
+    buckets = []
+    for scope, counts, floor in (("rpi", per_device, min_cost), ("sensor_type", per_type, 1)):
+        for name in sorted(counts):
+            rate, burst = _bucket_limit(limits, scope, name)
+            if rate > 0 and burst > 0:
+                # A call larger than the bucket takes the whole bucket
+                buckets.append((scope, name, rate, burst, min(max(counts[name], floor), burst)))
+    return buckets
+
+
+def _take_tokens(buckets):
+    """Run the token bucket script; returns (allowed, wait_seconds, bucket)."""
+    global _script
+    cache = frappe.cache()
+    if _script is None:
+        _script = cache.register_script(TOKEN_BUCKET_SCRIPT)
+    keys = [cache.make_key(f"{RATE_LIMIT_PREFIX}|{scope}|{name}") for scope, name, *_limit in buckets]
+    args = [value for _scope, _name, *limit in buckets for value in limit]
+    allowed, wait, short = _script(keys=keys, args=args)
+    return bool(int(allowed)), float(wait), buckets[int(short) - 1] if int(short) else None
+
+
+# ============================================================================
+# CHECK
+# ============================================================================
+
+def check_rate_limit(rows, rpi_id=None):
+    """None when the call may proceed, else the 429 response body (and the
+    HTTP status is set). Call before any database work."""
+    limits = get_rate_limits()
+    if not limits.get("enabled"):
+        return None
+    by_sensor = None
+    if not rpi_id and any(not row.get("rpi_id") for row in rows):
+        from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_device_registry
+        by_sensor = get_device_registry()["by_sensor"]
+    buckets = plan_buckets(rows, rpi_id, limits, by_sensor)
+    if not buckets:
+        return None
+
+    try:
+        allowed, wait, short = _take_tokens(buckets)
+    except Exception:
+        frappe.log_error(frappe.get_traceback(), "IoT rate limit check failed")
+        return None
+    if allowed:
+        return None
+
+    scope, name = short[0], short[1]
+    _record_throttle(scope, name, len(rows))
+    if getattr(frappe.local, "response", None) is not None:
+        frappe.local.response["http_status_code"] = 429
+    return {
+        "error": f"Rate limit exceeded for {scope} {name}",
+        "code": "rate_limited",
+        "limit": f"{scope}:{name}",
+        "retry_after": max(1, math.ceil(wait)),
+    }
+
+
+def _record_throttle(scope, name, rows):
+    cache = frappe.cache()
+    member = f"{scope}|{name}"
+    pipe = cache.pipeline()
+    for suffix, amount in (("calls", 1), ("rows", rows)):
+        key = cache.make_key(f"{THROTTLED_KEYS}|{member}|{suffix}")
+        pipe.incrby(key, amount)
+        pipe.expire(key, THROTTLE_STATS_TTL)
+    pipe.execute()
+    cache.sadd(THROTTLED_KEYS, member)
+
+
+# ============================================================================
+# DASHBOARD
+# ============================================================================
+
+@frappe.whitelist()
+def get_throttle_stats():
+    """Calls and rows rejected per rpi_id / sensor type over the last day
+    of throttling, most throttled first."""
+    cache = frappe.cache()
+    entries, expired = [], []
+    for member in cache.smembers(THROTTLED_KEYS) or ():
+        member = member.decode() if isinstance(member, bytes) else member
+        calls = cache.get(cache.make_key(f"{THROTTLED_KEYS}|{member}|calls"))
+        if calls is None:
+            expired.append(member)
+            continue
+        scope, name = member.split("|", 1)
+        rows = cache.get(cache.make_key(f"{THROTTLED_KEYS}|{member}|rows"))
+        entries.append({"scope": scope, "name": name, "calls": int(calls), "rows": int(rows or 0)})
+    if expired:
+        cache.srem(THROTTLED_KEYS, *expired)
+    entries.sort(key=lambda e: (-e["calls"], e["scope"], e["name"]))
+    return {
+        "enabled": bool(get_rate_limits().get("enabled")),
+        "throttled_calls": sum(e["calls"] for e in entries),
+        "throttled_rows": sum(e["rows"] for e in entries),
+        "keys": entries,
+    }
@@ -0,0 +1,459 @@
+"""Phase 6.20: IoT Derived Data Rebuild
+Recomputes the structures derived from raw IoT Sensor Reading history after
+a threshold change or a bug fix, via bench execute:
+
+    bench --site <site> execute rnd_warehouse_management.rnd_warehouse_management.iot_rebuild.run \\
+        --kwargs '{"targets": "rollups,health", "workers": 4, "duty_cycle": 0.5}'
+
+The work is split into chunks that run on a process pool:
+- rollups: one chunk per (sensor type, chunk_hours of hours), each a
+  rebuild_rollups of that range. Only hours behind the lateness horizon are
+  rebuilt, so no chunk races the additive updates made on ingest. Types
+  under swinging-door compression (iot_compression) are skipped: only their
+  kept points are stored, so a rebuild would replace their rollups, built
+  on ingest from every reading, with undercounted ones.
+- gaps, health, drift: one replay chunk per sensor type, which streams the
+  type's whole history (live and archived) in time order once and rebuilds
+  the gap index, Sensor Health Snapshot and drift states from it.
+Every chunk replaces what it covers, so running one twice gives the same
+result. Finished chunks are recorded in a checkpoint file under the site's
+private files; running the same command again resumes with the chunks not
+yet done (fresh=1 starts over).
+
+Throttling: workers sets the pool size, each worker runs at lower CPU
+priority (nice), sleeps after each unit of work so it is busy only
+duty_cycle of the time, and waits while ingest has flagged the database as
+slow (iot_spool). Rolling stats and quantile sketches only cover the last
+hours to days and rebuild themselves from new readings; they are not
+replayed."""
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, add_to_date, get_datetime, time_diff_in_seconds
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+    READING_TIME_FIELD, floor_to_minutes, reading_time, rebuild_rollups)
+
+
+REBUILD_TARGETS = ("rollups", "gaps", "health", "drift")
+REPLAY_TARGETS = ("gaps", "health", "drift")
+DEFAULT_WORKERS = 2
+DEFAULT_CHUNK_HOURS = 6
+DEFAULT_NICE = 10
+# Hours of readings a replay loads and folds at a time
+REPLAY_WINDOW_HOURS = 6
+REBUILD_DIR = "iot_rebuild"
+DB_SLOW_POLL_SECONDS = 5
+GAP_INSERT_CHUNK = 1000
+
+_duty_cycle = 1.0
+
+
+def _split(value):
+    if not value:
+        return []
+    if isinstance(value, str):
+        return [v.strip() for v in value.split(",") if v.strip()]
+    return list(value)
+
+
+def parse_targets(targets=None):
+    targets = _split(targets) or list(REBUILD_TARGETS)
+    unknown = [t for t in targets if t not in REBUILD_TARGETS]
+    if unknown:
+        frappe.throw(_("Unknown rebuild targets: {0}").format(", ".join(unknown)))
+    return [t for t in REBUILD_TARGETS if t in targets]
+
+
+# ============================================================================
+# PLAN
+# ============================================================================
+
+def plan_chunks(targets, sensor_types, start=None, end=None, chunk_hours=DEFAULT_CHUNK_HOURS):
+    """Chunks to run, in order: the replays of each sensor type first (they
+    are the longest), then its rollup ranges. Compressed types get no rollup
+    chunks. Each chunk is a dict with an id that stays the same across runs
+    of the same plan."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_compression import is_compressed
+
+    replay = [t for t in targets if t in REPLAY_TARGETS]
+    chunks = []
+    if replay:
+        for sensor_type in sensor_types:
+            chunks.append({"id": f"replay|{sensor_type}", "kind": "replay",
+                           "sensor_type": sensor_type, "targets": replay})
+    rollup_types = [t for t in sensor_types if not is_compressed(t)]
+    if "rollups" in targets and start and end and rollup_types:
+        chunk_start = floor_to_minutes(start, 60)
+        end = get_datetime(end)
+        while chunk_start < end:
+            chunk_end = min(add_to_date(chunk_start, hours=int(chunk_hours)), end)
+            for sensor_type in rollup_types:
+                chunks.append({"id": f"rollups|{sensor_type}|{chunk_start}", "kind": "rollups",
+                               "sensor_type": sensor_type, "start": str(chunk_start), "end": str(chunk_end)})
+            chunk_start = chunk_end
+    return chunks
+
+
+def get_sensor_types():
+    """Every type that has readings: each has a health snapshot, and types
+    only found in the live table (snapshots lost) are added."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import HEALTH_SNAPSHOT_DOCTYPE
+
+    types = {r[0] for r in frappe.db.sql(
+        f"SELECT DISTINCT sensor_type FROM `tab{HEALTH_SNAPSHOT_DOCTYPE}` WHERE sensor_type IS NOT NULL")}
+    types.update(r[0] for r in frappe.db.sql(
+        "SELECT DISTINCT sensor_type FROM `tabIoT Sensor Reading` WHERE sensor_type IS NOT NULL"))
+    return sorted(types)
+
+
+def get_history_start(sensor_type=None):
+    """Time of the oldest reading: the snapshots' first_seen covers archived
+    days, the live table covers types whose snapshots were lost."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import HEALTH_SNAPSHOT_DOCTYPE
+
+    condition = " WHERE sensor_type = %(sensor_type)s" if sensor_type else ""
+    params = {"sensor_type": sensor_type}
+    candidates = [
+        frappe.db.sql(f"SELECT MIN(first_seen) FROM `tab{HEALTH_SNAPSHOT_DOCTYPE}`{condition}", params)[0][0],
+        frappe.db.sql(f"SELECT MIN(`{READING_TIME_FIELD}`) FROM `tabIoT Sensor Reading`{condition}", params)[0][0],
+    ]
+    candidates = [get_datetime(c) for c in candidates if c]
+    return min(candidates) if candidates else None
+
+
+def get_rollup_boundary(now=None):
+    """Rollups are rebuilt up to the last hour behind the lateness horizon;
+    later hours are still updated by ingest."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_lateness import get_lateness_horizon
+
+    return floor_to_minutes((now or now_datetime()) - get_lateness_horizon(), 60)
+
+
+# ============================================================================
+# CHECKPOINT
+# ============================================================================
+
+def run_id(params):
+    return hashlib.md5(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def get_checkpoint_path(rebuild_id):
+    path = frappe.get_site_path("private", "files", REBUILD_DIR)
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, f"{rebuild_id}.json")
+
+
+def load_checkpoint(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def save_checkpoint(path, checkpoint):
+    """Write through a temporary file so an interrupted run never leaves a
+    truncated checkpoint."""
+    checkpoint["updated"] = str(now_datetime())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as handle:
+        json.dump(checkpoint, handle, default=str, indent=1)
+    os.replace(tmp, path)
+
+
+def pending_chunks(checkpoint):
+    done = checkpoint.get("done") or {}
+    return [c for c in checkpoint["chunks"] if c["id"] not in done]
+
+
+# ============================================================================
+# THROTTLING
+# ============================================================================
+
+def _wait_while_db_slow():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_spool import is_db_slow
+
+    while is_db_slow():
+        time.sleep(DB_SLOW_POLL_SECONDS)
+
+
+def pause_after(busy_seconds, duty_cycle=None):
+    """Seconds to sleep after busy_seconds of work to stay at duty_cycle."""
+    duty_cycle = _duty_cycle if duty_cycle is None else duty_cycle
+    if duty_cycle >= 1 or duty_cycle <= 0:
+        return 0
+    return busy_seconds * (1 - duty_cycle) / duty_cycle
+
+
+def _throttle(started):
+    time.sleep(pause_after(time.monotonic() - started))
+    _wait_while_db_slow()
+
+
+# ============================================================================
+# CHUNKS
+# ============================================================================
+
+def run_chunk(chunk):
+    """Run one chunk and commit. Returns its result for the checkpoint."""
+    _wait_while_db_slow()
+    started = time.monotonic()
+    try:
+        if chunk["kind"] == "rollups":
+            result = rebuild_rollups(chunk["start"], chunk["end"], chunk["sensor_type"])
+            result = {"buckets": result["buckets"]}
+        else:
+            result = replay_sensor_type(chunk["sensor_type"], chunk["targets"])
+        frappe.db.commit()
+    except Exception:
+        frappe.db.rollback()
+        raise
+    _throttle(started)
+    result["seconds"] = round(time.monotonic() - started, 1)
+    return result
+
+
+def replay_sensor_type(sensor_type, targets, as_of=None):
+    """Stream a type's readings oldest first and rebuild the selected
+    structures from them. Readings that arrive while the replay runs are
+    handled by ingest as usual."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import get_readings
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        HEALTH_SNAPSHOT_DOCTYPE, update_health_snapshot)
+
+    as_of = get_datetime(as_of) if as_of else now_datetime()
+    history_start = get_history_start(sensor_type)
+    result = {"rows": 0}
+    if not history_start or history_start >= as_of:
+        return result
+
+    # Health counters are upserted window by window, so the type's snapshots
+    # are cleared first; first_seen is set once the replay is done.
+    if "health" in targets:
+        frappe.db.delete(HEALTH_SNAPSHOT_DOCTYPE, {"sensor_type": sensor_type})
+        frappe.db.commit()
+
+    gap_state = _new_gap_replay() if "gaps" in targets else None
+    drift_states = {} if "drift" in targets else None
+    first_seen = {}
+
+    window_start = floor_to_minutes(history_start, 60)
+    while window_start < as_of:
+        started = time.monotonic()
+        window_end = min(add_to_date(window_start, hours=REPLAY_WINDOW_HOURS), as_of)
+        rows = sorted(get_readings(sensor_type, window_start, window_end), key=reading_time)
+        if rows:
+            result["rows"] += len(rows)
+            if gap_state is not None:
+                _replay_gaps(gap_state, sensor_type, rows)
+            if drift_states is not None:
+                _replay_drift(drift_states, sensor_type, rows)
+            if "health" in targets:
+                update_health_snapshot(rows)
+                for row in rows:
+                    first_seen.setdefault(row.get("sensor_id") or "", reading_time(row))
+                frappe.db.commit()
+        window_start = window_end
+        _throttle(started)
+
+    if gap_state is not None:
+        result["gaps"] = _write_gaps(gap_state, sensor_type, as_of)
+    if drift_states is not None:
+        result["drift_sensors"] = _write_drift_states(drift_states, sensor_type, as_of)
+    if "health" in targets:
+        _fix_first_seen(sensor_type, first_seen)
+        result["health_sensors"] = len(first_seen)
+    return result
+
+
+def _new_gap_replay():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_device_registry
+
+    return {"by_sensor": get_device_registry()["by_sensor"], "last": {}, "gaps": []}
+
+
+def _replay_gaps(state, sensor_type, rows):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_uptime import find_gaps
+
+    times = {}
+    for row in rows:
+        if row.get("sensor_id"):
+            times.setdefault(row["sensor_id"], []).append(reading_time(row))
+    for sensor_id, timestamps in times.items():
+        gaps, state["last"][sensor_id] = find_gaps(state["last"].get(sensor_id), timestamps,
+                                                   _gap_interval(state, sensor_type, sensor_id))
+        state["gaps"].extend((sensor_id, start, end) for start, end in gaps)
+
+
+def _gap_interval(state, sensor_type, sensor_id):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_uptime import get_expected_interval
+
+    return get_expected_interval(sensor_type, sensor_id, state["by_sensor"])
+
+
+def _write_gaps(state, sensor_type, as_of):
+    """Replace the type's gaps that ended before as_of; gaps closed by
+    readings ingested during the replay are kept."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_uptime import (
+        GAP_DOCTYPE, GAP_RETENTION_DAYS, _GAP_COLUMNS)
+
+    retention_start = add_to_date(now_datetime(), days=-GAP_RETENTION_DAYS)
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for sensor_id, start, end in state["gaps"]:
+        if end < retention_start:
+            continue
+        interval = _gap_interval(state, sensor_type, sensor_id)
+        values.append((frappe.generate_hash(length=10), now, now, user, user,
+                       sensor_type, sensor_id, interval, start, end, time_diff_in_seconds(end, start)))
+
+    frappe.db.delete(GAP_DOCTYPE, {"sensor_type": sensor_type, "gap_end": ["<", as_of]})
+    for i in range(0, len(values), GAP_INSERT_CHUNK):
+        frappe.db.bulk_insert(GAP_DOCTYPE, _GAP_COLUMNS, values[i:i + GAP_INSERT_CHUNK])
+    frappe.db.commit()
+    return len(values)
+
+
+def _replay_drift(states, sensor_type, rows):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        advance_drift_state, _new_drift_state)
+
+    points = {}
+    for row in rows:
+        if row.get("temperature") is not None:
+            points.setdefault(row.get("sensor_id") or "", []).append(
+                (float(row["temperature"]), reading_time(row)))
+    for sensor_id, sensor_points in points.items():
+        state = states.get(sensor_id)
+        if state is None:
+            state = states[sensor_id] = _new_drift_state()
+        # Replayed events are history: they set last_event but aren't published
+        advance_drift_state(state, sensor_type, sensor_points)
+
+
+def _write_drift_states(states, sensor_type, as_of):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import _drift_cache_key
+
+    cache = frappe.cache()
+    key = _drift_cache_key(sensor_type)
+    cache.delete_value(key)
+    for sensor_id, state in states.items():
+        state["updated"] = str(as_of)
+        cache.hset(key, sensor_id, state)
+    return len(states)
+
+
+def _fix_first_seen(sensor_type, first_seen):
+    """A reading ingested during the replay can create a sensor's snapshot
+    before the replay reaches it, and the upsert keeps the first insert's
+    first_seen."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        HEALTH_SNAPSHOT_DOCTYPE, snapshot_name)
+
+    for sensor_id, ts in first_seen.items():
+        frappe.db.sql(f"""
+            UPDATE `tab{HEALTH_SNAPSHOT_DOCTYPE}` SET first_seen = LEAST(first_seen, %s) WHERE name = %s
+        """, (ts, snapshot_name(sensor_type, sensor_id)))
+    frappe.db.commit()
+
+
+# ============================================================================
+# POOL
+# ============================================================================
+
+def _init_worker(site, sites_path, duty_cycle, nice):
+    global _duty_cycle
+    _duty_cycle = duty_cycle
+    if nice:
+        os.nice(int(nice))
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+
+
+def _progress(done, total, chunk, result, started, rows):
+    elapsed = time.monotonic() - started
+    eta = elapsed / done * (total - done) if done else 0
+    detail = ", ".join(f"{k} {v}" for k, v in result.items()) if isinstance(result, dict) else result
+    print(f"[{done}/{total}] {chunk['id']}: {detail} | {rows} rows, "
+          f"{timedelta(seconds=int(elapsed))} elapsed, ETA {timedelta(seconds=int(eta))}", flush=True)
+
+
+def run(targets=None, start=None, end=None, sensor_type=None, workers=DEFAULT_WORKERS,
+        chunk_hours=DEFAULT_CHUNK_HOURS, duty_cycle=1.0, nice=DEFAULT_NICE, fresh=0):
+    """Rebuild derived IoT data. targets: comma-separated subset of
+    REBUILD_TARGETS (default all); sensor_type: comma-separated types
+    (default all); start/end bound the rollup rebuild (default the whole
+    history up to the lateness horizon); workers=0 runs in this process."""
+    targets = parse_targets(targets)
+    params = {"targets": targets, "start": start, "end": end, "sensor_type": _split(sensor_type),
+              "chunk_hours": int(chunk_hours)}
+    rebuild_id = run_id(params)
+    path = get_checkpoint_path(rebuild_id)
+    checkpoint = None if int(fresh) else load_checkpoint(path)
+
+    if checkpoint is None:
+        sensor_types = params["sensor_type"] or get_sensor_types()
+        boundary = get_rollup_boundary()
+        rollup_start = get_datetime(start) if start else get_history_start()
+        rollup_end = min(get_datetime(end), boundary) if end else boundary
+        checkpoint = {
+            "run_id": rebuild_id, "params": params, "started": str(now_datetime()),
+            "rollup_range": [str(rollup_start), str(rollup_end)] if rollup_start else None,
+            "chunks": plan_chunks(targets, sensor_types, rollup_start, rollup_end, chunk_hours),
+            "done": {}, "failed": {},
+        }
+        save_checkpoint(path, checkpoint)
+        print(f"IoT rebuild {rebuild_id}: {len(checkpoint['chunks'])} chunks, checkpoint {path}", flush=True)
+    else:
+        print(f"IoT rebuild {rebuild_id}: resuming, {len(checkpoint['done'])} of "
+              f"{len(checkpoint['chunks'])} chunks done", flush=True)
+
+    chunks = pending_chunks(checkpoint)
+    checkpoint["failed"] = {}
+    total, done = len(checkpoint["chunks"]), len(checkpoint["done"])
+    started, rows = time.monotonic(), 0
+
+    def finish(chunk, result=None, error=None):
+        nonlocal done, rows
+        if error is None:
+            checkpoint["done"][chunk["id"]] = result
+            done += 1
+            rows += result.get("rows", 0)
+        else:
+            checkpoint["failed"][chunk["id"]] = error
+        save_checkpoint(path, checkpoint)
+        _progress(done, total, chunk, result if error is None else f"FAILED {error}", started, rows)
+
+    if not int(workers):
+        global _duty_cycle
+        _duty_cycle = float(duty_cycle)
+        for chunk in chunks:
+            try:
+                finish(chunk, run_chunk(chunk))
+            except Exception as e:
+                frappe.log_error(frappe.get_traceback(), f"IoT rebuild chunk {chunk['id']} failed")
+                finish(chunk, error=str(e))
+    else:
+        with ProcessPoolExecutor(max_workers=int(workers), mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker,
+                                 initargs=(frappe.local.site, frappe.local.sites_path,
+                                           float(duty_cycle), int(nice))) as executor:
+            futures = {executor.submit(run_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                try:
+                    finish(futures[future], future.result())
+                except Exception as e:
+                    finish(futures[future], error=str(e))
+
+    status = "completed" if done == total else "incomplete"
+    print(f"IoT rebuild {rebuild_id} {status}: {done}/{total} chunks, {len(checkpoint['failed'])} failed"
+          + ("; run again to retry" if checkpoint["failed"] else ""), flush=True)
+    return {"run_id": rebuild_id, "status": status, "done": done, "total": total,
+            "failed": checkpoint["failed"], "checkpoint": path}
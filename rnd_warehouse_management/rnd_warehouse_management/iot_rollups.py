@@ -0,0 +1,412 @@
+"""Phase 6.6: IoT Reading Rollups
+Incrementally maintained 1-minute, 15-minute and 1-hour aggregates per sensor
+and metric, so aggregation and dashboard queries never scan raw readings."""
+import frappe
+from frappe.utils import now_datetime, get_datetime
+import hashlib
+import math
+from datetime import datetime, timedelta
+
+from rnd_warehouse_management.rnd_warehouse_management.plc_integration import DEFAULT_PLC_REGISTER_MAP
+
+
+ROLLUP_DOCTYPE = "IoT Reading Rollup"
+ROLLUP_RESOLUTIONS = (1, 15, 60)
+ROLLUP_METRICS = ("temperature", "humidity", "ph", "brix", "color_index")
+ROLLUP_INSERT_CHUNK = 500
+# IoT Sensor Reading custom field (fixture) holding the device's own timestamp
+READING_TIME_FIELD = "device_time"
+
+_EPOCH = datetime(1970, 1, 1)
+
+_ROLLUP_COLUMNS = (
+    "name", "creation", "modified", "owner", "modified_by",
+    "resolution", "sensor_type", "sensor_id", "metric", "bucket_start",
+    "reading_count", "value_sum", "value_sum_sq", "min_value", "max_value",
+    "avg_value", "last_reading"
+)
+
+# MariaDB applies ON DUPLICATE KEY assignments left to right, so avg_value
+# sees the already-updated sum and count.
+_ADDITIVE_UPDATE = """
+    reading_count = reading_count + VALUES(reading_count),
+    value_sum = value_sum + VALUES(value_sum),
+    value_sum_sq = value_sum_sq + VALUES(value_sum_sq),
+    min_value = LEAST(min_value, VALUES(min_value)),
+    max_value = GREATEST(max_value, VALUES(max_value)),
+    avg_value = value_sum / reading_count,
+    last_reading = GREATEST(last_reading, VALUES(last_reading)),
+    modified = VALUES(modified)
+"""
+
+_REPLACE_UPDATE = """
+    reading_count = VALUES(reading_count),
+    value_sum = VALUES(value_sum),
+    value_sum_sq = VALUES(value_sum_sq),
+    min_value = VALUES(min_value),
+    max_value = VALUES(max_value),
+    avg_value = VALUES(avg_value),
+    last_reading = VALUES(last_reading),
+    modified = VALUES(modified)
+"""
+
+
+# ============================================================================
+# BUCKETING HELPERS
+# ============================================================================
+
+def floor_to_minutes(dt, minutes):
+    """Floor a naive datetime to a multiple of `minutes` since the epoch."""
+    dt = get_datetime(dt)
+    total = int((dt - _EPOCH).total_seconds() // 60)
+    return _EPOCH + timedelta(minutes=total - total % minutes)
+
+
+def reading_time(row, default=None):
+    """When a reading was taken: its device_time, else its arrival (creation).
+    Every bucket is keyed on this, so buffered readings that arrive late
+    still land in the bucket they were measured in."""
+    return get_datetime(row.get(READING_TIME_FIELD) or row.get("creation") or default or now_datetime())
+
+
+def pick_resolution(interval_minutes):
+    """Coarsest rollup resolution that evenly divides interval_minutes."""
+    for resolution in sorted(ROLLUP_RESOLUTIONS, reverse=True):
+        if interval_minutes % resolution == 0:
+            return resolution
+    return min(ROLLUP_RESOLUTIONS)
+
+
+def primary_metric(sensor_type):
+    """Metric a sensor type reports by default. PLC readings carry their
+    register value in the temperature column, so map them to the register's
+    parameter (ph, brix, color_index)."""
+    return DEFAULT_PLC_REGISTER_MAP.get(sensor_type, {}).get("parameter", "temperature")
+
+
+def row_metrics(row):
+    """Extract {metric: value} from a reading row."""
+    metrics = {}
+    for metric in ROLLUP_METRICS:
+        value = row.get(metric)
+        if value is None:
+            continue
+        try:
+            metrics[metric] = float(value)
+        except (ValueError, TypeError):
+            continue
+
+    primary = primary_metric(row.get("sensor_type"))
+    if primary != "temperature" and primary not in metrics and "temperature" in metrics:
+        metrics[primary] = metrics.pop("temperature")
+    return metrics
+
+
+def _metric_sql(metric, columns):
+    """SQL expression for one metric's value in a reading row, following
+    row_metrics: a PLC type's temperature counts as its register parameter
+    when the row has no value of its own for it. columns are the metric
+    columns the reading doctype has. None when no row can have the metric."""
+    moved = {}
+    for sensor_type in DEFAULT_PLC_REGISTER_MAP:
+        primary = primary_metric(sensor_type)
+        if primary != "temperature":
+            moved.setdefault(primary, []).append(frappe.db.escape(sensor_type))
+
+    if metric == "temperature":
+        if "temperature" not in columns:
+            return None
+        conditions = [
+            f"(sensor_type IN ({', '.join(types)})" + (f" AND `{primary}` IS NULL)" if primary in columns else ")")
+            for primary, types in moved.items()
+        ]
+        if not conditions:
+            return "`temperature`"
+        return f"CASE WHEN {' OR '.join(conditions)} THEN NULL ELSE `temperature` END"
+
+    expression = f"`{metric}`" if metric in columns else None
+    if metric in moved and "temperature" in columns:
+        alias = f"CASE WHEN sensor_type IN ({', '.join(moved[metric])}) THEN `temperature` END"
+        expression = f"COALESCE({expression}, {alias})" if expression else alias
+    return expression
+
+
+def rollup_name(resolution, sensor_type, sensor_id, metric, bucket_start):
+    """Deterministic primary key so upserts hit the same row."""
+    key = f"{resolution}|{sensor_type}|{sensor_id or ''}|{metric}|{bucket_start:%Y-%m-%d %H:%M}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def _new_partial(value, ts):
+    return {"count": 1, "sum": value, "sum_sq": value * value, "min": value, "max": value, "last": ts}
+
+
+def _add_to_partial(acc, value, ts):
+    acc["count"] += 1
+    acc["sum"] += value
+    acc["sum_sq"] += value * value
+    acc["min"] = min(acc["min"], value)
+    acc["max"] = max(acc["max"], value)
+    acc["last"] = max(acc["last"], ts)
+
+
+def _merge_partials(acc, other):
+    acc["count"] += other["count"]
+    acc["sum"] += other["sum"]
+    acc["sum_sq"] += other["sum_sq"]
+    acc["min"] = min(acc["min"], other["min"])
+    acc["max"] = max(acc["max"], other["max"])
+    acc["last"] = max(acc["last"], other["last"])
+
+
+# ============================================================================
+# INCREMENTAL MAINTENANCE
+# ============================================================================
+
+def update_rollups(rows):
+    """Fold ingested rows into every rollup resolution. The whole batch is
+    pre-aggregated in memory and written with one upsert per chunk."""
+    partials = {}
+    _fold_rows(partials, rows)
+    _upsert_rollups(partials)
+
+
+def _fold_rows(partials, rows):
+    """Pre-aggregate reading rows into partials for every resolution."""
+    now = now_datetime()
+    for row in rows:
+        sensor_type = row.get("sensor_type")
+        if not sensor_type:
+            continue
+        ts = reading_time(row, now)
+        sensor_id = row.get("sensor_id") or ""
+        for metric, value in row_metrics(row).items():
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (resolution, sensor_type, sensor_id, metric, floor_to_minutes(ts, resolution))
+                acc = partials.get(key)
+                if acc is None:
+                    partials[key] = _new_partial(value, ts)
+                else:
+                    _add_to_partial(acc, value, ts)
+
+
+def _upsert_rollups(partials, replace=False):
+    """Write {(resolution, sensor_type, sensor_id, metric, bucket): partial}.
+    replace=False adds to existing buckets, replace=True overwrites them."""
+    if not partials:
+        return
+
+    now = now_datetime()
+    user = frappe.session.user
+    values = []
+    for (resolution, sensor_type, sensor_id, metric, bucket), acc in partials.items():
+        values.append((
+            rollup_name(resolution, sensor_type, sensor_id, metric, bucket),
+            now, now, user, user,
+            resolution, sensor_type, sensor_id or None, metric, bucket,
+            acc["count"], acc["sum"], acc["sum_sq"], acc["min"], acc["max"],
+            acc["sum"] / acc["count"], acc["last"]
+        ))
+
+    row_placeholder = "(" + ", ".join(["%s"] * len(_ROLLUP_COLUMNS)) + ")"
+    columns = ", ".join(f"`{c}`" for c in _ROLLUP_COLUMNS)
+    update = _REPLACE_UPDATE if replace else _ADDITIVE_UPDATE
+    for i in range(0, len(values), ROLLUP_INSERT_CHUNK):
+        chunk = values[i:i + ROLLUP_INSERT_CHUNK]
+        frappe.db.sql(
+            f"INSERT INTO `tab{ROLLUP_DOCTYPE}` ({columns}) VALUES "
+            + ", ".join([row_placeholder] * len(chunk))
+            + f" ON DUPLICATE KEY UPDATE {update}",
+            [v for row in chunk for v in row]
+        )
+
+
+def rebuild_rollups(start, end, sensor_type=None):
+    """Recompute all rollups for [start, end) from raw readings, live and
+    archived. The range is widened to whole hours so every coarse bucket is
+    rebuilt from complete data. Run via bench execute for history that
+    predates incremental maintenance; iot_lateness uses it for single hours
+    touched by readings that arrived past the lateness horizon. Types under
+    swinging-door compression only have their stored points left, so their
+    counts come out lower than the incremental rollups'."""
+    start = floor_to_minutes(start, 60)
+    end = floor_to_minutes(get_datetime(end) + timedelta(minutes=59), 60)
+
+    conditions = f"`{READING_TIME_FIELD}` >= %(start)s AND `{READING_TIME_FIELD}` < %(end)s"
+    params = {"start": start, "end": end}
+    if sensor_type:
+        conditions += " AND sensor_type = %(sensor_type)s"
+        params["sensor_type"] = sensor_type
+
+    meta = frappe.get_meta("IoT Sensor Reading")
+    columns = [m for m in ROLLUP_METRICS if meta.has_field(m)]
+
+    partials = {}
+    for metric in ROLLUP_METRICS:
+        value = _metric_sql(metric, columns)
+        if not value:
+            continue
+        minute_rows = frappe.db.sql(f"""
+            SELECT sensor_type, IFNULL(sensor_id, '') as sensor_id,
+                TIMESTAMPDIFF(MINUTE, '1970-01-01', `{READING_TIME_FIELD}`) as minute_no,
+                COUNT(v) as cnt, SUM(v) as total, SUM(v * v) as total_sq,
+                MIN(v) as min_val, MAX(v) as max_val,
+                MAX(`{READING_TIME_FIELD}`) as last_reading
+            FROM (
+                SELECT sensor_type, sensor_id, `{READING_TIME_FIELD}`, {value} as v
+                FROM `tabIoT Sensor Reading`
+                WHERE {conditions} AND sensor_type IS NOT NULL
+            ) readings
+            WHERE v IS NOT NULL
+            GROUP BY sensor_type, sensor_id, minute_no
+        """, params, as_dict=True)
+
+        for r in minute_rows:
+            bucket = _EPOCH + timedelta(minutes=int(r.minute_no))
+            partial = {
+                "count": int(r.cnt), "sum": float(r.total), "sum_sq": float(r.total_sq),
+                "min": float(r.min_val), "max": float(r.max_val),
+                "last": get_datetime(r.last_reading)
+            }
+            for resolution in ROLLUP_RESOLUTIONS:
+                key = (resolution, r.sensor_type, r.sensor_id, metric, floor_to_minutes(bucket, resolution))
+                if key in partials:
+                    _merge_partials(partials[key], partial)
+                else:
+                    partials[key] = dict(partial)
+
+    # Days already moved to the archive tier are folded in from segment files
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import (
+        get_archived_readings, get_hot_cutoff)
+    cutoff = get_hot_cutoff()
+    if start < cutoff:
+        _fold_rows(partials, get_archived_readings(sensor_type, start, min(end, cutoff)))
+
+    delete_conditions = "bucket_start >= %(start)s AND bucket_start < %(end)s"
+    if sensor_type:
+        delete_conditions += " AND sensor_type = %(sensor_type)s"
+    frappe.db.sql(f"DELETE FROM `tab{ROLLUP_DOCTYPE}` WHERE {delete_conditions}", params)
+    _upsert_rollups(partials, replace=True)
+    frappe.db.commit()
+    return {"start": str(start), "end": str(end), "buckets": len(partials)}
+
+
+# ============================================================================
+# QUERIES
+# ============================================================================
+
+def get_rollup_buckets(sensor_type, metric, start, end=None, resolution=60, sensor_id=None):
+    """Rollup rows for one sensor type (all sensor_ids merged unless one id,
+    or a list of ids, is given), one row per bucket."""
+    conditions = ["resolution = %(resolution)s", "sensor_type = %(sensor_type)s",
+                  "metric = %(metric)s", "bucket_start >= %(start)s"]
+    params = {"resolution": resolution, "sensor_type": sensor_type, "metric": metric,
+              "start": start, "end": end, "sensor_id": sensor_id}
+    if end:
+        conditions.append("bucket_start < %(end)s")
+    if isinstance(sensor_id, (list, tuple, set)):
+        if not sensor_id:
+            return []
+        params["sensor_id"] = tuple(sensor_id)
+        conditions.append("sensor_id IN %(sensor_id)s")
+    elif sensor_id:
+        conditions.append("sensor_id = %(sensor_id)s")
+
+    return frappe.db.sql(f"""
+        SELECT bucket_start, SUM(reading_count) as reading_count,
+               SUM(value_sum) as value_sum, SUM(value_sum_sq) as value_sum_sq,
+               MIN(min_value) as min_value, MAX(max_value) as max_value,
+               MAX(last_reading) as last_reading
+        FROM `tab{ROLLUP_DOCTYPE}`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY bucket_start
+        ORDER BY bucket_start
+    """, params, as_dict=True)
+
+
+def aggregate_series(sensor_type, interval_minutes, start, end=None, metric=None, sensor_id=None):
+    """avg/min/max/count/std per interval, read from the coarsest rollup that
+    divides the interval and merged up to interval_minutes."""
+    metric = metric or primary_metric(sensor_type)
+    resolution = pick_resolution(interval_minutes)
+    start = floor_to_minutes(start, interval_minutes)
+
+    merged = {}
+    for r in get_rollup_buckets(sensor_type, metric, start, end, resolution, sensor_id):
+        bucket = floor_to_minutes(r.bucket_start, interval_minutes)
+        partial = {
+            "count": int(r.reading_count), "sum": float(r.value_sum),
+            "sum_sq": float(r.value_sum_sq), "min": float(r.min_value),
+            "max": float(r.max_value), "last": r.last_reading
+        }
+        if bucket in merged:
+            _merge_partials(merged[bucket], partial)
+        else:
+            merged[bucket] = partial
+
+    series = []
+    for bucket in sorted(merged):
+        acc = merged[bucket]
+        mean = acc["sum"] / acc["count"]
+        variance = max(acc["sum_sq"] / acc["count"] - mean * mean, 0)
+        series.append({
+            "time_bucket": bucket.strftime("%Y-%m-%d %H:%M"),
+            "avg_temp": mean,
+            "min_temp": acc["min"],
+            "max_temp": acc["max"],
+            "std_dev": math.sqrt(variance),
+            "reading_count": acc["count"]
+        })
+    return series
+
+
+def summarize_window(sensor_type, start, end=None, metric=None, sensor_id=None, resolution=60):
+    """Count and mean of one metric over [start, end) from a single rollup."""
+    metric = metric or primary_metric(sensor_type)
+    conditions = ["resolution = %(resolution)s", "sensor_type = %(sensor_type)s",
+                  "metric = %(metric)s", "bucket_start >= %(start)s"]
+    if end:
+        conditions.append("bucket_start < %(end)s")
+    if sensor_id:
+        conditions.append("sensor_id = %(sensor_id)s")
+
+    row = frappe.db.sql(f"""
+        SELECT SUM(reading_count) as cnt, SUM(value_sum) as total
+        FROM `tab{ROLLUP_DOCTYPE}`
+        WHERE {" AND ".join(conditions)}
+    """, {"resolution": resolution, "sensor_type": sensor_type, "metric": metric,
+          "start": start, "end": end, "sensor_id": sensor_id}, as_dict=True)[0]
+
+    count = int(row.cnt or 0)
+    return {"count": count, "mean": (float(row.total) / count) if count else None}
+
+
+def get_sensor_type_totals(sensor_ids=None):
+    """Lifetime count, last reading and mean per sensor type from the hourly
+    rollup, using each type's primary metric. sensor_ids narrows it to some
+    sensors (e.g. those of one device)."""
+    conditions = ["resolution = 60"]
+    if sensor_ids is not None:
+        if not sensor_ids:
+            return {}
+        conditions.append("sensor_id IN %(sensor_ids)s")
+    rows = frappe.db.sql(f"""
+        SELECT sensor_type, metric, SUM(reading_count) as reading_count,
+               SUM(value_sum) as value_sum, MAX(last_reading) as last_reading
+        FROM `tab{ROLLUP_DOCTYPE}`
+        WHERE {" AND ".join(conditions)}
+        GROUP BY sensor_type, metric
+        ORDER BY sensor_type
+    """, {"sensor_ids": tuple(sensor_ids or ())}, as_dict=True)
+
+    totals = {}
+    for r in rows:
+        if r.metric != primary_metric(r.sensor_type):
+            continue
+        count = int(r.reading_count or 0)
+        totals[r.sensor_type] = {
+            "count": count,
+            "last_reading": r.last_reading,
+            "avg_value": (float(r.value_sum) / count) if count else None
+        }
+    return totals
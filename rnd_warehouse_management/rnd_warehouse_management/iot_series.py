@@ -0,0 +1,159 @@
+"""Phase 6.16: IoT Series Queries
+Chart-ready series for any time range. get_sensor_series reads raw readings
+(live and archived), the 1-minute, 15-minute or 1-hour rollups, whichever
+is the finest that doesn't return far more points than asked for, then
+thins the result to max_points with Largest-Triangle-Three-Buckets (LTTB),
+which keeps peaks and dips a plain stride would skip. The reply is
+column arrays, not a list of dicts."""
+import frappe
+from frappe import _
+from frappe.utils import now_datetime, add_to_date, get_datetime
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+    ROLLUP_RESOLUTIONS, get_rollup_buckets, primary_metric, reading_time, row_metrics)
+
+
+DEFAULT_SERIES_POINTS = 1000
+MAX_SERIES_POINTS = 10000
+# A source is used when it returns at most this many times max_points
+SERIES_OVERSAMPLE = 4
+SERIES_VALUE_PRECISION = 4
+
+
+# ============================================================================
+# LTTB
+# ============================================================================
+
+def lttb(times, values, threshold):
+    """Indexes of the points Largest-Triangle-Three-Buckets keeps out of
+    (times, values), always including the first and the last."""
+    n = len(times)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    keep = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket is the triangle's third corner
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        span = next_end - next_start
+        avg_t = sum(times[next_start:next_end]) / span
+        avg_v = sum(values[next_start:next_end]) / span
+
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        ta, va = times[a], values[a]
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((ta - avg_t) * (values[j] - va) - (ta - times[j]) * (avg_v - va))
+            if area > best_area:
+                best, best_area = j, area
+        keep.append(best)
+        a = best
+    keep.append(n - 1)
+    return keep
+
+
+# ============================================================================
+# SOURCES
+# ============================================================================
+
+def resolve_series_sensor(sensor, sensor_type=None, by_sensor=None):
+    """(sensor_type, sensor_id) for a registered sensor_id or a sensor type.
+    An unregistered sensor is taken as a sensor_id only with a sensor_type."""
+    registered = (by_sensor or {}).get(sensor)
+    if registered:
+        return sensor_type or registered["sensor_type"], sensor
+    if sensor_type:
+        return sensor_type, sensor
+    return sensor, None
+
+
+def pick_series_source(span_seconds, max_points, interval_seconds=None):
+    """"raw" or a rollup resolution in minutes: the finest source expected
+    to return at most SERIES_OVERSAMPLE x max_points points. Raw needs
+    the sensor's sample interval."""
+    budget = max_points * SERIES_OVERSAMPLE
+    if interval_seconds and span_seconds / interval_seconds <= budget:
+        return "raw"
+    for resolution in sorted(ROLLUP_RESOLUTIONS):
+        if span_seconds / (resolution * 60) <= budget:
+            return resolution
+    return max(ROLLUP_RESOLUTIONS)
+
+
+def _raw_series(sensor_type, sensor_id, start, end, metric):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_archive import get_readings
+
+    points = []
+    for row in get_readings(sensor_type, start, end, sensor_id):
+        value = row_metrics(row).get(metric)
+        if value is not None:
+            points.append((reading_time(row).timestamp(), value))
+    points.sort()
+    return [t for t, _v in points], [v for _t, v in points], None
+
+
+def _rollup_series(sensor_type, sensor_id, start, end, metric, resolution):
+    times, values, envelope = [], [], {"min": [], "max": [], "count": []}
+    for r in get_rollup_buckets(sensor_type, metric, start, end, resolution, sensor_id):
+        count = int(r.reading_count or 0)
+        if not count:
+            continue
+        times.append(get_datetime(r.bucket_start).timestamp())
+        values.append(float(r.value_sum) / count)
+        envelope["min"].append(float(r.min_value))
+        envelope["max"].append(float(r.max_value))
+        envelope["count"].append(count)
+    return times, values, envelope
+
+
+# ============================================================================
+# API
+# ============================================================================
+
+@frappe.whitelist()
+def get_sensor_series(sensor, start=None, end=None, max_points=DEFAULT_SERIES_POINTS, metric=None,
+                      sensor_type=None):
+    """Series of a sensor_id (or a whole sensor type) over [start, end),
+    at most max_points long. Returns {"t": [epoch s], "v": [...]} plus
+    "min"/"max"/"count" per point when read from a rollup, where t is
+    the bucket start and v its mean."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_device_registry
+    from rnd_warehouse_management.rnd_warehouse_management.iot_uptime import get_expected_interval
+
+    end = get_datetime(end) if end else now_datetime()
+    start = get_datetime(start) if start else add_to_date(end, days=-7)
+    if start >= end:
+        frappe.throw(_("start must be before end"))
+    max_points = min(max(int(max_points or DEFAULT_SERIES_POINTS), 3), MAX_SERIES_POINTS)
+
+    by_sensor = get_device_registry()["by_sensor"]
+    sensor_type, sensor_id = resolve_series_sensor(sensor, sensor_type, by_sensor)
+    metric = metric or primary_metric(sensor_type)
+    # Raw rows of several sensors don't form one series; types use rollups
+    interval = get_expected_interval(sensor_type, sensor_id, by_sensor) if sensor_id else None
+    source = pick_series_source((end - start).total_seconds(), max_points, interval)
+
+    if source == "raw":
+        times, values, envelope = _raw_series(sensor_type, sensor_id, start, end, metric)
+    else:
+        times, values, envelope = _rollup_series(sensor_type, sensor_id, start, end, metric, source)
+
+    keep = lttb(times, values, max_points)
+    result = {
+        "sensor_type": sensor_type,
+        "sensor_id": sensor_id,
+        "metric": metric,
+        "source": source if source == "raw" else f"{source}m",
+        "points": len(times),
+        "returned": len(keep),
+        "t": [int(times[i]) for i in keep],
+        "v": [round(values[i], SERIES_VALUE_PRECISION) for i in keep],
+    }
+    if envelope:
+        for key, column in envelope.items():
+            result[key] = [column[i] for i in keep]
+    return result
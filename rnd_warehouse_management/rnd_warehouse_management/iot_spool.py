@@ -0,0 +1,275 @@
+"""Phase 6.10: IoT Ingest Spool
+Append-only write-ahead spool for validated readings, used while the
+database is slow. ingest_batch appends to it instead of inserting when the
+last insert took longer than the latency threshold (or hit a lock timeout);
+drain_spool replays it into IoT Sensor Reading in large ordered batches.
+
+Segments live under the site's private files (iot_spool/<time_ns>.wal) and
+hold length-prefixed, CRC32-checked JSON records:
+    record := length u32 | crc32 u32 | payload[length]
+    payload := {"received_at": str, "rpi_id": str|null, "rows": [...]}
+Appends take an flock on append.lock and write each record with one
+os.write. The drainer rotates the active segment first, so it only reads
+sealed segments, and stores its checkpoint (segment, offset) with
+frappe.db.set_global in the same transaction as the replayed rows: a crash
+at any point replays nothing twice and loses nothing that was fsynced.
+The spool is per host; run the scheduler on the host that serves ingest."""
+import frappe
+from frappe.utils import now_datetime, get_datetime
+import fcntl
+import json
+import os
+import struct
+import time
+import zlib
+from contextlib import contextmanager
+
+
+SPOOL_DIR = "iot_spool"
+SEGMENT_SUFFIX = ".wal"
+CHECKPOINT_KEY = "iot_spool_checkpoint"
+DB_SLOW_CACHE_KEY = "iot_spool|db_slow"
+
+DEFAULT_LATENCY_THRESHOLD_MS = 1500
+DEFAULT_COOLDOWN_SECONDS = 60
+DEFAULT_SEGMENT_BYTES = 16 * 1024 * 1024
+DRAIN_BATCH_ROWS = 5000
+DRAIN_MAX_SECONDS = 50
+
+_RECORD_HEADER = struct.Struct("<II")
+
+
+def _conf(key, default):
+    value = frappe.conf.get(key)
+    return default if value is None else value
+
+
+def spool_enabled():
+    return bool(_conf("iot_spool_enabled", 1))
+
+
+def get_latency_threshold():
+    """Seconds; site_config iot_spool_latency_ms."""
+    return float(_conf("iot_spool_latency_ms", DEFAULT_LATENCY_THRESHOLD_MS)) / 1000
+
+
+def get_spool_dir():
+    path = frappe.get_site_path("private", "files", SPOOL_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _segments(spool_dir):
+    """Segment file names in append order."""
+    return sorted(f for f in os.listdir(spool_dir) if f.endswith(SEGMENT_SUFFIX))
+
+
+@contextmanager
+def _flock(spool_dir, name, blocking=True):
+    """Exclusive lock on a lock file; yields False if non-blocking and busy."""
+    with open(os.path.join(spool_dir, name), "a") as handle:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+
+
+def _new_segment_name():
+    return f"{time.time_ns():020d}{SEGMENT_SUFFIX}"
+
+
+# ============================================================================
+# DB LATENCY - decide when ingest writes to the spool
+# ============================================================================
+
+def record_db_latency(seconds):
+    """Called by ingest after each claim + insert. A slow write flags the
+    database as slow for every worker for the cooldown period."""
+    if seconds > get_latency_threshold():
+        mark_db_slow(f"insert took {seconds:.2f}s")
+
+
+def mark_db_slow(reason=None):
+    cache = frappe.cache()
+    cooldown = int(_conf("iot_spool_cooldown_seconds", DEFAULT_COOLDOWN_SECONDS))
+    cache.set(cache.make_key(DB_SLOW_CACHE_KEY), reason or "slow", ex=cooldown)
+
+
+def is_db_slow():
+    cache = frappe.cache()
+    return bool(cache.get(cache.make_key(DB_SLOW_CACHE_KEY)))
+
+
+def has_pending():
+    """True while any segment holds records. Ingest keeps appending until
+    the drainer empties the spool, so readings reach the table in order."""
+    spool_dir = get_spool_dir()
+    return any(os.path.getsize(os.path.join(spool_dir, f)) for f in _segments(spool_dir))
+
+
+def should_spool():
+    return spool_enabled() and (is_db_slow() or has_pending())
+
+
+# ============================================================================
+# APPEND
+# ============================================================================
+
+def encode_record(payload):
+    data = json.dumps(payload, default=str, separators=(",", ":")).encode()
+    return _RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def append(rows, rpi_id=None):
+    """Append validated rows as one record. Returns the segment written."""
+    record = encode_record({"received_at": str(now_datetime()), "rpi_id": rpi_id, "rows": rows})
+    spool_dir = get_spool_dir()
+    max_bytes = int(_conf("iot_spool_segment_bytes", DEFAULT_SEGMENT_BYTES))
+    with _flock(spool_dir, "append.lock"):
+        segments = _segments(spool_dir)
+        segment = segments[-1] if segments else _new_segment_name()
+        path = os.path.join(spool_dir, segment)
+        if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            segment = _new_segment_name()
+            path = os.path.join(spool_dir, segment)
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o640)
+        try:
+            os.write(fd, record)
+            if _conf("iot_spool_fsync", 1):
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+    return segment
+
+
+# ============================================================================
+# READ / DRAIN
+# ============================================================================
+
+def read_records(path, offset=0):
+    """Yield (payload, end_offset) for each intact record from offset.
+    Stops at a torn tail or a checksum mismatch, reporting it once."""
+    with open(path, "rb") as f:
+        data = f.read()
+    pos = offset
+    while pos < len(data):
+        if pos + _RECORD_HEADER.size > len(data):
+            _report_corruption(path, pos, "torn record header")
+            return
+        length, crc = _RECORD_HEADER.unpack_from(data, pos)
+        start = pos + _RECORD_HEADER.size
+        body = data[start:start + length]
+        if len(body) < length:
+            _report_corruption(path, pos, "torn record body")
+            return
+        if zlib.crc32(body) != crc:
+            _report_corruption(path, pos, "checksum mismatch")
+            return
+        pos = start + length
+        yield json.loads(body), pos
+
+
+def _report_corruption(path, offset, reason):
+    frappe.log_error(f"{os.path.basename(path)} at byte {offset}: {reason}; rest of segment skipped",
+                     "IoT spool corruption")
+
+
+def get_checkpoint():
+    value = frappe.db.get_global(CHECKPOINT_KEY)
+    return json.loads(value) if value else {"segment": "", "offset": 0}
+
+
+def _rotate(spool_dir):
+    """Seal the active segment so the drainer never reads one being written.
+    Returns the sealed segment names."""
+    with _flock(spool_dir, "append.lock"):
+        segments = _segments(spool_dir)
+        if segments and os.path.getsize(os.path.join(spool_dir, segments[-1])):
+            open(os.path.join(spool_dir, _new_segment_name()), "a").close()
+        return [s for s in _segments(spool_dir)
+                if os.path.getsize(os.path.join(spool_dir, s))]
+
+
+def drain_spool(max_seconds=DRAIN_MAX_SECONDS, batch_rows=DRAIN_BATCH_ROWS):
+    """Scheduler job: replay sealed segments in order. Each batch commits
+    together with the checkpoint; drained segments are deleted."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import ingest_batch
+
+    spool_dir = get_spool_dir()
+    if not _segments(spool_dir):
+        return {"drained_rows": 0}
+
+    with _flock(spool_dir, "drain.lock", blocking=False) as locked:
+        if not locked:
+            return {"drained_rows": 0, "busy": True}
+
+        deadline = time.monotonic() + float(max_seconds)
+        checkpoint = get_checkpoint()
+        drained = 0
+        for segment in _rotate(spool_dir):
+            path = os.path.join(spool_dir, segment)
+            # Only the checkpointed segment can be partly drained; segments are
+            # deleted as soon as their last batch commits
+            offset = checkpoint["offset"] if segment == checkpoint["segment"] else 0
+
+            rows, received = [], []
+            end = offset
+            for payload, end in read_records(path, offset):
+                received_at = get_datetime(payload["received_at"])
+                rows.extend(payload["rows"])
+                received.extend([received_at] * len(payload["rows"]))
+                if len(rows) >= int(batch_rows):
+                    drained += _replay(ingest_batch, rows, received, segment, end)
+                    rows, received = [], []
+                    if time.monotonic() > deadline:
+                        return {"drained_rows": drained, "more": True}
+            drained += _replay(ingest_batch, rows, received, segment, end)
+
+            # Fully read (or the rest is corrupt): move on
+            _save_checkpoint(segment, os.path.getsize(path))
+            frappe.db.commit()
+            checkpoint = get_checkpoint()
+            os.unlink(path)
+            if time.monotonic() > deadline:
+                return {"drained_rows": drained, "more": bool(_segments(spool_dir))}
+
+        # Remove the empty active segment left by _rotate if nothing arrived
+        with _flock(spool_dir, "append.lock"):
+            for segment in _segments(spool_dir):
+                path = os.path.join(spool_dir, segment)
+                if not os.path.getsize(path):
+                    os.unlink(path)
+        return {"drained_rows": drained}
+
+
+def _save_checkpoint(segment, offset):
+    frappe.db.set_global(CHECKPOINT_KEY, json.dumps({"segment": segment, "offset": offset}))
+
+
+def _replay(ingest_batch, rows, received, segment, offset):
+    if not rows:
+        return 0
+    result = ingest_batch(rows, spool=False, received_at=received,
+                          before_commit=lambda: _save_checkpoint(segment, offset))
+    return result["accepted"]
+
+
+@frappe.whitelist()
+def get_spool_status():
+    """Pending segments and bytes on this host, checkpoint and DB state."""
+    spool_dir = get_spool_dir()
+    segments = [{"segment": s, "bytes": os.path.getsize(os.path.join(spool_dir, s))}
+                for s in _segments(spool_dir)]
+    return {
+        "enabled": spool_enabled(),
+        "db_slow": is_db_slow(),
+        "latency_threshold_ms": get_latency_threshold() * 1000,
+        "segments": segments,
+        "pending_bytes": sum(s["bytes"] for s in segments),
+        "checkpoint": get_checkpoint(),
+    }
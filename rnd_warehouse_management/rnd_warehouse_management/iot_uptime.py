@@ -0,0 +1,285 @@
+"""Phase 6.12: IoT Sensor Uptime
+Gap index built on ingest: whenever the time between two readings of a
+sensor exceeds GAP_TOLERANCE x its expected interval, the missed interval
+is stored as an IoT Sensor Gap. Readings that arrive late or out of order
+(spool drains, parallel flushes, RPi backlogs) and fall inside a recorded
+gap delete or split it, past the lateness horizon too. Uptime, gap lists and the longest outage
+over 7 or 30 days are computed by merging those intervals, never from
+raw readings."""
+import frappe
+from frappe.utils import now_datetime, add_to_date, get_datetime, time_diff_in_seconds
+from datetime import timedelta
+
+from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import reading_time
+
+
+GAP_DOCTYPE = "IoT Sensor Gap"
+DEFAULT_EXPECTED_INTERVAL_SECONDS = 60
+# A gap is recorded only when this many consecutive readings are missing,
+# so jitter and a single dropped sample don't count as an outage.
+GAP_TOLERANCE = 3
+GAP_RETENTION_DAYS = 90
+REPORT_WINDOWS_DAYS = (7, 30)
+MAX_GAPS_LISTED = 50
+
+_GAP_COLUMNS = ("name", "creation", "modified", "owner", "modified_by",
+                "sensor_type", "sensor_id", "expected_interval",
+                "gap_start", "gap_end", "duration_seconds")
+
+
+def get_expected_interval(sensor_type, sensor_id=None, by_sensor=None):
+    """Seconds between readings: the IoT Device Sensor row's
+    expected_interval, else the sensor type's sample_interval_seconds."""
+    from rnd_warehouse_management.rnd_warehouse_management.sensor_discovery import DEFAULT_SENSOR_REGISTRY
+
+    registered = (by_sensor or {}).get(sensor_id) or {}
+    if registered.get("expected_interval"):
+        return int(registered["expected_interval"])
+    entry = DEFAULT_SENSOR_REGISTRY.get(sensor_type) or {}
+    return int(entry.get("sample_interval_seconds") or DEFAULT_EXPECTED_INTERVAL_SECONDS)
+
+
+# ============================================================================
+# GAP INDEX - updated on ingest
+# ============================================================================
+
+def find_gaps(previous, timestamps, interval):
+    """Gaps between the previous last_seen and a sensor's new reading times.
+    Each gap runs from when the first missed reading was due to the reading
+    that ended it. Readings older than the last one seen are ignored.
+    Returns (gaps, new_last_seen)."""
+    gaps = []
+    last = previous
+    threshold = GAP_TOLERANCE * interval
+    for ts in sorted(timestamps):
+        if last is not None and ts > last and (ts - last).total_seconds() > threshold:
+            gaps.append((last + timedelta(seconds=interval), ts))
+        if last is None or ts > last:
+            last = ts
+    return gaps, last
+
+
+def split_gap(gap_start, gap_end, timestamps, interval):
+    """What is left of a recorded gap once readings inside it arrive: the
+    gaps find_gaps sees between its bounding readings with the new ones in
+    between. [] when they fill it."""
+    previous = gap_start - timedelta(seconds=interval)
+    inside = [ts for ts in timestamps if gap_start <= ts < gap_end]
+    return find_gaps(previous, inside + [gap_end], interval)[0]
+
+
+def _times_by_sensor(rows):
+    times = {}
+    for row in rows:
+        if row.get("sensor_type") and row.get("sensor_id"):
+            key = (row["sensor_type"], row["sensor_id"])
+            times.setdefault(key, []).append(reading_time(row))
+    return times
+
+
+def _gap_values(sensor_type, sensor_id, interval, gaps):
+    now = now_datetime()
+    user = frappe.session.user
+    return [(frappe.generate_hash(length=10), now, now, user, user,
+             sensor_type, sensor_id, interval, start, end, time_diff_in_seconds(end, start))
+            for start, end in gaps]
+
+
+def close_gaps(rows):
+    """Delete or split the recorded gaps that ingested rows fall inside.
+    Runs on every ingested row, including those past the lateness horizon,
+    and before update_gap_index."""
+    times = _times_by_sensor(rows)
+    if not times:
+        return []
+
+    earliest = min(min(ts) for ts in times.values())
+    latest = max(max(ts) for ts in times.values())
+    gaps = frappe.db.sql(f"""
+        SELECT name, sensor_type, sensor_id, expected_interval, gap_start, gap_end
+        FROM `tab{GAP_DOCTYPE}`
+        WHERE sensor_id IN %(sensor_ids)s AND gap_end > %(earliest)s AND gap_start <= %(latest)s
+    """, {"sensor_ids": tuple({sensor_id for _type, sensor_id in times}),
+          "earliest": earliest, "latest": latest}, as_dict=True)
+
+    closed = []
+    values = []
+    for gap in gaps:
+        gap_start, gap_end = get_datetime(gap.gap_start), get_datetime(gap.gap_end)
+        inside = [ts for ts in times.get((gap.sensor_type, gap.sensor_id), ()) if gap_start <= ts < gap_end]
+        if not inside:
+            continue
+        interval = int(gap.expected_interval or DEFAULT_EXPECTED_INTERVAL_SECONDS)
+        closed.append(gap.name)
+        values.extend(_gap_values(gap.sensor_type, gap.sensor_id, interval,
+                                  split_gap(gap_start, gap_end, inside, interval)))
+    if closed:
+        frappe.db.delete(GAP_DOCTYPE, {"name": ["in", closed]})
+    if values:
+        frappe.db.bulk_insert(GAP_DOCTYPE, _GAP_COLUMNS, values)
+    return values
+
+
+def update_gap_index(rows):
+    """Record the gaps closed by ingested rows. Must run before
+    update_health_snapshot, whose last_seen is the previous reading time."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        HEALTH_SNAPSHOT_DOCTYPE, snapshot_name, get_device_registry)
+
+    times = _times_by_sensor(rows)
+    if not times:
+        return []
+
+    names = {snapshot_name(*key): key for key in times}
+    previous = {names[r.name]: r.last_seen for r in frappe.db.sql(f"""
+        SELECT name, last_seen FROM `tab{HEALTH_SNAPSHOT_DOCTYPE}` WHERE name IN %s
+    """, (tuple(names),), as_dict=True)}
+
+    by_sensor = get_device_registry()["by_sensor"]
+    values = []
+    for (sensor_type, sensor_id), timestamps in times.items():
+        interval = get_expected_interval(sensor_type, sensor_id, by_sensor)
+        gaps, _last = find_gaps(previous.get((sensor_type, sensor_id)), timestamps, interval)
+        values.extend(_gap_values(sensor_type, sensor_id, interval, gaps))
+    if values:
+        frappe.db.bulk_insert(GAP_DOCTYPE, _GAP_COLUMNS, values)
+    return values
+
+
+def purge_old_gaps():
+    """Scheduler job (daily): drop gaps that ended before the retention."""
+    frappe.db.delete(GAP_DOCTYPE, {"gap_end": ["<", add_to_date(now_datetime(), days=-GAP_RETENTION_DAYS)]})
+    frappe.db.commit()
+
+
+# ============================================================================
+# UPTIME - interval merging over a window
+# ============================================================================
+
+def merge_intervals(intervals):
+    """Union of (start, end) intervals, sorted and non-overlapping."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(i) for i in merged]
+
+
+def compute_uptime(gaps, window_start, window_end, first_seen, last_seen, interval):
+    """Uptime of one sensor over [window_start, window_end]. Time before the
+    sensor's first reading isn't counted; an outage still in progress is."""
+    if not first_seen:
+        return {"observed_seconds": 0, "downtime_seconds": 0, "uptime_pct": None,
+                "gap_count": 0, "longest_outage_seconds": 0, "longest_outage": None, "gaps": []}
+
+    start = max(window_start, get_datetime(first_seen))
+    intervals = list(gaps)
+    last_seen = get_datetime(last_seen)
+    if (window_end - last_seen).total_seconds() > GAP_TOLERANCE * interval:
+        intervals.append((last_seen + timedelta(seconds=interval), window_end))
+
+    clipped = [(max(s, start), min(e, window_end)) for s, e in intervals]
+    merged = merge_intervals([(s, e) for s, e in clipped if e > s])
+    observed = max((window_end - start).total_seconds(), 0)
+    downtime = sum((e - s).total_seconds() for s, e in merged)
+    longest = max(merged, key=lambda i: i[1] - i[0], default=None)
+    return {
+        "observed_seconds": observed,
+        "downtime_seconds": downtime,
+        "uptime_pct": round(100 * (1 - downtime / observed), 3) if observed else None,
+        "gap_count": len(merged),
+        "longest_outage_seconds": (longest[1] - longest[0]).total_seconds() if longest else 0,
+        "longest_outage": {"start": str(longest[0]), "end": str(longest[1])} if longest else None,
+        "gaps": [{"start": str(s), "end": str(e), "seconds": (e - s).total_seconds()}
+                 for s, e in merged[-MAX_GAPS_LISTED:]],
+    }
+
+
+def _load_gaps(window_start, sensor_type=None, sensor_ids=None):
+    conditions = ["gap_end >= %(start)s"]
+    if sensor_type:
+        conditions.append("sensor_type = %(sensor_type)s")
+    if sensor_ids is not None:
+        conditions.append("sensor_id IN %(sensor_ids)s")
+    rows = frappe.db.sql(f"""
+        SELECT sensor_type, sensor_id, gap_start, gap_end
+        FROM `tab{GAP_DOCTYPE}`
+        WHERE {' AND '.join(conditions)}
+    """, {"start": window_start, "sensor_type": sensor_type, "sensor_ids": tuple(sensor_ids or ())},
+        as_dict=True)
+    gaps = {}
+    for r in rows:
+        gaps.setdefault((r.sensor_type, r.sensor_id), []).append(
+            (get_datetime(r.gap_start), get_datetime(r.gap_end)))
+    return gaps
+
+
+def _uptime_by_sensor(windows, sensor_type=None, sensor_id=None, rpi_id=None):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        resolve_sensor_filter, get_health_snapshots, get_device_registry)
+
+    sensor_ids = resolve_sensor_filter(sensor_id, rpi_id)
+    if sensor_ids == []:
+        return []
+    now = now_datetime()
+    starts = {days: add_to_date(now, days=-days) for days in windows}
+    gaps = _load_gaps(min(starts.values()), sensor_type, sensor_ids)
+    by_sensor = get_device_registry()["by_sensor"]
+
+    sensors = []
+    for snap in get_health_snapshots(sensor_type, sensor_ids):
+        if not snap.sensor_id:
+            continue
+        interval = get_expected_interval(snap.sensor_type, snap.sensor_id, by_sensor)
+        entry = {"sensor_type": snap.sensor_type, "sensor_id": snap.sensor_id,
+                 "expected_interval": interval, "last_seen": str(snap.last_seen) if snap.last_seen else None}
+        for days, start in starts.items():
+            entry[days] = compute_uptime(gaps.get((snap.sensor_type, snap.sensor_id), []),
+                                         start, now, snap.first_seen, snap.last_seen, interval)
+        sensors.append(entry)
+    return sensors
+
+
+@frappe.whitelist()
+def get_sensor_uptime(sensor_type=None, sensor_id=None, rpi_id=None, days=7):
+    """Uptime %, merged gap intervals and longest outage per sensor over the
+    last `days`, for a sensor type, one sensor_id or an rpi_id's sensors."""
+    days = int(days)
+    sensors = _uptime_by_sensor([days], sensor_type, sensor_id, rpi_id)
+    for entry in sensors:
+        entry.update(entry.pop(days))
+    return {"days": days, "sensors": sensors, "summary": _summarize(sensors)}
+
+
+@frappe.whitelist()
+def get_uptime_report(sensor_type=None, rpi_id=None):
+    """Maintenance SLA view: 7 and 30 day uptime and longest outage per
+    sensor, without gap lists."""
+    rows = []
+    for entry in _uptime_by_sensor(REPORT_WINDOWS_DAYS, sensor_type, rpi_id=rpi_id):
+        row = {k: entry[k] for k in ("sensor_type", "sensor_id", "expected_interval", "last_seen")}
+        for days in REPORT_WINDOWS_DAYS:
+            window = entry[days]
+            row[f"uptime_{days}d"] = window["uptime_pct"]
+            row[f"gaps_{days}d"] = window["gap_count"]
+            row[f"longest_outage_{days}d"] = window["longest_outage_seconds"]
+        rows.append(row)
+    rows.sort(key=lambda r: (r[f"uptime_{REPORT_WINDOWS_DAYS[-1]}d"] is None,
+                             r[f"uptime_{REPORT_WINDOWS_DAYS[-1]}d"] or 0))
+    return rows
+
+
+def _summarize(sensors):
+    measured = [s for s in sensors if s["uptime_pct"] is not None]
+    if not measured:
+        return {"sensors": len(sensors)}
+    worst = min(measured, key=lambda s: s["uptime_pct"])
+    return {
+        "sensors": len(sensors),
+        "avg_uptime_pct": round(sum(s["uptime_pct"] for s in measured) / len(measured), 3),
+        "worst_sensor": worst["sensor_id"],
+        "worst_uptime_pct": worst["uptime_pct"],
+        "longest_outage_seconds": max(s["longest_outage_seconds"] for s in measured),
+    }
@@ -98,16 +98,27 @@ def get_zone_sensors_for_work_order(work_order_name):
     if not frappe.db.exists("DocType", "IoT Sensor Reading"):
         return result
 
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        get_sensor_ids, get_recent_readings)
+
+    # Sensors registered (IoT Device) in the Work Order's warehouse. Without
+    # a registration for it, fall back to every sensor.
+    sensor_ids = get_sensor_ids(warehouse=zone) if zone else None
+    result["zone_filtered"] = bool(sensor_ids)
+
     # Get latest readings from sensors in this zone (last 30 min)
-    cutoff = add_to_date(now_datetime(), minutes=-30)
-    readings = frappe.db.sql("""
-        SELECT sensor_type, sensor_id, temperature, humidity,
-               creation as reading_time
-        FROM `tabIoT Sensor Reading`
-        WHERE creation >= %s
-        ORDER BY creation DESC
-        LIMIT 50
-    """, (cutoff,), as_dict=True)
+    if sensor_ids:
+        readings = get_recent_readings(warehouse=zone, minutes=30, limit=50)
+    else:
+        cutoff = add_to_date(now_datetime(), minutes=-30)
+        readings = frappe.db.sql("""
+            SELECT sensor_type, sensor_id, temperature, humidity,
+                   device_time as reading_time
+            FROM `tabIoT Sensor Reading`
+            WHERE device_time >= %(cutoff)s
+            ORDER BY device_time DESC
+            LIMIT 50
+        """, {"cutoff": cutoff}, as_dict=True)
 
     result["sensors"] = readings
     result["sensor_count"] = len(readings)
@@ -3,8 +3,14 @@ ERPNext-side integration for Allen Bradley PLC sensors.
 Register mapping, calibration, alarm forwarding, combined dashboard."""
 import frappe
 from frappe import _
-from frappe.utils import now_datetime, add_to_date
+from frappe.utils import now_datetime, add_to_date, get_datetime
 import json
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 # ============================================================================
@@ -74,6 +80,9 @@ DEFAULT_PLC_CONFIG = {
     "port": 502,
     "timeout": 5,
     "poll_interval_seconds": 10,
+    "min_poll_interval_seconds": 1,
+    "max_poll_interval_seconds": 300,
+    "adaptive_polling": True,
     "retry_count": 3,
     "retry_delay": 2
 }
@@ -109,10 +118,21 @@ def get_plc_register_map():
     return DEFAULT_PLC_REGISTER_MAP
 
 
+def _plc_connection_config():
+    """DEFAULT_PLC_CONFIG, then site_config "plc_config"."""
+    config = dict(DEFAULT_PLC_CONFIG)
+    config.update(frappe.conf.get("plc_config") or {})
+    return config
+
+
 @frappe.whitelist()
 def get_plc_config():
-    """Return PLC connection configuration."""
-    return DEFAULT_PLC_CONFIG
+    """Return PLC connection configuration, with the per-register poll
+    schedule plc_reader follows (see ADAPTIVE POLLING)."""
+    config = _plc_connection_config()
+    config["register_schedule"] = get_register_schedule(config)
+    config["schedule_refresh_seconds"] = POLL_SCHEDULE_CACHE_SECONDS
+    return config
 
 
 @frappe.whitelist()
@@ -129,10 +149,7 @@ def convert_raw_to_engineering(sensor_type, raw_value):
         return {"error": f"Unknown PLC sensor type: {sensor_type}"}
 
     reg = DEFAULT_PLC_REGISTER_MAP[sensor_type]
-    eng_value = (raw_value * reg["scale_factor"]) + reg["offset"]
-
-    # Clamp to engineering range
-    eng_value = max(reg["min_eng"], min(reg["max_eng"], eng_value))
+    eng_value = _to_engineering(reg, raw_value)
 
     return {
         "sensor_type": sensor_type,
@@ -143,6 +160,20 @@ def convert_raw_to_engineering(sensor_type, raw_value):
     }
 
 
+def _to_engineering(reg, raw_value):
+    """Scale a raw register value and clamp it to the engineering range."""
+    eng_value = (raw_value * reg["scale_factor"]) + reg["offset"]
+    return max(reg["min_eng"], min(reg["max_eng"], eng_value))
+
+
+def _alarm_level(alarm, value):
+    if value <= alarm["critical_low"] or value >= alarm["critical_high"]:
+        return "critical"
+    if value <= alarm["warning_low"] or value >= alarm["warning_high"]:
+        return "warning"
+    return "normal"
+
+
 @frappe.whitelist()
 def check_plc_alarm(sensor_type, value):
     """Check if a PLC reading triggers warning or critical alarm."""
@@ -152,15 +183,8 @@ def check_plc_alarm(sensor_type, value):
 
     alarm = DEFAULT_PLC_ALARMS[sensor_type]
 
-    if value <= alarm["critical_low"] or value >= alarm["critical_high"]:
-        level = "critical"
-    elif value <= alarm["warning_low"] or value >= alarm["warning_high"]:
-        level = "warning"
-    else:
-        level = "normal"
-
     return {
-        "alarm_level": level,
+        "alarm_level": _alarm_level(alarm, value),
         "sensor_type": sensor_type,
         "value": value,
         "thresholds": alarm
@@ -197,38 +221,34 @@ def get_plc_sensor_types():
 
 
 @frappe.whitelist()
-def get_combined_dashboard():
-    """Get combined dashboard showing both Arduino and PLC sensors."""
+def get_combined_dashboard(rpi_id=None, warehouse=None):
+    """Get combined dashboard showing both Arduino and PLC sensors,
+    optionally only for the sensors registered on one device or warehouse."""
     if not frappe.db.exists("DocType", "IoT Sensor Reading"):
         return {"error": "IoT Sensor Reading doctype not found"}
 
-    # Get all sensor types with their counts
-    sensor_data = frappe.db.sql("""
-        SELECT sensor_type, COUNT(*) as count,
-               MAX(creation) as last_reading,
-               AVG(temperature) as avg_value
-        FROM `tabIoT Sensor Reading`
-        WHERE sensor_type IS NOT NULL
-        GROUP BY sensor_type
-        ORDER BY sensor_type
-    """, as_dict=True)
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import get_sensor_type_totals
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_sensor_ids
+
+    # Per-type counts, last reading and mean from the hourly rollup
+    totals = get_sensor_type_totals(get_sensor_ids(rpi_id=rpi_id, warehouse=warehouse))
 
     arduino_sensors = []
     plc_sensors = []
 
-    for s in sensor_data:
+    for sensor_type, t in totals.items():
         entry = {
-            "sensor_type": s.sensor_type,
-            "reading_count": s.count,
-            "last_reading": str(s.last_reading) if s.last_reading else None,
-            "avg_value": round(float(s.avg_value), 2) if s.avg_value else None
+            "sensor_type": sensor_type,
+            "reading_count": t["count"],
+            "last_reading": str(t["last_reading"]) if t["last_reading"] else None,
+            "avg_value": round(float(t["avg_value"]), 2) if t["avg_value"] else None
         }
-        if s.sensor_type and s.sensor_type.startswith("PLC_"):
+        if sensor_type.startswith("PLC_"):
             plc_sensors.append(entry)
         else:
             arduino_sensors.append(entry)
 
-    total = frappe.db.count("IoT Sensor Reading")
+    total = sum(t["count"] for t in totals.values())
 
     return {
         "total_readings": total,
@@ -273,3 +293,265 @@ def validate_plc_connection_config(ip_address, port=502, protocol="ModbusTCP"):
         "protocol": protocol,
         "errors": errors
     }
+
+
+# ============================================================================
+# FRAME CONVERSION - a whole register frame per call
+# ============================================================================
+
+# plc_reader posts every register of a poll (or of many polls) at once:
+# frame maps register address or sensor type to one raw value or to a list
+# with one raw value per timestamp. All values are scaled, clamped and
+# classified as arrays, one register per row. Level codes index
+# PLC_ALARM_LEVELS; missing or non-numeric raw values give None.
+PLC_ALARM_LEVELS = ("normal", "warning", "critical")
+
+
+def _frame_columns(frame):
+    """({sensor_type: [raw, ...]} in register map order, unknown keys, n)."""
+    by_address = {reg["register_address"]: sensor_type
+                  for sensor_type, reg in DEFAULT_PLC_REGISTER_MAP.items()}
+    columns, unknown = {}, []
+    for key, raw in frame.items():
+        sensor_type = key if key in DEFAULT_PLC_REGISTER_MAP else by_address.get(key)
+        if sensor_type is None:
+            unknown.append(key)
+            continue
+        columns[sensor_type] = raw if isinstance(raw, (list, tuple)) else [raw]
+    lengths = {len(raw) for raw in columns.values()}
+    if len(lengths) > 1:
+        frappe.throw(_("Every register of a frame needs the same number of values"))
+    ordered = {t: columns[t] for t in DEFAULT_PLC_REGISTER_MAP if t in columns}
+    return ordered, unknown, lengths.pop() if lengths else 0
+
+
+def _raw_float(value):
+    try:
+        value = float(value)
+    except (ValueError, TypeError):
+        return float("nan")
+    return value
+
+
+def _convert_frame_arrays(columns, n):
+    """NumPy path: (values, levels, clamped) per sensor type."""
+    types = list(columns)
+    raw = np.empty((len(types), n))
+    for i, sensor_type in enumerate(types):
+        try:
+            raw[i] = np.asarray(columns[sensor_type], dtype=float)
+        except (ValueError, TypeError):
+            raw[i] = [_raw_float(v) for v in columns[sensor_type]]
+
+    def register_param(key):
+        return np.array([[float(DEFAULT_PLC_REGISTER_MAP[t][key])] for t in types])
+
+    def alarm_param(key):
+        return np.array([[float((DEFAULT_PLC_ALARMS.get(t) or {}).get(key, np.nan))] for t in types])
+
+    scaled = raw * register_param("scale_factor") + register_param("offset")
+    eng = np.clip(scaled, register_param("min_eng"), register_param("max_eng"))
+    missing = np.isnan(raw)
+    clamped = ((eng != scaled) & ~missing).sum(axis=1)
+    eng = np.round(eng, 3)
+
+    # Comparisons with NaN (no thresholds) are False, so those stay normal
+    with np.errstate(invalid="ignore"):
+        critical = (eng <= alarm_param("critical_low")) | (eng >= alarm_param("critical_high"))
+        warning = (eng <= alarm_param("warning_low")) | (eng >= alarm_param("warning_high"))
+    levels = np.where(critical, 2, np.where(warning, 1, 0))
+
+    values, codes = {}, {}
+    for i, sensor_type in enumerate(types):
+        values[sensor_type] = [None if m else v for v, m in zip(eng[i].tolist(), missing[i].tolist())]
+        codes[sensor_type] = [None if m else c for c, m in zip(levels[i].tolist(), missing[i].tolist())]
+    return values, codes, {t: int(c) for t, c in zip(types, clamped.tolist())}
+
+
+def _convert_frame_loop(columns):
+    """Fallback without NumPy, with the single-value helpers."""
+    values, codes, clamped = {}, {}, {}
+    for sensor_type, raws in columns.items():
+        reg = DEFAULT_PLC_REGISTER_MAP[sensor_type]
+        alarm = DEFAULT_PLC_ALARMS.get(sensor_type)
+        values[sensor_type], codes[sensor_type], clamped[sensor_type] = [], [], 0
+        for raw in raws:
+            raw = _raw_float(raw)
+            if raw != raw:
+                values[sensor_type].append(None)
+                codes[sensor_type].append(None)
+                continue
+            eng = _to_engineering(reg, raw)
+            clamped[sensor_type] += int(eng != raw * reg["scale_factor"] + reg["offset"])
+            eng = round(eng, 3)
+            values[sensor_type].append(eng)
+            codes[sensor_type].append(PLC_ALARM_LEVELS.index(_alarm_level(alarm, eng)) if alarm else 0)
+    return values, codes, clamped
+
+
+@frappe.whitelist()
+def convert_plc_frame(frame, timestamps=None):
+    """Convert and classify a whole register frame in one call.
+    frame: {register_address or sensor_type: raw value or [raw, ...]};
+    timestamps: optional, one per value. Returns engineering values and
+    level codes per sensor type, plus the non-normal values as alarms."""
+    if isinstance(frame, str):
+        frame = json.loads(frame)
+    if isinstance(timestamps, str):
+        timestamps = json.loads(timestamps)
+
+    columns, unknown, n = _frame_columns(frame or {})
+    if timestamps is not None and columns and len(timestamps) != n:
+        frappe.throw(_("Got {0} timestamps for {1} values per register").format(len(timestamps), n))
+
+    if np is not None and columns:
+        values, codes, clamped = _convert_frame_arrays(columns, n)
+    else:
+        values, codes, clamped = _convert_frame_loop(columns)
+
+    alarms = []
+    for sensor_type, levels in codes.items():
+        for index, code in enumerate(levels):
+            if code:
+                alarms.append({
+                    "sensor_type": sensor_type,
+                    "index": index,
+                    "timestamp": timestamps[index] if timestamps else None,
+                    "value": values[sensor_type][index],
+                    "alarm_level": PLC_ALARM_LEVELS[code],
+                })
+
+    return {
+        "count": n,
+        "timestamps": timestamps,
+        "units": {t: DEFAULT_PLC_REGISTER_MAP[t]["unit"] for t in columns},
+        "values": values,
+        "levels": codes,
+        "level_names": PLC_ALARM_LEVELS,
+        "clamped": clamped,
+        "alarms": alarms,
+        "unknown_registers": unknown,
+    }
+
+
+# ============================================================================
+# ADAPTIVE POLLING - per-register poll intervals from the 1-minute rollups
+# ============================================================================
+
+# A register is polled often enough that the value is not expected to move
+# more than its deadband between two polls. The expected move combines the
+# trend (95th percentile of |change| between consecutive minute means) and
+# the noise inside a minute. Overrides: site_config "plc_poll_overrides"
+# {sensor_type: seconds}; bounds: min/max_poll_interval_seconds.
+POLL_HISTORY_HOURS = 24
+POLL_MIN_BUCKETS = 30
+POLL_RATE_PERCENTILE = 0.95
+# Default deadband: this share of the register's engineering span, and never
+# below one raw count (scale_factor)
+POLL_DEADBAND_FRACTION = 0.0025
+POLL_INTERVAL_STEPS = (1, 2, 5, 10, 15, 30, 60, 120, 300, 600)
+POLL_SCHEDULE_CACHE_KEY = "plc_poll_schedule"
+POLL_SCHEDULE_CACHE_SECONDS = 900
+
+
+def get_register_deadband(sensor_type):
+    reg = DEFAULT_PLC_REGISTER_MAP[sensor_type]
+    if reg.get("poll_deadband"):
+        return float(reg["poll_deadband"])
+    span = reg["max_eng"] - reg["min_eng"]
+    return max(span * POLL_DEADBAND_FRACTION, reg["scale_factor"])
+
+
+def _percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def recommend_poll_interval(buckets, deadband, min_seconds, max_seconds):
+    """Poll interval (seconds) for one register from its 1-minute rollup
+    buckets (bucket_start, reading_count, value_sum, value_sum_sq), oldest
+    first. Returns (seconds, stats), or (None, stats) without enough history."""
+    points = []
+    noise = []
+    for b in buckets:
+        count = int(b["reading_count"] or 0)
+        if not count:
+            continue
+        mean = float(b["value_sum"]) / count
+        points.append((get_datetime(b["bucket_start"]), mean))
+        if count > 1:
+            variance = max(float(b["value_sum_sq"]) / count - mean * mean, 0)
+            noise.append(math.sqrt(variance))
+    stats = {"buckets": len(points), "deadband": deadband}
+    if len(points) < POLL_MIN_BUCKETS:
+        return None, stats
+
+    rates = [abs(b_mean - a_mean) / (b_t - a_t).total_seconds()
+             for (a_t, a_mean), (b_t, b_mean) in zip(points, points[1:])]
+    rate = _percentile(rates, POLL_RATE_PERCENTILE)
+    sigma = _percentile(noise, 0.5) if noise else 0.0
+    # Noise is spread over the minute it was measured in
+    expected_rate = max(rate, sigma / 60)
+    stats.update(rate_per_second=round(rate, 6), noise=round(sigma, 4))
+
+    seconds = deadband / expected_rate if expected_rate else max_seconds
+    seconds = min(max(seconds, min_seconds), max_seconds)
+    steps = [step for step in POLL_INTERVAL_STEPS if min_seconds <= step <= seconds]
+    return (steps[-1] if steps else int(min_seconds)), stats
+
+
+def compute_register_schedule(config=None):
+    """{sensor_type: {register_address, poll_interval_seconds, source, ...}}
+    for every PLC register, from the last POLL_HISTORY_HOURS of rollups."""
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import (
+        get_rollup_buckets, primary_metric)
+
+    config = config or DEFAULT_PLC_CONFIG
+    default = int(config["poll_interval_seconds"])
+    low = int(config.get("min_poll_interval_seconds") or 1)
+    high = int(config.get("max_poll_interval_seconds") or default)
+    overrides = frappe.conf.get("plc_poll_overrides") or {}
+    start = add_to_date(now_datetime(), hours=-POLL_HISTORY_HOURS)
+
+    schedule = {}
+    for sensor_type, reg in DEFAULT_PLC_REGISTER_MAP.items():
+        entry = {"register_address": reg["register_address"], "poll_interval_seconds": default,
+                 "source": "default"}
+        if sensor_type in overrides:
+            entry.update(poll_interval_seconds=int(overrides[sensor_type]), source="override")
+        elif config.get("adaptive_polling"):
+            buckets = get_rollup_buckets(sensor_type, primary_metric(sensor_type), start, resolution=1)
+            seconds, stats = recommend_poll_interval(buckets, get_register_deadband(sensor_type), low, high)
+            entry.update(stats)
+            if seconds:
+                entry.update(poll_interval_seconds=seconds, source="adaptive")
+        schedule[sensor_type] = entry
+    return schedule
+
+
+def get_register_schedule(config=None, refresh=False):
+    """Cached compute_register_schedule; recomputed every
+    POLL_SCHEDULE_CACHE_SECONDS."""
+    cache = frappe.cache()
+    schedule = None if refresh else cache.get_value(POLL_SCHEDULE_CACHE_KEY)
+    if schedule is None:
+        schedule = compute_register_schedule(config)
+        cache.set_value(POLL_SCHEDULE_CACHE_KEY, schedule, expires_in_sec=POLL_SCHEDULE_CACHE_SECONDS)
+    return schedule
+
+
+@frappe.whitelist()
+def get_plc_poll_schedule(refresh=0):
+    """Per-register poll schedule with the stats behind each interval and
+    the reduction in polls against the fixed interval."""
+    config = _plc_connection_config()
+    schedule = get_register_schedule(config, refresh=bool(int(refresh or 0)))
+    fixed = len(schedule) / config["poll_interval_seconds"]
+    adaptive = sum(1 / e["poll_interval_seconds"] for e in schedule.values())
+    return {
+        "poll_interval_seconds": config["poll_interval_seconds"],
+        "register_schedule": schedule,
+        "polls_per_hour": round(adaptive * 3600),
+        "fixed_polls_per_hour": round(fixed * 3600),
+        "reduction_pct": round(100 * (1 - adaptive / fixed), 1) if fixed else None,
+    }
@@ -21,6 +21,10 @@ DEFAULT_SENSOR_REGISTRY = {
         "min_value": -40.0,
         "max_value": 150.0,
         "calibration_method": "steinhart_hart",
+        "drift_cusum_k": 0.75,
+        "drift_cusum_h": 10.0,
+        "sample_interval_seconds": 10,
+        "compression_deviation": 0.25,
         "fields": ["temperature", "resistance", "raw_adc", "millivolts"],
         "arduino_sketch": "ford_ntc_reader",
         "description": "Ford NTC thermistor (216+1S7Z6G004AA) with 10K pull-up"
@@ -32,6 +36,10 @@ DEFAULT_SENSOR_REGISTRY = {
         "min_value": 0.0,
         "max_value": 50.0,
         "calibration_method": "linear",
+        "drift_cusum_k": 1.0,
+        "drift_cusum_h": 10.0,
+        "sample_interval_seconds": 30,
+        "compression_deviation": {"temperature": 1.0, "humidity": 1.0},
         "fields": ["temperature", "humidity"],
         "gpio_pin": 4,
         "description": "DHT11 digital temperature and humidity sensor"
@@ -43,6 +51,10 @@ DEFAULT_SENSOR_REGISTRY = {
         "min_value": -40.0,
         "max_value": 80.0,
         "calibration_method": "linear",
+        "drift_cusum_k": 0.5,
+        "drift_cusum_h": 10.0,
+        "sample_interval_seconds": 30,
+        "compression_deviation": {"temperature": 0.2, "humidity": 0.5},
         "fields": ["temperature", "humidity"],
         "gpio_pin": 4,
         "description": "DHT22/AM2302 precision temperature and humidity sensor"
@@ -54,6 +66,10 @@ DEFAULT_SENSOR_REGISTRY = {
         "min_value": -55.0,
         "max_value": 125.0,
         "calibration_method": "factory",
+        "drift_cusum_k": 0.5,
+        "drift_cusum_h": 8.0,
+        "sample_interval_seconds": 15,
+        "compression_deviation": 0.1,
         "fields": ["temperature"],
         "protocol": "1-wire",
         "description": "DS18B20 waterproof 1-Wire digital temperature sensor"
@@ -65,6 +81,10 @@ DEFAULT_SENSOR_REGISTRY = {
         "min_value": -40.0,
         "max_value": 85.0,
         "calibration_method": "factory",
+        "drift_cusum_k": 0.5,
+        "drift_cusum_h": 10.0,
+        "sample_interval_seconds": 30,
+        "compression_deviation": {"temperature": 0.1, "humidity": 0.5},
         "fields": ["temperature", "humidity", "pressure"],
         "protocol": "i2c",
         "i2c_address": "0x76",
@@ -77,6 +97,10 @@ DEFAULT_SENSOR_REGISTRY = {
         "min_value": 0.0,
         "max_value": 5.0,
         "calibration_method": "linear",
+        "drift_cusum_k": 0.75,
+        "drift_cusum_h": 10.0,
+        "sample_interval_seconds": 10,
+        "compression_deviation": 0.02,
         "fields": ["raw_adc", "voltage"],
         "description": "Generic analog sensor via ADC"
     }
@@ -0,0 +1,84 @@
+"""Phase 6.11 Test Plan: IoT Quantile Sketches
+Tests t-digest accuracy and merging, MAD, robust outlier checks and the quantile API."""
+import frappe
+import random
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_sketch_quantiles_accurate,
+        test_sketch_merge_bounded,
+        test_sketch_mad,
+        test_robust_outlier_ignores_spikes,
+        test_get_sensor_quantiles,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.11 Results: {passed}/{len(results)} passed ===")
+    return results
+
+def _spiky_readings(n=5000, seed=7):
+    """Thermistor-like readings around 20 C with 1% spikes to 120 C."""
+    rng = random.Random(seed)
+    return [120.0 if rng.random() < 0.01 else rng.gauss(20, 0.5) for _ in range(n)]
+
+def test_sketch_quantiles_accurate():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import new_sketch, sketch_add, sketch_quantile
+    data = _spiky_readings()
+    sketch = new_sketch()
+    for i in range(0, len(data), 100):
+        sketch_add(sketch, data[i:i + 100])
+    ordered = sorted(data)
+    for q in (0.05, 0.25, 0.5, 0.75, 0.95):
+        exact = ordered[int(q * len(ordered))]
+        assert abs(sketch_quantile(sketch, q) - exact) < 0.05, (q, sketch_quantile(sketch, q), exact)
+    assert sketch_quantile(sketch, 0) == min(data) and sketch_quantile(sketch, 1) == max(data)
+
+def test_sketch_merge_bounded():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import (
+        new_sketch, sketch_add, sketch_merge, SKETCH_COMPRESSION)
+    merged = new_sketch()
+    for seed in range(10):
+        merged = sketch_merge(merged, sketch_add(new_sketch(), _spiky_readings(2000, seed)))
+    assert merged["count"] == 20000
+    assert len(merged["centroids"]) <= SKETCH_COMPRESSION
+
+def test_sketch_mad():
+    import statistics
+    from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import new_sketch, sketch_add, sketch_mad
+    data = _spiky_readings()
+    median = statistics.median(data)
+    exact = statistics.median(abs(x - median) for x in data)
+    assert abs(sketch_mad(sketch_add(new_sketch(), data)) - exact) < 0.02
+
+def test_robust_outlier_ignores_spikes():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import (
+        new_sketch, sketch_add, robust_stats, robust_outlier_warning)
+    stats = robust_stats(sketch_add(new_sketch(), _spiky_readings()))
+    assert abs(stats["median"] - 20) < 0.1
+    assert robust_outlier_warning(20.5, stats) is None
+    assert robust_outlier_warning(24.0, stats)
+    # Too little history: no verdict
+    assert robust_outlier_warning(24.0, dict(stats, count=5)) is None
+
+def test_get_sensor_quantiles():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_quantiles import (
+        update_quantile_sketches, get_sensor_quantiles, _sketch_cache_key)
+    sensor_type, sensor_id = "DHT22", "_Test Quantile Sensor"
+    frappe.cache().delete_value(_sketch_cache_key(sensor_type, sensor_id))
+    update_quantile_sketches([{"sensor_type": sensor_type, "sensor_id": sensor_id, "temperature": float(v)}
+                              for v in range(1, 101)])
+    result = get_sensor_quantiles(sensor_type, sensor_id=sensor_id, quantiles="0.5,0.9")
+    assert result["count"] == 100
+    assert abs(result["quantiles"]["0.5"] - 50.5) < 1, result
+    assert abs(result["quantiles"]["0.9"] - 90.5) < 1, result
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,102 @@
+"""Phase 6.16 Test Plan: IoT Series Queries
+Tests LTTB downsampling, source selection by range and the compact series
+reply. Readings and rollups are served from memory."""
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+START = datetime(2026, 1, 1, 0, 0, 0)
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_lttb_keeps_ends_and_peaks,
+        test_lttb_short_series,
+        test_pick_series_source,
+        test_series_from_rollups,
+        test_series_from_raw,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.16 Results: {passed}/{len(results)} passed ===")
+    return results
+
+def test_lttb_keeps_ends_and_peaks():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_series import lttb
+    times = list(range(1000))
+    values = [20.0] * 1000
+    values[437] = 35.0
+    values[802] = 5.0
+    keep = lttb(times, values, 50)
+    assert len(keep) == 50 and keep[0] == 0 and keep[-1] == 999
+    assert keep == sorted(keep)
+    # A single spike survives where a stride of 20 would miss both
+    assert 437 in keep and 802 in keep, keep
+
+def test_lttb_short_series():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_series import lttb
+    assert lttb([1, 2, 3], [1.0, 2.0, 3.0], 10) == [0, 1, 2]
+    assert lttb([], [], 10) == []
+
+def test_pick_series_source():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_series import pick_series_source
+    hour, day = 3600, 86400
+    # 1 h of 30 s readings is 120 points: raw
+    assert pick_series_source(hour, 100, 30) == "raw"
+    # A day of 30 s readings is 2880 points, over 4 x 500
+    assert pick_series_source(day, 500, 30) == 1
+    assert pick_series_source(7 * day, 500, 30) == 15
+    assert pick_series_source(90 * day, 500, 30) == 60
+    # Without an interval (a whole sensor type) raw is never used
+    assert pick_series_source(hour, 100) == 1
+
+def _with_series(fn, registry=None, readings=(), buckets=()):
+    from rnd_warehouse_management.rnd_warehouse_management import iot_series, iot_pipeline, iot_archive
+    originals = (iot_pipeline.get_device_registry, iot_archive.get_readings, iot_series.get_rollup_buckets)
+    iot_pipeline.get_device_registry = lambda: {"by_sensor": registry or {}}
+    iot_archive.get_readings = lambda sensor_type, start, end, sensor_id: list(readings)
+    calls = []
+
+    def rollups(sensor_type, metric, start, end, resolution, sensor_id):
+        calls.append(resolution)
+        return list(buckets)
+    iot_series.get_rollup_buckets = rollups
+    try:
+        return fn(), calls
+    finally:
+        iot_pipeline.get_device_registry, iot_archive.get_readings, iot_series.get_rollup_buckets = originals
+
+def test_series_from_rollups():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_series import get_sensor_series
+    buckets = [SimpleNamespace(bucket_start=START + timedelta(minutes=15 * i), reading_count=30,
+                               value_sum=30 * (20 + i % 5), min_value=19 + i % 5, max_value=21 + i % 5)
+               for i in range(672)]
+    result, calls = _with_series(
+        lambda: get_sensor_series("DHT22", START, START + timedelta(days=7), max_points=200), buckets=buckets)
+    assert calls == [15] and result["source"] == "15m"
+    assert result["sensor_id"] is None and result["metric"] == "temperature"
+    assert result["points"] == 672 and result["returned"] == 200
+    assert len(result["t"]) == len(result["v"]) == len(result["min"]) == len(result["max"]) == 200
+    assert result["t"][0] == int(START.timestamp()) and result["v"][0] == 20.0
+
+def test_series_from_raw():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_series import get_sensor_series
+    registry = {"dht22_1": {"sensor_type": "DHT22", "expected_interval": 60}}
+    readings = [{"sensor_type": "DHT22", "device_time": START + timedelta(minutes=i), "temperature": 20 + i % 3}
+                for i in range(120)]
+    result, calls = _with_series(
+        lambda: get_sensor_series("dht22_1", START, START + timedelta(hours=2), max_points=500),
+        registry=registry, readings=readings)
+    assert not calls and result["source"] == "raw"
+    assert result["sensor_type"] == "DHT22" and result["sensor_id"] == "dht22_1"
+    assert result["returned"] == 120 and "min" not in result
+    assert result["v"][:3] == [20.0, 21.0, 22.0]
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,104 @@
+"""Phase 6.17 Test Plan: IoT Zone Correlation
+Tests the vectorized pairwise correlation, residual flags from the zone
+median and the cached zone job. Rollups are generated in memory."""
+import frappe
+import math
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_pairwise_correlation,
+        test_pairwise_correlation_overlap,
+        test_analyze_zone_flags,
+        test_compute_zone_correlation,
+        test_run_zone_correlation,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.17 Results: {passed}/{len(results)} passed ===")
+    return results
+
+def _room(minutes=360, sensors=5):
+    """A cold room cycling 2-6 C; each sensor with a small fixed offset."""
+    return [[4 + 2 * math.sin(m / 20) + 0.1 * s + 0.05 * math.cos(m * (s + 1)) for m in range(minutes)]
+            for s in range(sensors)]
+
+def test_pairwise_correlation():
+    import numpy as np
+    from rnd_warehouse_management.rnd_warehouse_management.iot_correlation import pairwise_correlation
+    matrix = np.array(_room())
+    assert np.allclose(pairwise_correlation(matrix), np.corrcoef(matrix), atol=1e-9)
+
+def test_pairwise_correlation_overlap():
+    import numpy as np
+    from rnd_warehouse_management.rnd_warehouse_management.iot_correlation import pairwise_correlation
+    matrix = np.array(_room(sensors=3))
+    matrix[0, :200] = np.nan
+    matrix[1, 190:] = np.nan
+    corr = pairwise_correlation(matrix)
+    # Sensors 0 and 1 share 10 minutes: too few to report
+    assert np.isnan(corr[0, 1]) and np.isnan(corr[1, 0])
+    both = ~np.isnan(matrix[0]) & ~np.isnan(matrix[2])
+    assert abs(corr[0, 2] - np.corrcoef(matrix[0, both], matrix[2, both])[0, 1]) < 1e-9
+
+def test_analyze_zone_flags():
+    import numpy as np
+    from rnd_warehouse_management.rnd_warehouse_management.iot_correlation import analyze_zone
+    room = _room()
+    # Sensor 3 drifts 2 C away over the last hour, sensor 4 is stuck
+    room[3] = [v + max(0, m - 300) * 2 / 60 for m, v in enumerate(room[3])]
+    room[4] = [4.0 + 0.01 * (m % 2) for m in range(360)]
+    analysis = analyze_zone(np.array(room), limit=1.0, recent_minutes=30, min_correlation=0.5)
+    assert analysis["flags"][:3] == [[], [], []], analysis["flags"]
+    assert "offset" in analysis["flags"][3] and "diverging" in analysis["flags"][3]
+    assert "decorrelated" in analysis["flags"][4], analysis["flags"][4]
+    assert analysis["median_correlation"][0] > 0.9
+
+def _rows(room, metric="temperature", prefix="s"):
+    return [(f"{prefix}{s}", metric, m, v) for s, series in enumerate(room) for m, v in enumerate(series)]
+
+def test_compute_zone_correlation():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_correlation import (
+        compute_zone_correlation, DEFAULT_ZONE_SETTINGS)
+    room = _room()
+    room[2] = [v + 3 for v in room[2]]
+    rows = _rows(room) + _rows(_room(sensors=2), prefix="t")
+    zones = {"Cold Room": ["s0", "s1", "s2", "s3", "s4"], "Tank Line": ["t0", "t1"]}
+    results = compute_zone_correlation(zones, rows, 360, DEFAULT_ZONE_SETTINGS)
+    # Two sensors have no median to compare against; humidity has no rows
+    assert [(r["zone"], r["metric"]) for r in results] == [("Cold Room", "temperature")]
+    assert results[0]["flagged"] == ["s2"]
+    assert results[0]["sensor_ids"] == ["s0", "s1", "s2", "s3", "s4"]
+    assert len(results[0]["correlation"]) == 5
+
+def test_run_zone_correlation():
+    from rnd_warehouse_management.rnd_warehouse_management import iot_correlation, iot_pipeline
+    room = _room()
+    room[1] = [v - 2 for v in room[1]]
+    originals = (iot_pipeline.get_device_registry, iot_correlation._load_zone_rollups)
+    iot_pipeline.get_device_registry = lambda: {"by_zone": {"Cold Room": ["s0", "s1", "s2", "s3", "s4"],
+                                                            "Dock": ["d0"]}}
+    iot_correlation._load_zone_rollups = lambda sensor_ids, metrics, start, end: _rows(room)
+    frappe.cache().delete_value(iot_correlation.ZONE_CORRELATION_KEY)
+    try:
+        summary = iot_correlation.run_zone_correlation()
+        assert summary["zones"] == 1 and summary["sensors"] == 5 and summary["flagged"] == 1, summary
+        result = iot_correlation.get_zone_correlation(zone="Cold Room")
+        assert result["flagged"] == [{"zone": "Cold Room", "metric": "temperature", "sensor_id": "s1",
+                                      "flags": ["offset"]}], result["flagged"]
+        assert "correlation" not in result["zones"][0]
+        assert "correlation" in iot_correlation.get_zone_correlation(include_matrix=1)["zones"][0]
+        assert iot_correlation.get_zone_correlation(zone="Dock")["zones"] == []
+    finally:
+        iot_pipeline.get_device_registry, iot_correlation._load_zone_rollups = originals
+        frappe.cache().delete_value(iot_correlation.ZONE_CORRELATION_KEY)
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,90 @@
+"""Phase 6.18 Test Plan: IoT Ingest Rate Limits
+Tests bucket planning per rpi_id and sensor type, the Redis token bucket
+script, 429 rejections before database work and the throttle counters."""
+import frappe
+
+LIMITS = {
+    "enabled": True,
+    "min_call_cost": 10,
+    "rpi": {"rate": 100, "burst": 6000},
+    "sensor_type": {"rate": 2000, "burst": 20000},
+    "rpi_overrides": {"RPi-SLOW": {"rate": 5, "burst": 50}},
+    "sensor_type_overrides": {"PLC_pH": {"rate": 0}},
+}
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_plan_buckets,
+        test_plan_buckets_registry_device,
+        test_token_bucket_script,
+        test_rejection_before_db,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.18 Results: {passed}/{len(results)} passed ===")
+    return results
+
+def test_plan_buckets():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rate_limit import plan_buckets
+    rows = [{"sensor_type": "DHT22", "sensor_id": "d1"}] * 3 + [{"sensor_type": "PLC_pH", "rpi_id": "RPi-SLOW"}]
+    buckets = plan_buckets(rows, rpi_id="RPi-01", limits=LIMITS)
+    # A small call still costs min_call_cost; PLC_pH is not limited; a call
+    # larger than a bucket is capped at the burst
+    assert buckets == [("rpi", "RPi-01", 100.0, 6000.0, 10), ("rpi", "RPi-SLOW", 5.0, 50.0, 10),
+                       ("sensor_type", "DHT22", 2000.0, 20000.0, 3)], buckets
+    big = plan_buckets([{"sensor_type": "DHT22"}] * 100, rpi_id="RPi-SLOW", limits=LIMITS)
+    assert big[0] == ("rpi", "RPi-SLOW", 5.0, 50.0, 50)
+
+def test_plan_buckets_registry_device():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rate_limit import plan_buckets
+    by_sensor = {"d1": {"rpi_id": "RPi-02", "sensor_type": "DHT22"}}
+    buckets = plan_buckets([{"sensor_type": "DHT22", "sensor_id": "d1"}, {"sensor_type": "DHT22"}],
+                           limits=LIMITS, by_sensor=by_sensor)
+    assert [(b[0], b[1], b[4]) for b in buckets] == [("rpi", "RPi-02", 10), ("sensor_type", "DHT22", 2)]
+
+def test_token_bucket_script():
+    from rnd_warehouse_management.rnd_warehouse_management import iot_rate_limit
+    cache = frappe.cache()
+    buckets = [("rpi", "_Test RPi", 1.0, 30.0, 10), ("sensor_type", "_Test Type", 0.001, 4.0, 1)]
+    for scope, name, *_limit in buckets:
+        cache.delete_value(f"{iot_rate_limit.RATE_LIMIT_PREFIX}|{scope}|{name}")
+    outcomes = [iot_rate_limit._take_tokens(buckets) for _ in range(4)]
+    assert [allowed for allowed, _wait, _short in outcomes] == [True, True, True, False]
+    _allowed, wait, short = outcomes[-1]
+    assert short == buckets[0] and 9 < wait <= 10, (wait, short)
+    # The rejected call took nothing from the sensor type bucket: one token is left
+    assert iot_rate_limit._take_tokens(buckets[1:])[0]
+    assert not iot_rate_limit._take_tokens(buckets[1:])[0]
+
+def test_rejection_before_db():
+    from rnd_warehouse_management.rnd_warehouse_management import iot_rate_limit, iot_pipeline
+    cache = frappe.cache()
+    member = "rpi|_Test Flood"
+    for suffix in ("calls", "rows"):
+        cache.delete_value(f"{iot_rate_limit.THROTTLED_KEYS}|{member}|{suffix}")
+    originals = (iot_rate_limit._take_tokens, iot_rate_limit.get_rate_limits)
+    iot_rate_limit.get_rate_limits = lambda: LIMITS
+    iot_rate_limit._take_tokens = lambda buckets: (False, 2.2, buckets[0])
+    try:
+        response = iot_pipeline.ingest_readings([{"sensor_type": "DHT22", "temperature": 4}] * 3,
+                                                rpi_id="_Test Flood")
+        assert response["code"] == "rate_limited" and response["retry_after"] == 3, response
+        assert response["limit"] == "rpi:_Test Flood"
+        check = iot_pipeline.validate_sensor_reading("DHT22", 4, rpi_id="_Test Flood")
+        assert check["valid"] is False and check["errors"] == ["rate_limited"]
+        stats = iot_rate_limit.get_throttle_stats()
+        entry = next(e for e in stats["keys"] if e["name"] == "_Test Flood")
+        assert entry == {"scope": "rpi", "name": "_Test Flood", "calls": 2, "rows": 4}, entry
+    finally:
+        iot_rate_limit._take_tokens, iot_rate_limit.get_rate_limits = originals
+
+if __name__ == "__main__":
+    run_all_tests()
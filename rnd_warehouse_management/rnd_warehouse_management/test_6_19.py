@@ -0,0 +1,90 @@
+"""Phase 6.19 Test Plan: IoT Sensor Calibration
+Tests the vectorized Steinhart-Hart and linear conversions, the choice of
+calibration by effective date on ingest and raw-only rows passing
+validation. Calibrations are served from memory."""
+from datetime import datetime
+
+# 10K NTC thermistor, 24.68 C at 10 kOhm
+NTC = {"name": "CAL-NTC", "method": "steinhart_hart", "input_field": "raw_adc", "output_field": "temperature",
+       "coeff_a": 1.009249522e-03, "coeff_b": 2.378405444e-04, "coeff_c": 2.019202697e-07,
+       "series_resistor": 10000, "adc_max": 4095}
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_convert_steinhart_hart,
+        test_convert_linear,
+        test_calibrate_batch_by_effective_date,
+        test_raw_rows_pass_validation,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.19 Results: {passed}/{len(results)} passed ===")
+    return results
+
+def test_convert_steinhart_hart():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import convert
+    values = convert([2047.5, 0, 4095, None], NTC).tolist()
+    assert abs(values[0] - 24.68) < 0.01, values
+    # Rail readings (open or shorted thermistor) and missing inputs give NaN
+    assert all(v != v for v in values[1:]), values
+    by_resistance = convert([10000, 5000], dict(NTC, input_field="resistance")).tolist()
+    assert abs(by_resistance[0] - 24.68) < 0.01 and by_resistance[1] > 40
+
+def test_convert_linear():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import convert
+    cal = {"method": "linear", "input_field": "raw_adc", "gain": 5 / 4095, "offset": -0.1}
+    assert [round(v, 4) for v in convert([0, 4095], cal).tolist()] == [-0.1, 4.9]
+
+def _with_calibrations(by_sensor, fn):
+    from rnd_warehouse_management.rnd_warehouse_management import iot_calibration
+    original = iot_calibration.get_calibrations
+    iot_calibration.get_calibrations = lambda: by_sensor
+    try:
+        return fn()
+    finally:
+        iot_calibration.get_calibrations = original
+
+def test_calibrate_batch_by_effective_date():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import calibrate_batch
+    now = datetime(2026, 3, 1, 12, 0)
+    first = dict(NTC, effective_epoch=datetime(2026, 1, 1).timestamp())
+    second = dict(NTC, name="CAL-NTC-2", series_resistor=20000, effective_epoch=datetime(2026, 2, 1).timestamp())
+    batch = [
+        {"sensor_type": "Ford Temperature", "sensor_id": "ntc-1", "raw_adc": 2047.5, "device_time": "2025-12-15 08:00:00"},
+        {"sensor_type": "Ford Temperature", "sensor_id": "ntc-1", "raw_adc": 2047.5, "device_time": "2026-01-15 08:00:00"},
+        {"sensor_type": "Ford Temperature", "sensor_id": "ntc-1", "raw_adc": 2047.5, "temperature": 30.0},
+        {"sensor_type": "Ford Temperature", "sensor_id": "ntc-1", "raw_adc": 0, "temperature": 30.0},
+        {"sensor_type": "DHT22", "sensor_id": "dht-1", "temperature": 4.0},
+    ]
+    count = _with_calibrations({"ntc-1": [first, second]}, lambda: calibrate_batch(batch, now))
+    assert count == 2
+    # Before the first calibration the Pi's value is kept
+    assert "temperature" not in batch[0] and "calibration" not in batch[0]
+    assert batch[1]["temperature"] == 24.6813 and batch[1]["calibration"] == "CAL-NTC"
+    # No device time: the arrival time picks the newer calibration (R = 20k)
+    assert batch[2]["calibration"] == "CAL-NTC-2" and batch[2]["temperature"] < 10
+    assert batch[3]["temperature"] == 30.0 and "calibration" not in batch[3]
+    assert batch[4] == {"sensor_type": "DHT22", "sensor_id": "dht-1", "temperature": 4.0}
+
+def test_raw_rows_pass_validation():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_calibration import calibrate_batch
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import validate_reading_batch
+    from rnd_warehouse_management.rnd_warehouse_management.iot_gateway import prevalidate
+    row = {"sensor_type": "Ford Temperature", "sensor_id": "ntc-1", "raw_adc": 2047.5}
+    assert prevalidate(dict(row)) is None
+    batch = [row]
+    _with_calibrations({"ntc-1": [dict(NTC, effective_epoch=0)]}, lambda: calibrate_batch(batch))
+    results, accepted = validate_reading_batch(batch)
+    assert results[0]["code"] == "ok", results
+    assert accepted[0][1]["temperature"] == 24.6813
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -17,6 +17,20 @@ def run_all_tests():
         test_aggregated_readings,
         test_buffer_status_report,
         test_pipeline_dashboard,
+        test_ingest_readings_codes,
+        test_ingest_readings_rejects_non_list,
+        test_rolling_stats_cache,
+        test_aggregated_readings_from_rollups,
+        test_health_snapshot_counters,
+        test_sliding_count,
+        test_drift_cusum_step,
+        test_drift_params_from_registry,
+        test_dashboard_snapshot_seq,
+        test_dashboard_delta_flush,
+        test_apply_sequences,
+        test_ingest_readings_replay,
+        test_ingest_readings_stamps_rpi_id,
+        test_latest_values_ring,
     ]
     for test_fn in tests:
         try:
@@ -91,6 +105,7 @@ def test_buffer_status_report():
     assert result["received"] == True
     assert result["rpi_id"] == "RPi-IoT-L01"
     assert result["buffered_count"] == 5
+    assert result["next_expected_seq"] >= 1
 
 def test_pipeline_dashboard():
     from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_pipeline_dashboard
@@ -98,5 +113,178 @@ def test_pipeline_dashboard():
     assert isinstance(result, dict)
     assert "total_sensors" in result or "error" not in result
 
+def test_ingest_readings_codes():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import ingest_readings
+    batch = [
+        {"sensor_type": "DHT22", "sensor_id": "TEST-DHT22-01", "temperature": 21.5},
+        {"sensor_type": "DHT22", "sensor_id": "TEST-DHT22-01", "value": 22.0},
+        {"sensor_type": "DHT22", "sensor_id": "TEST-DHT22-01", "temperature": 999.0},
+        {"sensor_type": "DHT22", "sensor_id": "TEST-DHT22-01", "temperature": "abc"},
+        {"sensor_id": "TEST-DHT22-01", "temperature": 20.0},
+    ]
+    result = ingest_readings(json.dumps(batch))
+    assert result["received"] == 5
+    assert result["accepted"] == 2, f"Expected 2 accepted, got {result}"
+    codes = [r["code"] for r in result["results"]]
+    assert codes == ["ok", "ok", "out_of_range", "non_numeric", "missing_sensor_type"], codes
+    for r in result["results"][:2]:
+        assert frappe.db.exists("IoT Sensor Reading", r["name"])
+        frappe.delete_doc("IoT Sensor Reading", r["name"], force=True)
+    frappe.db.commit()
+
+def test_ingest_readings_rejects_non_list():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import ingest_readings
+    result = ingest_readings({"sensor_type": "DHT22"})
+    assert "error" in result
+
+def test_rolling_stats_cache():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        update_rolling_stats, get_sensor_stats, _stats_cache_key)
+    frappe.cache().delete_value(_stats_cache_key("_Test Sensor"))
+    frappe.cache().delete_value(_stats_cache_key("_Test Sensor", "TEST-01"))
+    values = [20.0, 21.0, 22.0, 23.0, 24.0]
+    update_rolling_stats([{"sensor_type": "_Test Sensor", "sensor_id": "TEST-01", "temperature": v} for v in values[:2]])
+    update_rolling_stats([{"sensor_type": "_Test Sensor", "sensor_id": "TEST-01", "temperature": v} for v in values[2:]])
+    stats = get_sensor_stats("_Test Sensor", minutes=30)
+    assert stats["count"] == 5
+    assert abs(stats["mean"] - 22.0) < 1e-9
+    assert abs(stats["std"] - 2 ** 0.5) < 1e-9
+    assert stats["min"] == 20.0 and stats["max"] == 24.0
+    assert get_sensor_stats("_Test Sensor", minutes=30, sensor_id="TEST-01")["count"] == 5
+
+def test_aggregated_readings_from_rollups():
+    from frappe.utils import now_datetime
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rollups import update_rollups
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_aggregated_readings
+    ts = now_datetime()
+    update_rollups([{"sensor_type": "_Test Rollup", "sensor_id": "TEST-01", "temperature": v, "creation": ts}
+                    for v in (10.0, 20.0, 30.0)])
+    result = get_aggregated_readings("_Test Rollup", interval_minutes=15, hours=1)
+    assert len(result) == 1, f"Expected one 15-minute bucket, got {result}"
+    assert result[0]["reading_count"] == 3
+    assert abs(result[0]["avg_temp"] - 20.0) < 1e-6
+    assert result[0]["min_temp"] == 10.0 and result[0]["max_temp"] == 30.0
+    frappe.db.delete("IoT Reading Rollup", {"sensor_type": "_Test Rollup"})
+    frappe.db.commit()
+
+def test_health_snapshot_counters():
+    from frappe.utils import now_datetime
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        update_health_snapshot, check_sensor_health)
+    frappe.db.delete("Sensor Health Snapshot", {"sensor_type": "_Test Health"})
+    ts = now_datetime()
+    rows = [{"sensor_type": "_Test Health", "sensor_id": "TEST-01", "temperature": v, "creation": ts}
+            for v in (20.0, 21.0, 22.0)]
+    update_health_snapshot(rows)
+    update_health_snapshot(rows[:1])
+    result = check_sensor_health("_Test Health")
+    assert result["status"] == "active", result
+    assert result["total_readings"] == 4
+    assert result["readings_last_hour"] == 4
+    assert result["last_value"] in (20.0, 22.0)
+    assert result["sensors"][0]["sensor_id"] == "TEST-01"
+    frappe.db.delete("Sensor Health Snapshot", {"sensor_type": "_Test Health"})
+    frappe.db.commit()
+
+def test_sliding_count():
+    from datetime import datetime
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import _sliding_count
+    bucket = datetime(2026, 1, 1, 10, 0)
+    assert _sliding_count(datetime(2026, 1, 1, 10, 30), bucket, 10, 20, 3600) == 20
+    assert _sliding_count(datetime(2026, 1, 1, 11, 30), bucket, 10, 20, 3600) == 5
+    assert _sliding_count(datetime(2026, 1, 1, 13, 0), bucket, 10, 20, 3600) == 0
+
+def test_drift_cusum_step():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        _drift_step, _new_drift_state, DRIFT_WARMUP_READINGS)
+    params = {"drift_cusum_k": 0.5, "drift_cusum_h": 5.0}
+    state = _new_drift_state()
+    for i in range(DRIFT_WARMUP_READINGS + 50):
+        assert _drift_step(state, 20.0 + (0.1 if i % 2 else -0.1), params) is None
+    assert abs(state["baseline"] - 20.0) < 0.05
+    events = [_drift_step(state, 21.0, params) for _ in range(20)]
+    assert "up" in events
+    assert state["events"] == 1
+    assert abs(state["baseline"] - 21.0) < 0.05
+
+def test_drift_params_from_registry():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        get_drift_params, DEFAULT_DRIFT_PARAMS)
+    assert get_drift_params("DHT11")["drift_cusum_k"] == 1.0
+    assert get_drift_params("PLC_pH") == DEFAULT_DRIFT_PARAMS
+
+def test_dashboard_snapshot_seq():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import get_dashboard_snapshot
+    result = get_dashboard_snapshot()
+    assert isinstance(result["seq"], int)
+    assert result["tick_seconds"] >= 1
+    assert "dashboard" in result
+
+def test_dashboard_delta_flush():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        mark_dashboard_dirty, flush_dashboard_deltas, get_dashboard_seq)
+    before = get_dashboard_seq()
+    mark_dashboard_dirty(["_Test Delta"])
+    seq = flush_dashboard_deltas(force=True)
+    assert seq == before + 1
+    assert get_dashboard_seq() == seq
+    # Nothing dirty: no delta, seq unchanged
+    assert flush_dashboard_deltas(force=True) is None
+    assert get_dashboard_seq() == seq
+
+def test_apply_sequences():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import apply_sequences
+    next_expected, ranges, fresh, duplicates = apply_sequences(1, [], [1, 2, 3, 5])
+    assert (next_expected, ranges, fresh, duplicates) == (4, [[5, 5]], {1, 2, 3, 5}, [])
+    next_expected, ranges, fresh, duplicates = apply_sequences(4, [[5, 5]], [2, 3, 4, 5, 6])
+    assert (next_expected, ranges, fresh) == (7, [], {4, 6})
+    assert sorted(duplicates) == [2, 3, 5]
+
+def test_ingest_readings_replay():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import ingest_readings
+    rpi_id = "_Test RPi Replay"
+    frappe.db.delete("IoT Device", {"rpi_id": rpi_id})
+    batch = [{"sensor_type": "DHT22", "sensor_id": "TEST-DHT22-01", "temperature": 21.0 + i, "seq": i}
+             for i in (1, 2, 3)]
+    first = ingest_readings(json.dumps(batch), rpi_id=rpi_id)
+    retry = ingest_readings(json.dumps(batch + [dict(batch[0], seq=4)]), rpi_id=rpi_id)
+    assert first["accepted"] == 3
+    assert retry["accepted"] == 1 and retry["duplicates"] == 3, retry
+    assert retry["next_expected_seq"][rpi_id] == 5
+    for r in first["results"] + retry["results"]:
+        if r.get("name"):
+            frappe.delete_doc("IoT Sensor Reading", r["name"], force=True)
+    frappe.db.delete("IoT Device", {"rpi_id": rpi_id})
+    frappe.db.commit()
+
+def test_ingest_readings_stamps_rpi_id():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import ingest_readings
+    rpi_id = "_Test RPi No Seq"
+    batch = [{"sensor_type": "DHT22", "sensor_id": "TEST-DHT22-01", "temperature": 21.0}]
+    result = ingest_readings(json.dumps(batch), rpi_id=rpi_id)
+    name = result["results"][0]["name"]
+    try:
+        assert frappe.db.get_value("IoT Sensor Reading", name, "rpi_id") == rpi_id
+    finally:
+        frappe.delete_doc("IoT Sensor Reading", name, force=True)
+        frappe.db.commit()
+
+def test_latest_values_ring():
+    from frappe.utils import now_datetime, add_to_date
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        update_latest_values, get_recent_readings, get_latest_reading, LATEST_PRIMED_KEY)
+    sensor_id = "_Test Latest Ring"
+    frappe.cache().delete_value(f"iot_latest|sensor|{sensor_id}")
+    frappe.cache().set(frappe.cache().make_key(LATEST_PRIMED_KEY), 1)
+    now = now_datetime()
+    update_latest_values([
+        {"sensor_type": "DHT22", "sensor_id": sensor_id, "temperature": 21.0, "creation": add_to_date(now, seconds=-20)},
+        {"sensor_type": "DHT22", "sensor_id": sensor_id, "temperature": 22.0, "creation": now},
+        {"sensor_type": "DHT22", "sensor_id": sensor_id, "temperature": 15.0, "creation": add_to_date(now, hours=-2)},
+    ])
+    assert get_latest_reading(sensor_id=sensor_id).temperature == 22.0
+    # The two-hour-old reading is outside the window
+    assert [r.temperature for r in get_recent_readings(sensor_id=sensor_id)] == [22.0, 21.0]
+
 if __name__ == "__main__":
     run_all_tests()
@@ -0,0 +1,124 @@
+"""Phase 6.20 Test Plan: IoT Derived Data Rebuild
+Tests chunk planning (compressed types get no rollup chunks), the duty
+cycle pause, the gap replay across windows and resuming from a checkpoint
+after a failed chunk. Chunks run in process (workers=0) with the chunk
+runner replaced."""
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_plan_chunks,
+        test_plan_chunks_skips_compressed_rollups,
+        test_pause_after,
+        test_gap_replay_across_windows,
+        test_checkpoint_resume,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.20 Results: {passed}/{len(results)} passed ===")
+    return results
+
+def test_plan_chunks():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rebuild import plan_chunks, parse_targets
+    targets = parse_targets("drift,rollups,health")
+    assert targets == ["rollups", "health", "drift"]
+    chunks = plan_chunks(targets, ["DHT22", "PLC_pH"], datetime(2026, 3, 1, 10, 20), datetime(2026, 3, 1, 20, 0),
+                         chunk_hours=6)
+    assert [c["id"] for c in chunks[:2]] == ["replay|DHT22", "replay|PLC_pH"]
+    assert chunks[0]["targets"] == ["health", "drift"]
+    rollups = [(c["sensor_type"], c["start"], c["end"]) for c in chunks[2:]]
+    # Ranges start on the hour and the last one stops at end
+    assert rollups == [
+        ("DHT22", "2026-03-01 10:00:00", "2026-03-01 16:00:00"),
+        ("PLC_pH", "2026-03-01 10:00:00", "2026-03-01 16:00:00"),
+        ("DHT22", "2026-03-01 16:00:00", "2026-03-01 20:00:00"),
+        ("PLC_pH", "2026-03-01 16:00:00", "2026-03-01 20:00:00"),
+    ], rollups
+    assert plan_chunks(["gaps"], ["DHT22"]) == [
+        {"id": "replay|DHT22", "kind": "replay", "sensor_type": "DHT22", "targets": ["gaps"]}]
+
+def test_plan_chunks_skips_compressed_rollups():
+    import frappe
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rebuild import plan_chunks
+    original = frappe.conf.get("iot_swinging_door")
+    frappe.conf["iot_swinging_door"] = ["PLC_pH"]
+    try:
+        chunks = plan_chunks(["rollups", "gaps"], ["DHT22", "PLC_pH"],
+                             datetime(2026, 3, 1, 10, 0), datetime(2026, 3, 1, 12, 0))
+    finally:
+        frappe.conf["iot_swinging_door"] = original
+    # The compressed type is still replayed, but its rollups are left alone
+    assert [c["id"] for c in chunks] == [
+        "replay|DHT22", "replay|PLC_pH", "rollups|DHT22|2026-03-01 10:00:00"], chunks
+
+def test_pause_after():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rebuild import pause_after
+    assert pause_after(2.0, 1.0) == 0
+    assert pause_after(2.0, 0.5) == 2.0
+    assert pause_after(1.0, 0.25) == 3.0
+
+def test_gap_replay_across_windows():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_rebuild import _replay_gaps
+    base = datetime(2026, 3, 1, 8, 0)
+    state = {"by_sensor": {"d1": {"expected_interval": 60}}, "last": {}, "gaps": []}
+    first = [{"sensor_type": "DHT22", "sensor_id": "d1", "device_time": base + timedelta(minutes=m)}
+             for m in range(5)]
+    # The outage spans the window boundary: it's found from the last reading
+    # of the previous window
+    second = [{"sensor_type": "DHT22", "sensor_id": "d1", "device_time": base + timedelta(minutes=m)}
+              for m in (20, 21)]
+    _replay_gaps(state, "DHT22", first)
+    _replay_gaps(state, "DHT22", second)
+    assert state["gaps"] == [("d1", base + timedelta(minutes=5), base + timedelta(minutes=20))], state["gaps"]
+    assert state["last"]["d1"] == base + timedelta(minutes=21)
+
+def test_checkpoint_resume():
+    from rnd_warehouse_management.rnd_warehouse_management import iot_rebuild
+    directory = tempfile.mkdtemp()
+    calls, failing = [], {"replay|PLC_pH"}
+
+    def fake_chunk(chunk):
+        calls.append(chunk["id"])
+        if chunk["id"] in failing:
+            failing.discard(chunk["id"])
+            raise RuntimeError("lock wait timeout")
+        return {"rows": 10}
+
+    patched = {
+        "get_checkpoint_path": lambda rebuild_id: os.path.join(directory, f"{rebuild_id}.json"),
+        "get_sensor_types": lambda: ["DHT22", "PLC_pH"],
+        "get_history_start": lambda sensor_type=None: datetime(2026, 3, 1, 0, 0),
+        "get_rollup_boundary": lambda now=None: datetime(2026, 3, 1, 12, 0),
+        "run_chunk": fake_chunk,
+    }
+    originals = {name: getattr(iot_rebuild, name) for name in patched}
+    for name, fn in patched.items():
+        setattr(iot_rebuild, name, fn)
+    try:
+        first = iot_rebuild.run(targets="rollups,health", workers=0)
+        assert first["status"] == "incomplete" and first["total"] == 6 and first["done"] == 5, first
+        assert list(first["failed"]) == ["replay|PLC_pH"]
+        calls.clear()
+        second = iot_rebuild.run(targets="rollups,health", workers=0)
+        # Only the failed chunk runs again
+        assert calls == ["replay|PLC_pH"] and second["status"] == "completed", (calls, second)
+        assert second["run_id"] == first["run_id"] and not second["failed"]
+        calls.clear()
+        iot_rebuild.run(targets="rollups,health", workers=0, fresh=1)
+        assert len(calls) == 6
+    finally:
+        for name, fn in originals.items():
+            setattr(iot_rebuild, name, fn)
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -21,6 +21,11 @@ def run_all_tests():
         test_combined_dashboard,
         test_validate_plc_config_valid,
         test_validate_plc_config_invalid,
+        test_poll_interval_slow_register,
+        test_poll_interval_fast_register,
+        test_plc_config_register_schedule,
+        test_convert_plc_frame,
+        test_convert_plc_frame_matches_single_calls,
     ]
     for test_fn in tests:
         try:
@@ -131,5 +136,72 @@ def test_validate_plc_config_invalid():
     assert result["valid"] == False
     assert len(result["errors"]) > 0
 
+def _minute_buckets(means, spread=0.0, count=6):
+    """1-minute rollup rows with the given means and within-minute spread."""
+    from datetime import datetime, timedelta
+    t0 = datetime(2026, 1, 1)
+    return [{"bucket_start": t0 + timedelta(minutes=i), "reading_count": count,
+             "value_sum": m * count, "value_sum_sq": count * (m * m + spread * spread)}
+            for i, m in enumerate(means)]
+
+def test_poll_interval_slow_register():
+    from rnd_warehouse_management.rnd_warehouse_management.plc_integration import recommend_poll_interval
+    # Brix creeping 0.01 per minute against a 0.2 deadband: slowest allowed
+    seconds, stats = recommend_poll_interval(_minute_buckets([40 + 0.01 * i for i in range(120)]), 0.2, 1, 300)
+    assert seconds == 300, stats
+    # Too little history: keep the default interval
+    assert recommend_poll_interval(_minute_buckets([40.0] * 5), 0.2, 1, 300)[0] is None
+
+def test_poll_interval_fast_register():
+    from rnd_warehouse_management.rnd_warehouse_management.plc_integration import recommend_poll_interval
+    # Temperature ramping 3 C/min against a 0.5 deadband: every 10 s or faster
+    seconds, _stats = recommend_poll_interval(_minute_buckets([20 + 3 * i for i in range(60)]), 0.5, 1, 300)
+    assert seconds == 10
+    # Noisy but flat: noise sets the pace
+    seconds, _stats = recommend_poll_interval(_minute_buckets([50.0] * 60, spread=2.0), 1.0, 1, 300)
+    assert seconds == 30
+
+def test_plc_config_register_schedule():
+    from rnd_warehouse_management.rnd_warehouse_management.plc_integration import (
+        get_plc_config, DEFAULT_PLC_REGISTER_MAP)
+    config = get_plc_config()
+    schedule = config["register_schedule"]
+    assert set(schedule) == set(DEFAULT_PLC_REGISTER_MAP)
+    for entry in schedule.values():
+        assert config["min_poll_interval_seconds"] <= entry["poll_interval_seconds"] <= config["max_poll_interval_seconds"]
+        assert entry["source"] in ("default", "adaptive", "override")
+
+def test_convert_plc_frame():
+    from rnd_warehouse_management.rnd_warehouse_management.plc_integration import convert_plc_frame
+    result = convert_plc_frame({"N7:0": [250, 2500, 900], "N7:1": [700, 250, None], "PLC_Brix": [450, 450, 450],
+                                "N7:9": [1, 2, 3]}, timestamps=["t0", "t1", "t2"])
+    assert result["count"] == 3 and result["unknown_registers"] == ["N7:9"]
+    assert result["values"]["PLC_Temperature"] == [25.0, 200.0, 90.0]
+    assert result["clamped"] == {"PLC_Temperature": 1, "PLC_pH": 0, "PLC_Brix": 0}
+    # normal, critical (clamped at 200), warning; a missing raw value has no level
+    assert result["levels"]["PLC_Temperature"] == [0, 2, 1]
+    assert result["values"]["PLC_pH"][2] is None and result["levels"]["PLC_pH"] == [0, 2, None]
+    assert [(a["sensor_type"], a["timestamp"], a["alarm_level"]) for a in result["alarms"]] == [
+        ("PLC_Temperature", "t1", "critical"), ("PLC_Temperature", "t2", "warning"), ("PLC_pH", "t1", "critical")]
+
+def test_convert_plc_frame_matches_single_calls():
+    from rnd_warehouse_management.rnd_warehouse_management import plc_integration
+    raws = {t: [reg["min_raw"] - 50 + i * (reg["max_raw"] + 100) // 40 for i in range(41)]
+            for t, reg in plc_integration.DEFAULT_PLC_REGISTER_MAP.items()}
+    vectorized = plc_integration.convert_plc_frame(raws)
+    original_np = plc_integration.np
+    plc_integration.np = None
+    try:
+        fallback = plc_integration.convert_plc_frame(raws)
+    finally:
+        plc_integration.np = original_np
+    assert fallback == vectorized
+    for sensor_type, values in raws.items():
+        for i, raw in enumerate(values):
+            eng = plc_integration.convert_raw_to_engineering(sensor_type, raw)["eng_value"]
+            level = plc_integration.check_plc_alarm(sensor_type, eng)["alarm_level"]
+            assert vectorized["values"][sensor_type][i] == eng, (sensor_type, raw)
+            assert vectorized["level_names"][vectorized["levels"][sensor_type][i]] == level, (sensor_type, raw)
+
 if __name__ == "__main__":
     run_all_tests()
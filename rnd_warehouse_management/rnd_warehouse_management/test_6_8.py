@@ -0,0 +1,80 @@
+"""Phase 6.8 Test Plan: Packed Binary Ingest
+Tests packed batch round-trip, missing values, malformed payloads and the JSON comparison benchmark."""
+import frappe
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_packed_round_trip,
+        test_packed_missing_values,
+        test_packed_float_typecodes,
+        test_packed_rejects_truncated,
+        test_packed_rejects_bad_magic,
+        test_packed_smaller_than_json,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.8 Results: {passed}/{len(results)} passed ===")
+    return results
+
+_T0 = 1767225600000000  # 2026-01-01 00:00:00 UTC in microseconds
+
+def _batch(typecode="i", temperatures=(21.3, 21.35, 21.4)):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import encode_section, encode_batch
+    timestamps = [_T0 + i * 10000000 for i in range(len(temperatures))]
+    return encode_batch([encode_section(
+        "DHT22", timestamps, {"temperature": list(temperatures), "humidity": [55.5] * len(temperatures)},
+        sensor_id="TEST-01", rpi_id="RPi-IoT-L01", base_seq=100, typecode=typecode)])
+
+def test_packed_round_trip():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import decode_batch
+    rows = decode_batch(_batch())
+    assert [r["temperature"] for r in rows] == [21.3, 21.35, 21.4]
+    assert [r["seq"] for r in rows] == [100, 101, 102]
+    assert rows[0]["sensor_id"] == "TEST-01" and rows[0]["rpi_id"] == "RPi-IoT-L01"
+    assert (rows[1]["timestamp"] - rows[0]["timestamp"]).total_seconds() == 10
+
+def test_packed_missing_values():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import decode_batch
+    for typecode in ("i", "f", "d"):
+        rows = decode_batch(_batch(typecode, temperatures=(21.5, None, 22.0)))
+        assert "temperature" not in rows[1], typecode
+        assert rows[2]["temperature"] == 22.0
+
+def test_packed_float_typecodes():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import decode_batch
+    assert [r["temperature"] for r in decode_batch(_batch("f"))] == [21.3, 21.35, 21.4]
+    assert [r["temperature"] for r in decode_batch(_batch("d"))] == [21.3, 21.35, 21.4]
+
+def test_packed_rejects_truncated():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import decode_batch
+    payload = _batch()
+    for cut in (3, 20, len(payload) - 1):
+        try:
+            decode_batch(payload[:cut])
+        except ValueError:
+            continue
+        raise AssertionError(f"Truncated payload ({cut} bytes) was accepted")
+
+def test_packed_rejects_bad_magic():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import decode_batch
+    try:
+        decode_batch(b"JSON" + _batch()[4:])
+    except ValueError:
+        return
+    raise AssertionError("Payload with wrong magic was accepted")
+
+def test_packed_smaller_than_json():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_packed import benchmark
+    result = benchmark(sensors=2, readings_per_sensor=100, repeat=1)
+    assert result["packed_i32"]["bytes"] * 5 < result["json"]["bytes"], result
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -0,0 +1,211 @@
+"""Phase 6.9 Test Plan: IoT Ingestion Gateway
+Tests pre-validation, topic parsing, HTTP micro-batching, backpressure, the publish socket,
+malformed request headers, device tokens and rate limiting.
+The gateway runs with an in-memory flush, so no database writes happen."""
+import frappe
+import asyncio
+import json
+import os
+import tempfile
+import threading
+
+def run_all_tests():
+    results = []
+    tests = [
+        test_prevalidate_codes,
+        test_parse_topic,
+        test_http_ingest_flushes_batch,
+        test_http_backpressure,
+        test_publish_socket,
+        test_invalid_content_length,
+        test_ingest_token_required,
+        test_rate_limited_upload,
+    ]
+    for test_fn in tests:
+        try:
+            test_fn()
+            results.append({"test": test_fn.__name__, "status": "PASS"})
+            print(f"  PASS: {test_fn.__name__}")
+        except Exception as e:
+            results.append({"test": test_fn.__name__, "status": "FAIL", "error": str(e)})
+            print(f"  FAIL: {test_fn.__name__} - {e}")
+    passed = sum(1 for r in results if r["status"] == "PASS")
+    print(f"\n=== Phase 6.9 Results: {passed}/{len(results)} passed ===")
+    return results
+
+TOKENS = {"RPi-1": "secret-1"}
+
+async def _post(port, body, authorization="token RPi-1:secret-1"):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    data = json.dumps(body).encode()
+    auth = f"Authorization: {authorization}\r\n" if authorization else ""
+    writer.write(b"POST /ingest HTTP/1.1\r\nHost: test\r\nConnection: close\r\n"
+                 + f"{auth}Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    return int(head.split(b" ")[1]), json.loads(payload)
+
+def _gateway(flush, **kwargs):
+    from rnd_warehouse_management.rnd_warehouse_management.iot_gateway import IngestGateway
+    kwargs.setdefault("token_loader", lambda: TOKENS)
+    return IngestGateway(flush, **kwargs)
+
+def test_prevalidate_codes():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_gateway import prevalidate
+    sensors = {"TEST-01": {"sensor_type": "DHT22"}}
+    assert prevalidate({"sensor_type": "DHT22", "temperature": 21.5}) is None
+    assert prevalidate({"sensor_type": "DHT22", "value": 21.5}) is None
+    assert prevalidate("x") == "invalid_row"
+    assert prevalidate({"temperature": 1}) == "missing_sensor_type"
+    assert prevalidate({"sensor_type": "DHT22", "temperature": "abc"}) == "non_numeric"
+    assert prevalidate({"sensor_type": "DHT22", "temperature": 999}) == "out_of_range"
+    assert prevalidate({"sensor_type": "DS18B20", "sensor_id": "TEST-01", "temperature": 20}, sensors) == "sensor_type_mismatch"
+
+def test_parse_topic():
+    from rnd_warehouse_management.rnd_warehouse_management.iot_gateway import parse_topic
+    assert parse_topic("sensors/RPi-1/DHT22/TEST-01") == {"sensor_type": "DHT22", "rpi_id": "RPi-1", "sensor_id": "TEST-01"}
+    try:
+        parse_topic("sensors/RPi-1")
+    except ValueError:
+        return
+    raise AssertionError("Short topic was accepted")
+
+def test_http_ingest_flushes_batch():
+    flushed = []
+
+    async def scenario():
+        gateway = _gateway(flushed.append, batch_size=100, max_wait_seconds=0.05)
+        server = (await gateway.start("127.0.0.1", 0))[0]
+        port = server.sockets[0].getsockname()[1]
+        rows = [{"sensor_type": "DHT22", "sensor_id": "TEST-01", "temperature": 20 + i * 0.1} for i in range(5)]
+        status, body = await _post(port, rows + [{"sensor_type": "DHT22", "temperature": 999}])
+        await gateway.stop()
+        return status, body
+
+    status, body = asyncio.run(scenario())
+    assert status == 202, body
+    assert body["queued"] == 5
+    assert body["rejected"] == [{"index": 5, "code": "out_of_range"}]
+    assert len(flushed) == 1 and len(flushed[0]) == 5
+
+def test_http_backpressure():
+    release = threading.Event()
+
+    async def scenario():
+        gateway = _gateway(lambda rows: release.wait(5), batch_size=1, max_wait_seconds=0.01, queue_size=2)
+        server = (await gateway.start("127.0.0.1", 0))[0]
+        port = server.sockets[0].getsockname()[1]
+        row = {"sensor_type": "DHT22", "temperature": 21.0}
+        first = await _post(port, [row])
+        await asyncio.sleep(0.05)  # batcher takes it and blocks in flush
+        second = await _post(port, [row, row])
+        third = await _post(port, [row])
+        release.set()
+        await gateway.stop()
+        return first, second, third
+
+    first, second, third = asyncio.run(scenario())
+    assert first[0] == 202 and second[0] == 202
+    assert third[0] == 503 and third[1]["retry_after"] > 0, third
+
+def test_publish_socket():
+    flushed = []
+    path = os.path.join(tempfile.mkdtemp(), "iot.sock")
+
+    async def scenario():
+        gateway = _gateway(flushed.append, batch_size=10, max_wait_seconds=0.05)
+        await gateway.start("127.0.0.1", 0, socket_path=path)
+        reader, writer = await asyncio.open_unix_connection(path)
+        replies = []
+        for line in ('PUB sensors/RPi-1/DHT22/TEST-01 {"temperature": 21.5}', "AUTH RPi-1 wrong",
+                     "AUTH RPi-1 secret-1", "PING", 'PUB sensors/RPi-2/DHT22/TEST-01 {"temperature": 21.5}',
+                     'PUB sensors/RPi-1/DHT22/TEST-01 {"temperature": 21.5}', "PUB bad {}"):
+            writer.write((line + "\n").encode())
+            await writer.drain()
+            replies.append((await reader.readline()).decode().strip())
+        writer.close()
+        await gateway.stop()
+        return replies
+
+    replies = asyncio.run(scenario())
+    # Nothing is accepted before AUTH, nor for another device's topic
+    assert replies == ["ERR unauthorized", "ERR unauthorized", "OK", "PONG", "ERR unauthorized",
+                       "OK 1", "ERR invalid_message"], replies
+    assert flushed[0][0]["rpi_id"] == "RPi-1"
+
+def test_invalid_content_length():
+    async def scenario():
+        gateway = _gateway(lambda rows: None)
+        server = (await gateway.start("127.0.0.1", 0))[0]
+        port = server.sockets[0].getsockname()[1]
+        statuses = []
+        for length in ("abc", "-5"):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(f"POST /ingest HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            statuses.append(int(response.split(b" ")[1]))
+        await gateway.stop()
+        return statuses
+
+    assert asyncio.run(scenario()) == [400, 400]
+
+def test_ingest_token_required():
+    flushed = []
+
+    async def scenario():
+        gateway = _gateway(flushed.append, batch_size=10, max_wait_seconds=0.05)
+        server = (await gateway.start("127.0.0.1", 0))[0]
+        port = server.sockets[0].getsockname()[1]
+        row = {"sensor_type": "DHT22", "temperature": 21.0}
+        responses = [
+            await _post(port, [row], authorization=None),
+            await _post(port, [row], authorization="token RPi-1:wrong"),
+            await _post(port, [row], authorization="token RPi-9:secret-1"),
+            await _post(port, {"rpi_id": "RPi-2", "readings": [row]}),
+            await _post(port, [row, dict(row, rpi_id="RPi-2")]),
+        ]
+        await gateway.stop()
+        return responses
+
+    responses = asyncio.run(scenario())
+    assert [status for status, _body in responses] == [401, 401, 401, 401, 202], responses
+    # A row naming another device is rejected; the rest is stored under the token's device
+    assert responses[-1][1]["rejected"] == [{"index": 1, "code": "rpi_id_mismatch"}]
+    assert [row["rpi_id"] for batch in flushed for row in batch] == ["RPi-1"]
+
+def test_rate_limited_upload():
+    flushed, calls = [], []
+    path = os.path.join(tempfile.mkdtemp(), "iot.sock")
+
+    def limiter(rows, rpi_id):
+        calls.append((len(rows), rpi_id))
+        if len(calls) > 1:
+            return {"error": "Rate limit exceeded for rpi RPi-1", "code": "rate_limited", "retry_after": 3}
+
+    async def scenario():
+        gateway = _gateway(flushed.append, rate_limiter=limiter, batch_size=10, max_wait_seconds=0.05)
+        server = (await gateway.start("127.0.0.1", 0, socket_path=path))[0]
+        port = server.sockets[0].getsockname()[1]
+        row = {"sensor_type": "DHT22", "temperature": 21.0}
+        first = await _post(port, [row, row])
+        second = await _post(port, [row])
+        reader, writer = await asyncio.open_unix_connection(path)
+        writer.write(b'AUTH RPi-1 secret-1\nPUB sensors/RPi-1/DHT22/TEST-01 {"temperature": 21.5}\n')
+        await writer.drain()
+        replies = [(await reader.readline()).decode().strip() for _ in range(2)]
+        writer.close()
+        await gateway.stop()
+        return first, second, replies
+
+    first, second, replies = asyncio.run(scenario())
+    assert first[0] == 202 and second[0] == 429 and second[1]["retry_after"] == 3, second
+    assert replies == ["OK", "ERR rate_limited 3"], replies
+    # Throttled rows never reach the queue
+    assert calls[0] == (2, "RPi-1") and sum(len(batch) for batch in flushed) == 2
+
+if __name__ == "__main__":
+    run_all_tests()
@@ -103,9 +103,24 @@ def evaluate_temperature_status(current_temp, min_temp, max_temp):
 
 def get_latest_iot_reading(warehouse_name):
     """Bridge to IoT Sensor Reading doctype (Phase 6)
-    Returns the latest temperature reading for a warehouse sensor"""
+    Returns the latest temperature reading for a warehouse sensor.
+    Warehouses with sensors registered on an IoT Device are answered from
+    the pipeline's latest-value rings; others still query the readings."""
     if not frappe.db.exists("DocType", "IoT Sensor Reading"):
         return None
+    from rnd_warehouse_management.rnd_warehouse_management.iot_pipeline import (
+        get_sensor_ids, get_recent_readings, SENSOR_RANGES)
+
+    if get_sensor_ids(warehouse=warehouse_name):
+        # The warehouse ring holds every sensor type registered there; only
+        # a temperature sensor's value is the warehouse temperature
+        latest = next((r for r in get_recent_readings(warehouse=warehouse_name)
+                       if r.temperature is not None
+                       and (SENSOR_RANGES.get(r.sensor_type) or {}).get("unit") == "C"), None)
+        if not latest:
+            return None
+        return frappe._dict(reading_value=latest.temperature, timestamp=latest.reading_time,
+                            sensor_id=latest.sensor_id)
     reading = frappe.get_all("IoT Sensor Reading", filters={
         "sensor_location": warehouse_name,
         "reading_type": "Temperature"